@@ -0,0 +1,328 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+# pandas and sklearn are imported inside the training functions; serving runs on numpy and the flat forest
+
+from file_versions import file_fingerprint, file_stamp, write_atomic
+from flat_forest import FlatForest
+from shared_artifacts import load_arrays
+
+
+TRAINING_DATA_PATH = "pet_adoption_data.csv"
+MODELS_DIR = "models"
+
+# Everything that changes how the training CSV is turned into a model.
+# Editing any of these values produces a new artifact key, so a stale model is never reused.
+FEATURE_SPEC = {
+    "version": 1,
+    "features": ['age_group', 'PetType', 'Size', 'shelter_period_category', 'HealthCondition', 'AdoptionFee', 'PreviousOwner'],
+    "target": "AdoptionLikelihood",
+    "pet_type_map": {"Bird": 0, "Rabbit": 1, "Dog": 2, "Cat": 3},
+    "size_map": {"Small": 0, "Large": 2, "Medium": 1},
+    "shelter_days_threshold": 30,
+    "age_bins": [0, 6, 18, 60, "inf"],
+    "age_labels": [0, 1, 2, 3],
+    "test_size": 0.2,
+    "random_state": 42,
+}
+# Used when the app has to train a model itself; train_model.py publishes tuned ones under the same key
+DEFAULT_MODEL_PARAMS = {"random_state": 42}
+
+_models = {}
+_flat_forests = {}
+_lock = threading.RLock()
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_training_data(train_csv, spec=FEATURE_SPEC):
+    import pandas as pd
+    train_csv = train_csv.drop("PetID", axis=1)
+    train_csv["PetType"] = train_csv["PetType"].map(spec["pet_type_map"])
+    train_csv["Size"] = train_csv["Size"].map(spec["size_map"])
+    threshold = spec["shelter_days_threshold"]
+    train_csv['shelter_period_category'] = np.where(train_csv['TimeInShelterDays'] > threshold, 0, 1)
+    bins = [float(b) for b in spec["age_bins"]]
+    train_csv['age_group'] = pd.cut(train_csv['AgeMonths'], bins=bins, labels=spec["age_labels"], right=True)
+    target = train_csv[spec["target"]]
+    features = train_csv[spec["features"]]
+    return features, target
+
+
+def artifact_key(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC):
+    # Content hash of the training data plus the feature spec
+    digest = hashlib.sha256(file_fingerprint(csv_path).encode())
+    digest.update(json.dumps(spec, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def artifact_path(key):
+    return os.path.join(MODELS_DIR, f"adoption_model-{key}.pkl")
+
+
+def flat_artifact_path(key):
+    return os.path.join(MODELS_DIR, f"adoption_model-{key}.flat.npz")
+
+
+def split_training_data(X, y, spec=FEATURE_SPEC):
+    # The same holdout split everywhere, so reported scores are comparable
+    from sklearn.model_selection import train_test_split
+    return train_test_split(X, y, test_size=spec["test_size"], random_state=spec["random_state"])
+
+
+def train_adoption_model(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC, params=DEFAULT_MODEL_PARAMS):
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    X, y = prepare_training_data(pd.read_csv(csv_path), spec)
+    X_train, X_test, y_train, y_test = split_training_data(X, y, spec)
+
+    model = RandomForestClassifier(**params)
+    model.fit(X_train, y_train)
+    return model
+
+
+def save_artifact(artifact, key):
+    return write_atomic(artifact_path(key), lambda f: pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_artifact(key):
+    path = artifact_path(key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        artifact = pickle.load(f)
+    if artifact.get("key") != key:
+        return None
+    return artifact
+
+
+def publish_model(model, key, spec=FEATURE_SPEC, **details):
+    # Writes the estimator and its flat form; running processes notice the new files and switch over
+    artifact = dict(details, key=key, feature_spec=spec, trained_at=time.time(), model=model)
+    save_artifact(artifact, key)
+    forest = FlatForest.from_sklearn(model)
+    write_atomic(flat_artifact_path(key), lambda f: np.savez(f, **forest.arrays()))
+    return artifact
+
+
+def stamp_or_none(path):
+    return file_stamp(path) if os.path.exists(path) else None
+
+
+def load_adoption_model(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC):
+    key = artifact_key(csv_path, spec)
+    stamp = stamp_or_none(artifact_path(key))
+    cached = _models.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with _lock:
+        artifact = load_artifact(key)
+        if artifact is None:
+            artifact = publish_model(train_adoption_model(csv_path, spec), key, spec, params=DEFAULT_MODEL_PARAMS)
+
+        # Only the current version stays resident
+        _models.clear()
+        _models[key] = (file_stamp(artifact_path(key)), artifact["model"])
+        return artifact["model"]
+
+
+def load_flat_model(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC):
+    # (version, forest): the inference-only form of the model, without keeping the sklearn estimator resident
+    key = artifact_key(csv_path, spec)
+    path = flat_artifact_path(key)
+    stamp = stamp_or_none(path)
+    cached = _flat_forests.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with _lock:
+        if stamp is None:
+            forest = FlatForest.from_sklearn(load_adoption_model(csv_path, spec))
+            write_atomic(path, lambda f: np.savez(f, **forest.arrays()))
+        else:
+            forest = FlatForest.from_arrays(load_arrays(path))
+
+        stamp = file_stamp(path)
+        version = f"{key}-{stamp[0]}"
+        _flat_forests.clear()
+        _flat_forests[key] = (stamp, (version, forest))
+        return version, forest
+
+
+def resident_flat_model(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC):
+    # (version, forest) when the current version is already loaded, else None; never reads or trains a model
+    key = artifact_key(csv_path, spec)
+    cached = _flat_forests.get(key)
+    if cached is not None and cached[0] == stamp_or_none(flat_artifact_path(key)):
+        return cached[1]
+    return None
+
+
+def load_flat_forest(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC):
+    return load_flat_model(csv_path, spec)[1]
+
+
+def model_version(csv_path=TRAINING_DATA_PATH, spec=FEATURE_SPEC):
+    return load_flat_model(csv_path, spec)[0]
+
+def pet_features(row):
+    # One pet from cats_and_dogs.json in the feature order of FEATURE_SPEC.
+    # Missing fields (None or absent, e.g. from a partial delta) encode like an unrecognised value.
+    age = row.get('age')
+    age_group = 0 if age == 'Baby' else 1 if age == 'Young' else 2 if age == 'Adult' else 3 if age == 'Senior' else -1
+    pet_type = 3 if row.get('pet_type') == 'Cat' else 2
+    size = 0 if row.get('size') == 'Small' else 1 if row.get('size') == 'Medium' else 2
+    shelter_period_category = 0 if '>30' in (row.get('days_on_petfinder') or '') else 1
+    health_condition = 0 if row.get('medical_care') == 'no special needs' else 1
+    adoption_fee = row.get('adoption_fee') if row.get('adoption_fee') is not None else 0
+    previous_owner = 1 if 'House trained' in (row.get('characteristics') or ()) else 0
+    return [age_group, pet_type, size, shelter_period_category, health_condition, adoption_fee, previous_owner]
+
+
+def encode_pets(pets, spec=FEATURE_SPEC):
+    return np.array([pet_features(pet) for pet in pets], dtype=np.float64).reshape(len(pets), len(spec["features"]))
+
+
+def predict_adoption(features, spec=FEATURE_SPEC):
+    # Adoption probability for every row of an encoded feature matrix, in one predict_proba call
+    if len(features) == 0:
+        return np.empty(0, dtype=np.float64)
+    return adoption_probabilities(load_flat_forest(spec=spec), features)
+
+
+def adoption_probabilities(forest, features):
+    return forest.predict_proba(features)[:, list(forest.classes).index(1)]
+
+
+class CatalogScores:
+    # Adoption probability of every pet in a catalog store, kept next to its rows.
+    # Scored in one batch up front; afterwards only pets whose features changed are rescored,
+    # and everything is rescored when a new model version appears. The store lock is never held while a
+    # model is loaded or trained: delta batches only score with a model that is already resident.
+
+    def __init__(self, store):
+        self.store = store
+        self.model_version = None
+        self.features = np.empty((0, len(FEATURE_SPEC["features"])), dtype=np.float64)
+        self.probabilities = np.empty(0, dtype=np.float64)
+        self._lock = threading.RLock()
+        store.subscribe(self.on_catalog_change, lambda store: self.invalidate())
+        self.rescore_all()
+
+    def invalidate(self):
+        # Called under the store lock: everything is rescored on the next lookup, outside it
+        with self._lock:
+            self.model_version = None
+
+    def rescore_all(self):
+        # The model is loaded (or trained) first; the locks only cover encoding the features and writing back
+        # the probabilities. Rows a delta batch changed in between keep the scores the listener gave them.
+        version, forest = load_flat_model()
+        with self.store.lock, self._lock:
+            records = self.store.records
+            features = np.full((len(records), self.features.shape[1]), np.nan)
+            live = [row for row, record in enumerate(records) if record is not None]
+            if live:
+                features[live] = [self.encode(records[row]) for row in live]
+            self.resize(len(records))
+            self.features[:len(features)] = features
+
+        probabilities = np.full(len(features), np.nan)
+        scored = np.flatnonzero(~np.isnan(features).any(axis=1))
+        if len(scored):
+            probabilities[scored] = adoption_probabilities(forest, features[scored])
+
+        with self._lock:
+            current = self.features[:len(features)]
+            unchanged = ((current == features) | np.isnan(current) & np.isnan(features)).all(axis=1)
+            self.probabilities[:len(features)][unchanged] = probabilities[unchanged]
+            self.model_version = version
+
+    def resize(self, size):
+        grow = size - len(self.probabilities)
+        if grow > 0:
+            self.features = np.vstack([self.features, np.full((grow, self.features.shape[1]), np.nan)])
+            self.probabilities = np.concatenate([self.probabilities, np.full(grow, np.nan)])
+
+    def encode(self, record):
+        # Features of one pet, all NaN (unscored) when its values can't be encoded
+        try:
+            return np.array(pet_features(record), dtype=np.float64)
+        except (TypeError, ValueError):
+            logger.warning("Can't score pet %r: unexpected feature values", record.get('pet_id'), exc_info=True)
+            return np.full(self.features.shape[1], np.nan)
+
+    def on_catalog_change(self, store, rows):
+        # Never raises into the store's delta batch: a pet that can't be encoded is left unscored (NaN), and
+        # a failed prediction, or no model loaded yet, leaves its rows unscored and has everything rescored
+        # on the next lookup
+        with self._lock:
+            self.resize(len(store.records))
+            changed = []
+            for row in rows:
+                record = store.records[row]
+                if record is None:
+                    self.features[row] = np.nan
+                    self.probabilities[row] = np.nan
+                    continue
+                features = self.encode(record)
+                if np.array_equal(self.features[row], features, equal_nan=True):
+                    continue
+                self.features[row] = features
+                self.probabilities[row] = np.nan
+                if not np.isnan(features).any():
+                    changed.append(row)
+
+            if changed:
+                model = resident_flat_model()
+                if model is None:
+                    self.model_version = None
+                    return
+                try:
+                    self.probabilities[changed] = adoption_probabilities(model[1], self.features[changed])
+                except Exception:
+                    logger.exception("Scoring %d changed pets failed, rescoring the catalog on the next lookup", len(changed))
+                    self.model_version = None
+
+    def ensure_current(self):
+        if model_version() != self.model_version:
+            self.rescore_all()
+
+    def probability(self, row):
+        self.ensure_current()
+        with self._lock:
+            return float(self.probabilities[row])
+
+    def rank(self, rows, max_probability=None, sort_by_risk=False):
+        # Filters rows to those below max_probability and/or orders them lowest adoption chance first
+        self.ensure_current()
+        with self._lock:
+            rows = np.asarray(rows, dtype=np.int32)
+            probabilities = self.probabilities[rows]
+        if max_probability is not None:
+            keep = probabilities < max_probability
+            rows, probabilities = rows[keep], probabilities[keep]
+        if sort_by_risk:
+            rows = rows[np.argsort(probabilities, kind='stable')]
+        return rows
+
+
+_scores = []
+_scores_lock = threading.Lock()
+
+
+def catalog_scores(store):
+    # Scores for the current catalog store; a reloaded store gets scored afresh
+    with _scores_lock:
+        if _scores and _scores[0].store is store:
+            return _scores[0]
+        scores = CatalogScores(store)
+        _scores[:] = [scores]
+        return scores
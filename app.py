@@ -1,6 +1,5 @@
 
 import streamlit as st
-from PIL import Image
 from functions import *
 
 st.set_page_config(layout="wide")
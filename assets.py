@@ -0,0 +1,72 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+
+import streamlit as st
+
+from file_versions import file_stamp, write_atomic
+
+
+# Streamlit serves this folder (next to app.py) at app/static/ when server.enableStaticServing is on
+STATIC_DIR = 'static'
+STATIC_URL = 'app/static'
+# Images above this size are linked as static files instead of being inlined into every page
+INLINE_LIMIT = 16 * 1024
+
+_assets = {}
+_lock = threading.Lock()
+
+
+def cached_asset(kind, path, build):
+    # Each static asset is read and encoded once per process, keyed by path and mtime
+    stamp = file_stamp(path)
+    cached = _assets.get((kind, path))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    value = build(path)
+    with _lock:
+        _assets[(kind, path)] = (stamp, value)
+    return value
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_text(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def base64_asset(path):
+    return cached_asset('base64', path, lambda p: base64.b64encode(read_bytes(p)).decode())
+
+
+def data_uri(path):
+    mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return cached_asset('data_uri', path, lambda p: f"data:{mime};base64,{base64_asset(p)}")
+
+
+def svg_asset(path):
+    return cached_asset('svg', path, read_text)
+
+
+def publish_static(path):
+    # Copies the file under a content-addressed name, so browsers can cache it forever
+    content = read_bytes(path)
+    name = hashlib.sha256(content).hexdigest()[:16] + os.path.splitext(path)[1].lower()
+    target = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(target):
+        write_atomic(target, lambda f: f.write(content))
+    return f"{STATIC_URL}/{name}"
+
+
+def image_src(path):
+    # Ready-made <img src>: small icons inline, large images as static files when static serving is enabled
+    if os.path.getsize(path) > INLINE_LIMIT and st.get_option('server.enableStaticServing'):
+        return cached_asset('static', path, publish_static)
+    return data_uri(path)
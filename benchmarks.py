@@ -0,0 +1,263 @@
+# Benchmarks for the search, prediction and recommendation hot paths on synthetic data.
+#
+#   python benchmarks.py --scales 1000,100000 --output bench.json
+#   python benchmarks.py --baseline bench.json --threshold 0.25     (exit code 1 on regressions)
+#
+# Catalogs in the cats_and_dogs.json schema and surveys in the survey_results_modified.xlsx schema are
+# generated once per scale under .cache/bench/<scale>/ by sampling the values of the bundled files.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import adoption_model
+import catalog
+import functions
+import matching
+import pet_db
+import recommender
+import similar_pets
+import text_search
+
+
+BENCH_DIR = os.path.join('.cache', 'bench')
+DEFAULT_SCALES = [1000, 100000, 1000000]
+SEARCH_CRITERIAS = dict(pet_type='Cat', primary_breed='Any', age='Adult', gender='Female', size='Any', coat_length='Any', medical_care='Any')
+BATCH_SIZE = 100
+TEXT_QUERY = "calm senior cat good with kids"
+ADOPTER = {'age': 29, 'gender': 'Female', 'living': 'Apartment', 'activity': 7.0, 'experience': 'Experienced', 'type': 'Cat',
+           'gender_pet': 'Any', 'size_pet': 'Any', 'age_pet': 'Young', 'vaccine_pet': "Yes, i'm ready to take only vaccinated pet",
+           'allergies_pet': 'No', 'shelter_time': 1, 'special_needs?': 'No'}
+
+
+def generate_catalog(size, rng, description_chars=300):
+    template = catalog.read_catalog(os.path.abspath(catalog.CATALOG_PATH))
+    columns = {field: [pet[field] for pet in template] for field in catalog.FIELDS}
+    picks = {field: rng.integers(0, len(template), size) for field in catalog.FIELDS}
+
+    pets = []
+    for i in range(size):
+        pet = {field: columns[field][picks[field][i]] for field in catalog.FIELDS}
+        pet['pet_id'] = 80000000 + i
+        if pet['description']:
+            pet['description'] = pet['description'][:description_chars]
+        pets.append(pet)
+    return pets
+
+
+def generate_survey(size, rng):
+    template = pd.read_excel(os.path.abspath(recommender.SURVEY_PATH))
+    survey = pd.DataFrame({column: template[column].to_numpy()[rng.integers(0, len(template), size)] for column in template.columns})
+    survey['age'] = rng.integers(19, 53, size)
+    return survey
+
+
+def prepare_scale(scale, seed=42):
+    # Working directory with the synthetic catalog/survey plus the real training data and model artifacts
+    directory = os.path.join(BENCH_DIR, str(scale))
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    catalog_path = os.path.join(directory, catalog.CATALOG_PATH)
+    if not os.path.exists(catalog_path):
+        with open(catalog_path, 'w') as f:
+            json.dump(generate_catalog(scale, rng), f)
+
+    survey_path = os.path.join(directory, recommender.SURVEY_PATH)
+    if not os.path.exists(survey_path):
+        generate_survey(scale, rng).to_excel(survey_path, index=False)
+
+    shutil.copyfile(adoption_model.TRAINING_DATA_PATH, os.path.join(directory, adoption_model.TRAINING_DATA_PATH))
+    models_link = os.path.join(directory, adoption_model.MODELS_DIR)
+    if not os.path.exists(models_link):
+        os.makedirs(adoption_model.MODELS_DIR, exist_ok=True)
+        os.symlink(os.path.abspath(adoption_model.MODELS_DIR), models_link)
+    return directory
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def measure(run, warmup, repeat, setup=None):
+    for _ in range(warmup):
+        if setup:
+            setup()
+        run()
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+
+    # Memory peak from one extra, separately traced run so tracing doesn't skew the timings
+    if setup:
+        setup()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings_ms = np.array(timings) * 1000
+    return {
+        "repeat": repeat,
+        "min_ms": float(timings_ms.min()),
+        "median_ms": float(np.median(timings_ms)),
+        "mean_ms": float(timings_ms.mean()),
+        "p95_ms": float(np.percentile(timings_ms, 95)),
+        "peak_memory_mb": peak / 1e6,
+    }
+
+
+def clear_catalog_cache():
+    catalog._stores.clear()
+
+
+def clear_survey_cache():
+    recommender._encoded_surveys.clear()
+
+
+def wait_for_similar_pets():
+    # The lists are built in the background: time the lookup, not an empty answer while they are building
+    similar_pets.similar_pets(catalog.catalog_store()).wait()
+
+
+def hot_paths():
+    # name -> (run, setup); every run works on the files of the current working directory
+    state = {}
+
+    def search_store():
+        return catalog.catalog_store().search(**SEARCH_CRITERIAS)
+
+    def find_pets_list():
+        if 'pets' not in state:
+            state['pets'] = functions.read_pets_file()
+        return functions.find_pets(state['pets'], **SEARCH_CRITERIAS)
+
+    def find_pets_db():
+        if 'db' not in state:
+            exists = os.path.exists(pet_db.DB_PATH)
+            state['db'] = pet_db.PetDatabase(pet_db.DB_PATH)
+            if not exists:
+                state['db'].import_json()
+        return state['db'].find_pets(**SEARCH_CRITERIAS)
+
+    def sample_pets():
+        store = catalog.catalog_store()
+        return [store.record(row) for row in store.index.all_rows[:BATCH_SIZE]]
+
+    return {
+        "read_pets_file": (functions.read_pets_file, None),
+        "catalog_store_cold": (catalog.catalog_store, clear_catalog_cache),
+        "catalog_store_warm": (catalog.catalog_store, None),
+        "find_pets": (find_pets_list, None),
+        "catalog_search": (search_store, None),
+        "find_pets_sqlite": (find_pets_db, None),
+        "catalog_search_uncached": (search_store, lambda: catalog.catalog_store().search_cache.clear()),
+        "facet_counts": (lambda: catalog.catalog_store().facet_counts(**SEARCH_CRITERIAS), None),
+        "facet_counts_uncached": (lambda: catalog.catalog_store().facet_counts(**SEARCH_CRITERIAS), lambda: catalog.catalog_store().search_cache.clear()),
+        "load_data": (recommender.load_data, None),
+        "load_encoded_survey_cold": (recommender.load_encoded_survey, clear_survey_cache),
+        "recommendation_engine": (lambda: functions.recommendation_engine(sample_pets()[0]), None),
+        f"recommend_owners_x{BATCH_SIZE}": (lambda: recommender.recommend_owners(sample_pets()), None),
+        "prediction_model_result": (lambda: functions.prediction_model_result(sample_pets()[0]), None),
+        "match_pets": (lambda: matching.match_pets(catalog.catalog_store(), ADOPTER, 10, pet_type='Cat'), None),
+        "similar_pets": (lambda: similar_pets.similar_pets(catalog.catalog_store()).similar(0), wait_for_similar_pets),
+        "text_search": (lambda: text_search.text_index(catalog.catalog_store()).search(TEXT_QUERY), None),
+        f"predict_adoption_x{BATCH_SIZE}": (lambda: adoption_model.predict_adoption(adoption_model.encode_pets(sample_pets())), None),
+    }
+
+
+def run_benchmarks(scales, warmup=1, repeat=5, only=None):
+    results = {}
+    for scale in scales:
+        directory = prepare_scale(scale)
+        clear_catalog_cache()
+        clear_survey_cache()
+        with working_directory(directory):
+            results[str(scale)] = {}
+            for name, (run, setup) in hot_paths().items():
+                if only and name not in only:
+                    continue
+                results[str(scale)][name] = measure(run, warmup, repeat, setup)
+                print(f"{scale:>9} {name:<28} {results[str(scale)][name]['median_ms']:10.3f} ms", file=sys.stderr)
+    return {
+        "meta": {
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    # Median-time regressions beyond the threshold (0.2 = 20% slower than the baseline)
+    regressions = []
+    for scale, benchmarks in report["results"].items():
+        for name, result in benchmarks.items():
+            previous = baseline.get("results", {}).get(scale, {}).get(name)
+            if previous is None or previous["median_ms"] <= 0:
+                continue
+            ratio = result["median_ms"] / previous["median_ms"]
+            result["baseline_median_ms"] = previous["median_ms"]
+            result["ratio"] = ratio
+            if ratio > 1 + threshold:
+                regressions.append({"scale": scale, "benchmark": name, "ratio": ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the 4Paws hot paths on synthetic catalogs and surveys.")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="comma-separated row counts (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="comma-separated benchmark names to run")
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed median slowdown vs. the baseline (default: %(default)s)")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    only = set(args.only.split(",")) if args.only else None
+    report = run_benchmarks(scales, args.warmup, args.repeat, only)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['scale']} {regression['benchmark']}: {regression['ratio']:.2f}x slower", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,623 @@
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from file_versions import file_stamp
+from instrumentation import timed
+from shared_artifacts import SHARED_ARTIFACTS
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = 'cats_and_dogs.json'
+# Append-only feed of {"op": "add" | "update" | "remove", "pet_id": ..., "pet": {...}} events next to the catalog
+DELTA_SUFFIX = '.delta.jsonl'
+
+# Record schema of cats_and_dogs.json
+FIELDS = ('pet_id', 'breeds_label', 'pet_name', 'pet_type', 'primary_breed', 'secondary_breed', 'mixed_breed', 'age',
+          'gender', 'characteristics', 'size', 'primary_color', 'secondary_color', 'coat_length', 'good_with', 'image_url',
+          'tags', 'adoption_fee', 'description', 'twitter_url', 'pinterest_url', 'facebook_url', 'medical_care',
+          'days_on_petfinder')
+# Low-cardinality strings shared between records instead of copied per pet
+CATEGORICAL_FIELDS = ('breeds_label', 'pet_type', 'primary_breed', 'secondary_breed', 'age', 'gender', 'size',
+                      'primary_color', 'secondary_color', 'coat_length', 'medical_care', 'days_on_petfinder')
+LIST_FIELDS = ('characteristics', 'tags')
+# Long text kept compressed and only decoded when a page actually shows it
+LONG_FIELDS = ('description', 'twitter_url', 'pinterest_url', 'facebook_url')
+# Distinct filter combinations whose results are kept, shared by all sessions
+SEARCH_CACHE_SIZE = 256
+# Serve the catalog from this SQLite database (see pet_db.py) instead of CATALOG_PATH
+CATALOG_DB = os.environ.get('FOURPAWS_CATALOG_DB')
+
+
+def normalize(value):
+    return str(value).lower()
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def pack_text(value):
+    return None if value is None else zlib.compress(value.encode())
+
+
+def unpack_text(value):
+    return None if value is None else zlib.decompress(value).decode()
+
+
+class PetRecord:
+    # Compact, read-only pet record that still reads like the original dict: pet["age"], pet.get("size"), "tags" in pet
+    __slots__ = tuple(field for field in FIELDS if field not in LONG_FIELDS) + tuple(f"_{field}" for field in LONG_FIELDS) + ('extra',)
+
+    @classmethod
+    def from_dict(cls, pet):
+        record = cls()
+        for field in FIELDS:
+            value = pet.get(field)
+            if field in CATEGORICAL_FIELDS:
+                value = intern_value(value)
+            elif field in LIST_FIELDS:
+                value = tuple(intern_value(item) for item in value or ())
+            if field in LONG_FIELDS:
+                setattr(record, f"_{field}", pack_text(value))
+            else:
+                setattr(record, field, value)
+        record.extra = {key: value for key, value in pet.items() if key not in FIELDS} or None
+        return record
+
+    def __getitem__(self, key):
+        if key in LONG_FIELDS:
+            return unpack_text(getattr(self, f"_{key}"))
+        if key in FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in FIELDS or bool(self.extra and key in self.extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(FIELDS) + list(self.extra or ())
+
+    def to_dict(self):
+        pet = {key: self[key] for key in self.keys()}
+        for field in LIST_FIELDS:
+            pet[field] = list(pet[field])
+        return pet
+
+
+def intersect_sorted(small, large):
+    # Keeps the entries of `small` that also appear in `large`; both are sorted id arrays
+    if len(small) == 0 or len(large) == 0:
+        return small[:0]
+    positions = np.searchsorted(large, small)
+    positions[positions == len(large)] = len(large) - 1
+    return small[large[positions] == small]
+
+
+def field_keys(pet, field):
+    if pet is None or field not in pet:
+        return set()
+    value = pet[field]
+    if isinstance(value, (list, tuple)):
+        return {item.lower() for item in value}
+    return {normalize(value)}
+
+
+def merge_postings(ids, removed, added):
+    if removed:
+        ids = ids[~np.isin(ids, removed)]
+    if added:
+        ids = np.union1d(ids, np.array(added, dtype=np.int32)).astype(np.int32)
+    return ids
+
+
+class PetIndex:
+    # Inverted index over a list of pet records: field -> normalized value -> sorted array of positions.
+    # List-valued fields (characteristics, tags) are indexed per element, removed pets (None) are skipped.
+    # Fields are indexed lazily, the first time a query filters on them.
+    # Pets held as columns (catalog_columns.py) bring their own row list and postings.
+
+    def __init__(self, pets):
+        self.pets = pets
+        self.postings = {}
+        self.codes = {}
+        self.live = None
+        if hasattr(pets, 'all_rows'):
+            self.all_rows = pets.all_rows()
+        else:
+            self.all_rows = np.array([row for row, pet in enumerate(pets) if pet is not None], dtype=np.int32)
+        self._lock = threading.RLock()
+
+    def field_postings(self, field):
+        postings = self.postings.get(field)
+        if postings is not None:
+            return postings
+
+        with self._lock:
+            if field in self.postings:
+                return self.postings[field]
+            if hasattr(self.pets, 'field_postings'):
+                postings = self.pets.field_postings(field)
+                if postings is not None:
+                    self.postings[field] = postings
+                    return postings
+
+            ids = {}
+            for position, pet in enumerate(self.pets):
+                for key in field_keys(pet, field):
+                    ids.setdefault(key, []).append(position)
+
+            postings = {key: np.array(positions, dtype=np.int32) for key, positions in ids.items()}
+            self.postings[field] = postings
+            return postings
+
+    def field_codes(self, field):
+        # (keys, codes) for a single-valued field: codes[row] is the row's value as a position in keys,
+        # len(keys) if missing. Built from the posting arrays, so counting values over a set of rows is one bincount.
+        codes = self.codes.get(field)
+        if codes is not None:
+            return codes
+
+        with self._lock:
+            postings = self.field_postings(field)
+            keys = list(postings)
+            column = np.full(len(self.pets), len(keys), dtype=np.int32)
+            for code, key in enumerate(keys):
+                column[postings[key]] = code
+            self.codes[field] = (keys, column)
+            return keys, column
+
+    def live_rows(self):
+        # Boolean mask of the rows that hold a pet (not removed)
+        if self.live is None:
+            with self._lock:
+                live = np.zeros(len(self.pets), dtype=bool)
+                live[self.all_rows] = True
+                self.live = live
+        return self.live
+
+    def facet_counts(self, fields, **criterias):
+        # One pass over the value codes of the filtered fields instead of a search per field: a row matching
+        # every filter counts towards all fields, a row failing only the filter on field f counts towards f.
+        # Single-valued fields only.
+        with self._lock:
+            mismatches = {}
+            misses = np.where(self.live_rows(), 0, len(criterias) + 1).astype(np.int8)
+            for field, value in criterias.items():
+                value = normalize(value)
+                if value == 'any':
+                    continue
+                keys, codes = self.field_codes(field)
+                mismatches[field] = codes != (keys.index(value) if value in keys else -1)
+                misses += mismatches[field]
+
+            counts = {}
+            matching_all = misses == 0
+            for field in fields:
+                keys, codes = self.field_codes(field)
+                selected = matching_all if field not in mismatches else misses == mismatches[field]
+                # Weighting by the mask avoids gathering the selected rows first, which is several times slower
+                tally = np.bincount(codes, weights=selected, minlength=len(keys) + 1)
+                counts[field] = {value: int(count) for value, count in zip(keys, tally) if count}
+                counts[field]['any'] = int(tally.sum())
+            return counts
+
+    def update(self, changes):
+        # changes: (row, old record or None, new record or None); only the touched posting arrays are rebuilt
+        with self._lock:
+            removed_rows = [row for row, old, new in changes if old is not None and new is None]
+            added_rows = [row for row, old, new in changes if old is None and new is not None]
+            self.all_rows = merge_postings(self.all_rows, removed_rows, added_rows)
+            # Rebuilt from the updated postings on the next facet count
+            self.codes = {}
+            self.live = None
+
+            for field, postings in self.postings.items():
+                removed = {}
+                added = {}
+                for row, old, new in changes:
+                    old_keys = field_keys(old, field)
+                    new_keys = field_keys(new, field)
+                    for key in old_keys - new_keys:
+                        removed.setdefault(key, []).append(row)
+                    for key in new_keys - old_keys:
+                        added.setdefault(key, []).append(row)
+
+                for key in set(removed) | set(added):
+                    ids = merge_postings(postings.get(key, np.empty(0, dtype=np.int32)), removed.get(key), added.get(key))
+                    if len(ids):
+                        postings[key] = ids
+                    else:
+                        postings.pop(key, None)
+
+    def search(self, **criterias):
+        # Positions of matching pets, in catalog order; 'any' leaves a field unfiltered
+        selected = []
+        for key, value in criterias.items():
+            if value.lower() == 'any':
+                continue
+            selected.append(self.field_postings(key).get(normalize(value), np.empty(0, dtype=np.int32)))
+
+        if not selected:
+            return self.all_rows
+
+        selected.sort(key=len)
+        result = selected[0]
+        for ids in selected[1:]:
+            result = intersect_sorted(result, ids)
+        return result
+
+
+def search_key(criterias):
+    # Normalized criteria: case-insensitive values, 'any' fields dropped, order of arguments ignored
+    return tuple(sorted((field, normalize(value)) for field, value in criterias.items() if normalize(value) != 'any'))
+
+
+class SearchCache:
+    # Bounded LRU of search results keyed by search_key. The owning store clears it whenever
+    # the catalog changes, so an entry is always the result for the current catalog version.
+
+    def __init__(self, capacity=SEARCH_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            rows = self.entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, key, rows):
+        with self._lock:
+            self.entries[key] = rows
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_indexes = []
+_indexes_lock = threading.Lock()
+
+
+def pet_index(pets):
+    # The index for the pet list last searched; the catalog is treated as read-only while indexed
+    with _indexes_lock:
+        if _indexes and _indexes[0].pets is pets:
+            return _indexes[0]
+        index = PetIndex(pets)
+        _indexes[:] = [index]
+        return index
+
+
+def read_delta_events(path, offset):
+    # New complete lines of an append-only JSON Lines feed, starting at a byte offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b'\n') + 1
+
+    events = []
+    for line in chunk[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            logger.warning("Skipping malformed catalog delta line: %r", line[:200])
+    return events, offset + end
+
+
+def check_event(event):
+    # The event with its pet checked against the record schema; ValueError when it can't be applied.
+    # Fields an add leaves out are missing (None), like in the catalog file.
+    if not isinstance(event, dict):
+        raise ValueError("not an object")
+    op = event.get('op')
+    if op not in ('add', 'update', 'remove'):
+        raise ValueError(f"unknown op {op!r}")
+    pet_id = event.get('pet_id')
+    if not isinstance(pet_id, (int, str)) or isinstance(pet_id, bool):
+        raise ValueError(f"pet_id must be an integer or a string, not {pet_id!r}")
+    pet = event.get('pet') or {}
+    if not isinstance(pet, dict):
+        raise ValueError("pet must be an object")
+    row = event.get('row')
+    if row is not None and (op == 'remove' or not isinstance(row, int) or isinstance(row, bool) or row < 0):
+        raise ValueError(f"row must be a row number of an add or update, not {row!r}")
+
+    for field, value in pet.items():
+        if value is None or field not in FIELDS or field == 'pet_id':
+            continue
+        if field in LIST_FIELDS:
+            valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+        elif field in LONG_FIELDS or field in CATEGORICAL_FIELDS:
+            valid = isinstance(value, str)
+        elif field == 'good_with':
+            # An empty good_with is a list in the catalog file
+            valid = isinstance(value, (dict, list))
+        else:
+            valid = not isinstance(value, (dict, list))
+        if not valid:
+            raise ValueError(f"unexpected value for {field}: {value!r}")
+
+    if op == 'add':
+        pet = dict({field: None for field in FIELDS}, **pet)
+    return {'op': op, 'pet_id': pet_id, 'pet': pet, 'row': row}
+
+
+# Every store of the process gets the next generation: row ids are only meaningful in the store that handed them out
+_generations = itertools.count(1)
+
+
+def row_keys(store):
+    # (pet_id, n) of every row of a store, for the n-th live row with that pet_id; None for removed rows
+    seen = {}
+    keys = []
+    with store.lock:
+        for record in store.records:
+            if record is None:
+                keys.append(None)
+                continue
+            n = seen.get(record.pet_id, 0)
+            seen[record.pet_id] = n + 1
+            keys.append((record.pet_id, n))
+    return keys
+
+
+class CatalogStore:
+    # The pet catalog of one server process, shared by every session.
+    # Rows are positions in the catalog; they stay stable while deltas are applied:
+    # new pets are appended and removed pets leave a None behind.
+    # Sessions keep row ids together with the store's generation and resolve records on demand;
+    # a reloaded catalog is a new store, which carries the rows of the one it replaced over by pet_id.
+
+    def __init__(self, pets, records=None, rows_by_pet_id=None, previous=None):
+        # records/rows_by_pet_id: an already loaded catalog (see catalog_columns.py) instead of pets dicts.
+        # previous: the store this one replaces.
+        self.generation = next(_generations)
+        self.previous_rows = None if previous is None else (previous.generation, row_keys(previous))
+        self.records = [PetRecord.from_dict(pet) for pet in pets] if records is None else records
+        if rows_by_pet_id is None:
+            rows_by_pet_id = {}
+            for row, record in enumerate(self.records):
+                rows_by_pet_id.setdefault(record.pet_id, []).append(row)
+        self.rows_by_pet_id = rows_by_pet_id
+        self.index = PetIndex(self.records)
+        self.delta_offset = 0
+        # What the records were loaded from, when it isn't the catalog file (e.g. a database import)
+        self.source = None
+        self.listeners = []
+        self.stale_listeners = set()
+        self.search_cache = SearchCache()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.index.all_rows)
+
+    def record(self, row):
+        # None for removed pets and for rows this store never had
+        with self.lock:
+            return self.records[row] if 0 <= row < len(self.records) else None
+
+    def carry_rows(self, generation, rows):
+        # Rows handed out by the store of the given generation, as rows of this store: pets are matched by
+        # pet_id (and position among duplicates), -1 where a pet is gone. None when the rows come from a store
+        # older than the one this replaced, so they can't be mapped.
+        if generation == self.generation:
+            return np.asarray(rows, dtype=np.int32)
+        if self.previous_rows is None or self.previous_rows[0] != generation:
+            return None
+        keys = self.previous_rows[1]
+        carried = np.full(len(rows), -1, dtype=np.int32)
+        with self.lock:
+            for i, row in enumerate(rows):
+                key = keys[row] if 0 <= row < len(keys) else None
+                current = self.rows_by_pet_id.get(key[0]) if key is not None else None
+                if current and key[1] < len(current):
+                    carried[i] = current[key[1]]
+        return carried
+
+    def get(self, pet_id):
+        with self.lock:
+            rows = self.rows_by_pet_id.get(pet_id)
+            return self.records[rows[0]] if rows else None
+
+    def facet_counts(self, fields=None, **criterias):
+        # For every field in fields (default: all of criterias): normalized value -> number of pets matching
+        # all the other criterias, plus 'any' -> the number matching the others regardless of this field.
+        # Cost doesn't depend on how many options a field has; repeated combinations come from the search cache.
+        # The result is shared through that cache like search results: callers must not modify it.
+        fields = list(criterias) if fields is None else list(fields)
+        key = ('facets',) + tuple(sorted(fields)) + search_key(criterias)
+        counts = self.search_cache.get(key)
+        if counts is not None:
+            return counts
+
+        with self.lock:
+            counts = self.index.facet_counts(fields, **criterias)
+            self.search_cache.put(key, counts)
+        return counts
+
+    def search(self, **criterias):
+        # Read-only int32 row ids. Posting arrays are replaced on update, never modified, so a one-field
+        # or all-'Any' query hands out the index's own array and sessions with that query share it.
+        # Repeated queries are answered from the search cache without touching the index.
+        key = search_key(criterias)
+        rows = self.search_cache.get(key)
+        if rows is not None:
+            return rows
+
+        with self.lock:
+            rows = self.index.search(**criterias)
+            rows.flags.writeable = False
+            # Stored under the store lock, so a result can't outlive the delta batch that invalidates it
+            self.search_cache.put(key, rows)
+        return rows
+
+    def subscribe(self, listener, rebuild):
+        # listener(store, changed_rows) runs inside each applied batch, so derived data never lags behind readers.
+        # rebuild(store) recomputes the listener's data from scratch, for when an incremental update failed.
+        with self.lock:
+            self.listeners.append((listener, rebuild))
+
+    def notify(self, changed_rows):
+        # A failing listener doesn't stop the others; it is rebuilt, and retried on later batches until that works
+        for listener, rebuild in self.listeners:
+            if rebuild not in self.stale_listeners:
+                try:
+                    listener(self, changed_rows)
+                    continue
+                except Exception:
+                    logger.exception("Catalog listener %r failed, rebuilding it", listener)
+            try:
+                rebuild(self)
+                self.stale_listeners.discard(rebuild)
+            except Exception:
+                logger.exception("Rebuilding catalog listener %r failed, retrying with the next batch", listener)
+                self.stale_listeners.add(rebuild)
+
+    def apply_events(self, events):
+        # add/update/remove events keyed by pet_id. Add replaces the record, update merges the given fields;
+        # both insert the pet if it is new. An add or update with a row only changes that row of the pet
+        # (one of its duplicates), or appends a new row of it when row is the next row of the catalog.
+        # The whole batch becomes visible at once. Events that can't be applied are skipped before anything changes.
+        checked = []
+        for event in events:
+            try:
+                checked.append(check_event(event))
+            except ValueError as error:
+                logger.warning("Skipping catalog delta %.200r: %s", event, error)
+
+        with self.lock:
+            changes = {}
+
+            def replace(row, record):
+                changes.setdefault(row, self.records[row])
+                self.records[row] = record
+
+            for event in checked:
+                op = event['op']
+                pet_id = event['pet_id']
+                pet = event['pet']
+                if op == 'remove':
+                    for row in self.rows_by_pet_id.pop(pet_id, []):
+                        replace(row, None)
+                elif op in ('add', 'update'):
+                    rows = self.rows_by_pet_id.get(pet_id)
+                    if event['row'] == len(self.records):
+                        self.rows_by_pet_id[pet_id] = (rows or []) + [event['row']]
+                        self.records.append(None)
+                        rows = [event['row']]
+                    elif event['row'] is not None:
+                        if event['row'] not in (rows or ()):
+                            logger.warning("Skipping catalog delta for pet %r: row %r isn't one of its rows", pet_id, event['row'])
+                            continue
+                        rows = [event['row']]
+                    elif not rows:
+                        rows = self.rows_by_pet_id[pet_id] = [len(self.records)]
+                        self.records.append(None)
+                    for row in rows:
+                        current = self.records[row]
+                        fields = dict(pet) if op == 'add' or current is None else {**current.to_dict(), **pet}
+                        fields['pet_id'] = pet_id
+                        replace(row, PetRecord.from_dict(fields))
+
+            if not changes:
+                return []
+            self.index.update([(row, old, self.records[row]) for row, old in changes.items()])
+            self.search_cache.clear()
+            self.notify(list(changes))
+            return list(changes)
+
+    def poll_deltas(self, path):
+        with self.lock:
+            if not os.path.exists(path):
+                return []
+            if os.path.getsize(path) < self.delta_offset:
+                # Feed was rotated; events are idempotent so replaying it is safe
+                self.delta_offset = 0
+            events, offset = read_delta_events(path, self.delta_offset)
+            changed = self.apply_events(events) if events else []
+            # Only a batch that was applied moves the offset; a failure leaves it to be read again
+            self.delta_offset = offset
+            return changed
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+@timed('read_catalog')
+def read_catalog(path=CATALOG_PATH):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def delta_path_for(path):
+    return f"{os.path.splitext(path)[0]}{DELTA_SUFFIX}"
+
+
+def catalog_store(path=CATALOG_PATH):
+    # Parsed once per process; re-read only when the file on disk changes.
+    # Between full reloads, new events in the delta feed are applied incrementally.
+    if CATALOG_DB and path == CATALOG_PATH:
+        from pet_db import database_store
+        return database_store(CATALOG_DB)
+    if SHARED_ARTIFACTS:
+        from catalog_columns import columns_store
+        return columns_store(path)
+    stamp = file_stamp(path)
+    cached = _stores.get(path)
+    if cached is None or cached[0] != stamp:
+        with _stores_lock:
+            cached = _stores.get(path)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, CatalogStore(read_catalog(path), previous=cached and cached[1]))
+                _stores[path] = cached
+
+    store = cached[1]
+    store.poll_deltas(delta_path_for(path))
+    return store
@@ -0,0 +1,283 @@
+# The pet catalog as column arrays (see shared_artifacts.py): one artifact next to the catalog that every
+# worker maps, instead of each one parsing cats_and_dogs.json into its own records.
+#
+#   <field>.codes / <field>.values     single-valued categorical fields: value codes (-1 = missing) and JSON values
+#   <field>.offsets / <field>.codes    list fields: CSR rows of value codes into <field>.values
+#   <field>.offsets / <field>.data     any other field: the JSON of each value, concatenated
+#   <field>.keys / .order / .bounds    search postings: rows of normalized key i are order[bounds[i]:bounds[i + 1]]
+#
+# Records are decoded from the columns when they are read; pets changed by deltas afterwards are kept as
+# ordinary PetRecords on top.
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from catalog import (CATALOG_PATH, CATEGORICAL_FIELDS, FIELDS, LIST_FIELDS, CatalogStore, delta_path_for, field_keys,
+                     intern_value, merge_postings, read_catalog)
+from file_versions import file_fingerprint, file_stamp, write_atomic
+from shared_artifacts import load_arrays
+
+# Bump when the column layout changes
+COLUMNS_VERSION = 1
+# Fields with precomputed search postings
+POSTING_FIELDS = CATEGORICAL_FIELDS + LIST_FIELDS
+JSON_FIELDS = tuple(field for field in FIELDS if field not in CATEGORICAL_FIELDS + LIST_FIELDS + ('pet_id',)) + ('extra',)
+
+
+def columns_path(path=CATALOG_PATH):
+    return f"{os.path.splitext(path)[0]}.columns.npz"
+
+
+def encode_values(values):
+    # (codes, distinct values as JSON) with -1 for None; JSON keeps numbers numbers
+    distinct = {}
+    codes = np.array([-1 if value is None else distinct.setdefault(value, len(distinct)) for value in values], dtype=np.int32)
+    return codes, np.array([json.dumps(value) for value in distinct], dtype=str)
+
+
+def encode_postings(pets, field):
+    ids = {}
+    for row, pet in enumerate(pets):
+        for key in field_keys(pet, field):
+            ids.setdefault(key, []).append(row)
+    keys = list(ids)
+    counts = [len(ids[key]) for key in keys]
+    order = np.array([row for key in keys for row in ids[key]], dtype=np.int32)
+    return np.array(keys, dtype=str), order, np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def build_columns(pets, source):
+    arrays = {'version': np.array(COLUMNS_VERSION), 'source': np.array(source),
+              'pet_id': np.array([pet['pet_id'] for pet in pets], dtype=np.int64)}
+    for field in CATEGORICAL_FIELDS:
+        arrays[f"{field}.codes"], arrays[f"{field}.values"] = encode_values([pet.get(field) for pet in pets])
+    for field in LIST_FIELDS:
+        lists = [pet.get(field) or () for pet in pets]
+        codes, arrays[f"{field}.values"] = encode_values([value for values in lists for value in values])
+        arrays[f"{field}.codes"] = codes
+        arrays[f"{field}.offsets"] = np.concatenate([[0], np.cumsum([len(values) for values in lists])]).astype(np.int64)
+    for field in JSON_FIELDS:
+        if field == 'extra':
+            encoded = [json.dumps({key: value for key, value in pet.items() if key not in FIELDS} or None).encode() for pet in pets]
+        else:
+            encoded = [json.dumps(pet.get(field)).encode() for pet in pets]
+        arrays[f"{field}.data"] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        arrays[f"{field}.offsets"] = np.concatenate([[0], np.cumsum([len(value) for value in encoded])]).astype(np.int64)
+    for field in POSTING_FIELDS:
+        arrays[f"{field}.keys"], arrays[f"{field}.order"], arrays[f"{field}.bounds"] = encode_postings(pets, field)
+    return arrays
+
+
+def publish_columns(path=CATALOG_PATH):
+    # Builds the artifact from the catalog file and swaps it in by rename
+    arrays = build_columns(read_catalog(path), file_fingerprint(path))
+    return write_atomic(columns_path(path), lambda f: np.savez(f, **arrays))
+
+
+class Columns:
+    # Mapped arrays plus the decoded value lists of the categorical and list fields, which are small
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.size = len(arrays['pet_id'])
+        self.values = {field: [intern_value(json.loads(value)) for value in arrays[f"{field}.values"].tolist()]
+                       for field in CATEGORICAL_FIELDS + LIST_FIELDS}
+
+    def value(self, field, row):
+        if field == 'pet_id':
+            return int(self.arrays['pet_id'][row])
+        if field in CATEGORICAL_FIELDS:
+            code = self.arrays[f"{field}.codes"][row]
+            return None if code < 0 else self.values[field][code]
+        offsets = self.arrays[f"{field}.offsets"]
+        start, end = offsets[row], offsets[row + 1]
+        if field in LIST_FIELDS:
+            values = self.values[field]
+            return tuple(values[code] for code in self.arrays[f"{field}.codes"][start:end].tolist())
+        return json.loads(self.arrays[f"{field}.data"][start:end].tobytes())
+
+
+class ColumnRecord:
+    # One row of the columns, read like a PetRecord: pet["age"], pet.get("size"), pet.pet_id, "tags" in pet
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getattr__(self, name):
+        if name in FIELDS:
+            return self.columns.value(name, self.row)
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        if key in FIELDS:
+            return self.columns.value(key, self.row)
+        extra = self.columns.value('extra', self.row)
+        if extra and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in FIELDS or key in (self.columns.value('extra', self.row) or ())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(FIELDS) + list(self.columns.value('extra', self.row) or ())
+
+    def to_dict(self):
+        pet = {key: self[key] for key in self.keys()}
+        for field in LIST_FIELDS:
+            pet[field] = list(pet[field])
+        return pet
+
+
+class ColumnRecords:
+    # The records list of a CatalogStore: rows decode from the columns on access; rows replaced by deltas and
+    # pets appended by them are held as PetRecords (or None) on top. Supports what CatalogStore needs of a list.
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.replaced = {}
+        self.appended = []
+
+    def __len__(self):
+        return self.columns.size + len(self.appended)
+
+    def __getitem__(self, row):
+        if row >= self.columns.size:
+            return self.appended[row - self.columns.size]
+        if row in self.replaced:
+            return self.replaced[row]
+        return ColumnRecord(self.columns, row)
+
+    def __setitem__(self, row, record):
+        if row >= self.columns.size:
+            self.appended[row - self.columns.size] = record
+        else:
+            self.replaced[int(row)] = record
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def append(self, record):
+        self.appended.append(record)
+
+    def changed_rows(self):
+        return sorted(self.replaced) + list(range(self.columns.size, len(self)))
+
+    def all_rows(self):
+        removed = [row for row, record in self.replaced.items() if record is None]
+        added = [row for row in range(self.columns.size, len(self)) if self[row] is not None]
+        return merge_postings(np.arange(self.columns.size, dtype=np.int32), removed, added)
+
+    def field_postings(self, field):
+        # normalized key -> rows for PetIndex, from the mapped postings; None for fields without them
+        if field not in POSTING_FIELDS:
+            return None
+        arrays = self.columns.arrays
+        order, bounds = arrays[f"{field}.order"], arrays[f"{field}.bounds"]
+        postings = {key: order[bounds[i]:bounds[i + 1]] for i, key in enumerate(arrays[f"{field}.keys"].tolist())}
+
+        changed = self.changed_rows()
+        if changed:
+            removed = {}
+            added = {}
+            for row in changed:
+                if row < self.columns.size:
+                    for key in field_keys(ColumnRecord(self.columns, row), field):
+                        removed.setdefault(key, []).append(row)
+                for key in field_keys(self[row], field):
+                    added.setdefault(key, []).append(row)
+            for key in set(removed) | set(added):
+                ids = merge_postings(postings.get(key, np.empty(0, dtype=np.int32)), removed.get(key), added.get(key))
+                if len(ids):
+                    postings[key] = ids
+                else:
+                    postings.pop(key, None)
+        return postings
+
+
+class PetIdRows:
+    # pet_id -> [rows] for CatalogStore.rows_by_pet_id, answered from the sorted pet_id column; ids changed
+    # by deltas are kept in a dict on top (None when removed)
+
+    def __init__(self, pet_ids):
+        self.order = np.argsort(pet_ids, kind='stable').astype(np.int32)
+        self.sorted_ids = pet_ids[self.order]
+        self.changed = {}
+
+    def get(self, pet_id, default=None):
+        if pet_id in self.changed:
+            rows = self.changed[pet_id]
+        elif isinstance(pet_id, (int, np.integer)) and not isinstance(pet_id, bool):
+            start = np.searchsorted(self.sorted_ids, pet_id, side='left')
+            end = np.searchsorted(self.sorted_ids, pet_id, side='right')
+            rows = self.order[start:end].tolist() or None
+        else:
+            rows = None
+        return default if rows is None else rows
+
+    def __getitem__(self, pet_id):
+        rows = self.get(pet_id)
+        if rows is None:
+            raise KeyError(pet_id)
+        return rows
+
+    def __setitem__(self, pet_id, rows):
+        self.changed[pet_id] = rows
+
+    def pop(self, pet_id, default=None):
+        rows = self.get(pet_id)
+        self.changed[pet_id] = None
+        return default if rows is None else rows
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def columns_store(path=CATALOG_PATH):
+    # Catalog store over the mapped columns artifact; a newly published artifact is mapped on the next call.
+    # Deltas are applied on top exactly as for the JSON catalog.
+    artifact = columns_path(path)
+    if not os.path.exists(artifact):
+        with _stores_lock:
+            if not os.path.exists(artifact):
+                publish_columns(path)
+
+    stamp = file_stamp(artifact)
+    cached = _stores.get(path)
+    if cached is None or cached[0] != stamp:
+        with _stores_lock:
+            cached = _stores.get(path)
+            if cached is None or cached[0] != stamp:
+                columns = Columns(load_arrays(artifact))
+                store = CatalogStore([], records=ColumnRecords(columns), rows_by_pet_id=PetIdRows(columns.arrays['pet_id']),
+                                     previous=cached and cached[1])
+                store.source = f"columns:{columns.arrays['source']}"
+                cached = _stores[path] = (stamp, store)
+
+    store = cached[1]
+    store.poll_deltas(delta_path_for(path))
+    return store
+
+
+def main():
+    started = time.perf_counter()
+    path = publish_columns()
+    print(f"Catalog columns in {time.perf_counter() - started:.1f}s -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import threading
+
+
+_fingerprints = {}
+_lock = threading.Lock()
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def file_fingerprint(path):
+    # Content hash of a data file, memoized on (mtime, size) so unchanged files are hashed only once
+    stamp = file_stamp(path)
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    fingerprint = digest.hexdigest()
+    with _lock:
+        _fingerprints[path] = (stamp, fingerprint)
+    return fingerprint
+
+
+def write_atomic(path, write):
+    # Writes through a temporary file and renames it into place, so readers never see a partial file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
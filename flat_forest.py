@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class FlatForest:
+    # A fitted sklearn tree ensemble flattened into contiguous node arrays.
+    # All trees share one node table; leaves point at themselves, so every row can walk
+    # every tree in lock-step for max_depth steps without branching per node.
+
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'classes')
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+
+            counts = tree.value[:, 0, :]
+            values.append(counts / counts.sum(axis=1, keepdims=True))
+            roots.append(offset)
+
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.int16),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.int32),
+            right=np.ascontiguousarray(np.concatenate(rights), dtype=np.int32),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float32),
+            roots=np.array(roots, dtype=np.int32),
+            classes=np.asarray(model.classes_),
+            max_depth=max_depth,
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(max_depth=int(arrays['max_depth']), **{name: arrays[name] for name in cls.ARRAYS})
+
+    def arrays(self):
+        return dict({name: getattr(self, name) for name in self.ARRAYS}, max_depth=np.array(self.max_depth))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def predict_proba(self, X):
+        # sklearn trees compare float32 inputs against float64 thresholds; do the same to take identical branches
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes].mean(axis=1, dtype=np.float64)
@@ -1,21 +1,24 @@
 import json
 import streamlit as st
-import pandas as pd
-import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import accuracy_score, classification_report
-import matplotlib.pyplot as  plt
-import seaborn as sns
+#pandas, sklearn and PIL are imported by the code paths that need them, see startup_profile.py
+from adoption_model import pet_features, encode_pets, predict_adoption, catalog_scores, FEATURE_SPEC
+from recommender import load_data, transform_data_pets, recommendation_engine
+from catalog import pet_index, catalog_store
+from assets import base64_asset, image_src, svg_asset
+from pet_images import pet_image_src, prefetch, PREFETCH_AHEAD
+from instrumentation import page_render, span, timed
+from session_memory import show_memory_report
+from matching import match_pets
+from similar_pets import similar_pets
+from text_search import text_index, query_criterias, TEXT_RESULTS
+from model_jobs import submit_pet, adoption_key, owners_key, stats as model_jobs_stats
 
 
 
 def get_base64_image(image_path):
-    import base64
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode()
+    return base64_asset(image_path)
     
+@timed('read_pets_file')
 def read_pets_file():
     with open('cats_and_dogs.json', 'r') as f:
         data = json.load(f)
@@ -26,24 +29,12 @@ def read_dictionary_file():
         data = json.load(f)
     return data
 
+@timed('find_pets')
 def find_pets(pets, **criterias):
-    def matches(pet, key, value):
-        if value.lower() == 'any':
-            return True
-        
-        if key in pet:
-            if isinstance(pet[key], list):
-                return value.lower() in (item.lower() for item in pet[key])
-            return str(pet[key]).lower() == str(value).lower()
-        return False
-        
-    match_pets = []
-
-    for pet in pets:
-        if all(matches(pet, key, value) for key, value in criterias.items()):
-            match_pets.append(pet)
-    return match_pets
+    index = pet_index(pets)
+    return [pets[position] for position in index.search(**criterias)]
 
+@timed('show_pet')
 def show_pet(pet):
     pet_name = pet["pet_name"]
     pet_breed = pet["primary_breed"]
@@ -99,13 +90,7 @@ def show_pet(pet):
 
     # Display the image
     
-    if pet["image_url"]:
-        image_path = pet['image_url']
-    else:
-        if pet["pet_type"].lower() == "cat":
-            image_path = f"data:image/png;base64,{get_base64_image('resources/cat_856461.png')}"
-        else:
-            image_path = f"data:image/png;base64,{get_base64_image('resources/dog_4540592.png')}"
+    image_path = pet_picture(pet)
 
     st.markdown(
         f"""
@@ -158,6 +143,15 @@ def show_pet(pet):
     show_model_buttons(pet)
 
 
+def pet_picture(pet, variant='display'):
+    #Image src of a pet, with a cat or dog placeholder for pets without a photo
+    if pet.get("image_url"):
+        return pet_image_src(pet["image_url"], variant)
+    if (pet.get("pet_type") or "").lower() == "cat":
+        return image_src('resources/cat_856461.png')
+    return image_src('resources/dog_4540592.png')
+
+
 def show_main_page():
     # #Header and Title
     # st.title("FourPaws - Each life matter!")
@@ -169,11 +163,22 @@ def show_main_page():
 
     #Read Dictionary with different categories
     dictionary = read_dictionary_file()
-    st.session_state.dictionary = dictionary
 
     #Filters
     st.sidebar.header("Filters")
-    pet_type = st.sidebar.selectbox("Pet", dictionary["pet_type"])
+    #Counts next to each option follow the selections of the other filters (as of the last rerun)
+    selections = {field: st.session_state.get(f"filter_{field}", "Any") for field in FILTER_FIELDS}
+    if selections["primary_breed"] not in dictionary['catBreeds' if selections["pet_type"] == 'Cat' else 'dogBreeds']:
+        #Breed of the previously chosen pet type; its selectbox resets to "Any" below
+        selections["primary_breed"] = "Any"
+    with span('facet_counts'):
+        store = catalog_store()
+        #Counts come from the store's cache and are shared with other sessions: replace entries in a copy only
+        facets = dict(store.facet_counts(**selections))
+        #Breed lists belong to a pet type, so switching type is never blocked by the chosen breed
+        without_breed = {field: value for field, value in selections.items() if field != "primary_breed"}
+        facets["pet_type"] = store.facet_counts(fields=["pet_type"], **without_breed)["pet_type"]
+    pet_type = facet_selectbox("Pet", "pet_type", dictionary["pet_type"], facets)
 
     if pet_type == 'Cat':
         breedType = 'catBreeds'
@@ -191,12 +196,15 @@ def show_main_page():
         """,
         unsafe_allow_html=True
     )
-    breed = st.sidebar.selectbox("Breed", dictionary[breedType])
-    age = st.sidebar.selectbox("Age", dictionary["age"])
-    gender = st.sidebar.selectbox("Gender", dictionary["gender"])
-    size = st.sidebar.selectbox("Size", dictionary["size"])
-    coat_length = st.sidebar.selectbox("Coat length", dictionary["coat_length"])
-    special_needs = st.sidebar.selectbox("Special needs", dictionary["special_needs"])
+    breed = facet_selectbox("Breed", "primary_breed", dictionary[breedType], facets)
+    age = facet_selectbox("Age", "age", dictionary["age"], facets)
+    gender = facet_selectbox("Gender", "gender", dictionary["gender"], facets)
+    size = facet_selectbox("Size", "size", dictionary["size"], facets)
+    coat_length = facet_selectbox("Coat length", "coat_length", dictionary["coat_length"], facets)
+    special_needs = facet_selectbox("Special needs", "medical_care", dictionary["special_needs"], facets)
+    max_probability = st.sidebar.slider("Max adoption probability, %", 0, 100, 100)
+    sort_by_risk = st.sidebar.checkbox("Lowest adoption chance first")
+    description = st.sidebar.text_input("Describe the pet", placeholder="e.g. calm senior cat good with kids").strip()
    
     # pets = read_pets_file()
 
@@ -214,21 +222,42 @@ def show_main_page():
 
     #Search button in the sidebar
     if st.sidebar.button("Search"):
-        match_pets = []
-        pets = read_pets_file()
-        match_pets = find_pets(pets, pet_type=pet_type, primary_breed=breed, age=age, gender=gender, size=size, coat_length=coat_length,medical_care =special_needs )
-        st.sidebar.markdown(f"**Pets found by your request:** {len(match_pets)}")
-        st.session_state.match_pets = match_pets
+        #Catalog is shared by all sessions, each session only keeps an int32 array of the matching row ids
+        store = catalog_store()
+        criterias = dict(pet_type=pet_type, primary_breed=breed, age=age, gender=gender, size=size, coat_length=coat_length,medical_care =special_needs )
+        if description and pet_type == "Any":
+            #A pet type named in the text narrows the search like the sidebar filter would
+            criterias.update(query_criterias(description))
+        with span('catalog_search'):
+            match_rows = store.search(**criterias)
+        if description:
+            #Free text ranks the filtered pets by relevance and keeps the best ones
+            match_rows = text_index(store).search(description, TEXT_RESULTS, allowed=match_rows)
+        if max_probability < 100 or sort_by_risk:
+            #Adoption probabilities are precomputed for the whole catalog
+            with span('rank_by_probability'):
+                match_rows = catalog_scores(store).rank(match_rows, max_probability / 100 if max_probability < 100 else None, sort_by_risk)
+        st.sidebar.markdown(f"**Pets found by your request:** {len(match_rows)}")
+        st.session_state.match_rows = match_rows
+        st.session_state.match_rows_generation = store.generation
         st.session_state.index = 0  # Reset index when a new search is performed
 
-    if 'match_pets' in st.session_state and st.session_state.match_pets:
+    if 'match_rows' in st.session_state:
+        carry_match_rows(catalog_store())
+    if 'match_rows' in st.session_state and len(st.session_state.match_rows):
         # Display Animal Profiles
         # st.write("### Found Pets")
         #Show animal from search results
         show_navigation_buttons( )
-        if 0 <= st.session_state.index < len(st.session_state.match_pets):
-            show_pet(st.session_state.match_pets[st.session_state.index])
-            show_social_media( st.session_state.match_pets[st.session_state.index] )
+        if 0 <= st.session_state.index < len(st.session_state.match_rows):
+            pet = catalog_store().record(st.session_state.match_rows[st.session_state.index])
+            if pet is None:
+                st.write("This pet is no longer available.")
+            else:
+                show_pet(pet)
+                show_social_media( pet )
+                show_similar_pets(st.session_state.match_rows[st.session_state.index])
+            prefetch_next_pets()
         else:
             st.write("No pets found")
          
@@ -239,6 +268,18 @@ def show_main_page():
         st.write("")
         
 
+#Catalog fields behind the sidebar filters, in the order they are shown
+FILTER_FIELDS = ["pet_type", "primary_breed", "age", "gender", "size", "coat_length", "medical_care"]
+
+def facet_selectbox(label, field, options, facets):
+    #Options without matching pets are hidden; "Any" and the current choice stay so the widget doesn't jump
+    counts = facets[field]
+    key = f"filter_{field}"
+    visible = [option for option in options if counts.get(option.lower()) or option in ("Any", st.session_state.get(key))]
+    if st.session_state.get(key) not in visible:
+        st.session_state.pop(key, None)
+    return st.sidebar.selectbox(label, visible, key=key, format_func=lambda option: f"{option} ({counts.get(option.lower(), 0)})")
+
 def show_about_page():
     # st.title("4 Paws")
     st.write("""
@@ -263,6 +304,49 @@ def show_about_page():
     return
 
 
+def show_match_page():
+    #Adopter at the front desk: their survey answers in, the closest pets of the catalog out
+    st.title("Find pets for an adopter")
+    with st.form("adopter"):
+        col1, col2 = st.columns(2)
+        with col1:
+            age = st.number_input("Adopter age", 19, 52, 30)
+            gender = st.selectbox("Adopter gender", ["Female", "Male"])
+            living = st.selectbox("Living", ["Apartment", "House"])
+            activity = st.slider("Activity level", 1, 9, 5)
+            experience = st.selectbox("Experience with pets", ["Experienced", "First-time owner"])
+            shelter_time = st.select_slider("Concern about time in shelter", [1, 2, 3])
+        with col2:
+            pet_type = st.selectbox("Preferred pet", ["Cat", "Dog"])
+            gender_pet = st.selectbox("Preferred pet gender", ["Any", "Female", "Male"])
+            age_pet = st.selectbox("Preferred pet age", ["Young", "Adult"])
+            vaccine_pet = st.selectbox("Vaccination", ["Yes, i'm ready to take only vaccinated pet", "No, vaccination is not so important for me"])
+            allergies_pet = st.selectbox("Allergies", ["No", "Yes"])
+            special_needs = st.selectbox("Ready for a pet with special needs", ["No", "Yes"])
+        only_type = st.checkbox("Only show the preferred pet type", value=True)
+        count = st.number_input("Pets to show", 1, 50, 10)
+        submitted = st.form_submit_button("Find pets")
+
+    if not submitted:
+        return
+
+    answers = {'age': age, 'gender': gender, 'living': living, 'activity': activity, 'experience': experience, 'type': pet_type,
+               'gender_pet': gender_pet, 'size_pet': 'Any', 'age_pet': age_pet, 'vaccine_pet': vaccine_pet,
+               'allergies_pet': allergies_pet, 'shelter_time': shelter_time, 'special_needs?': special_needs}
+    store = catalog_store()
+    matches = match_pets(store, answers, count, **({'pet_type': pet_type} if only_type else {}))
+    if not matches:
+        st.write("No pets found")
+    for row, score in matches:
+        pet = store.record(row)
+        if pet is None:
+            continue
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            st.markdown(f'<img src="{pet_picture(pet, "thumbnail")}" width="120">', unsafe_allow_html=True)
+        with col2:
+            st.markdown(f"**{pet['pet_name']}**, {pet['primary_breed']}  \n{pet['age']} • {pet['gender']} • {pet['size']} • match {score:.0%}")
+
 def show_dashboard_page():
     st.title("Analytics and reporting page")
     st.write("This page is in progress and will be deployed very soon...")
@@ -288,7 +372,7 @@ def show_dashboard_page():
         </style>
         <div class="center">
         <figure>
-        <img src="data:image/png;base64,{get_base64_image('Screenshot 2024-07-26 174039.png')}" alt="Future Dashboard Placeholder">
+        <img src="{image_src('Screenshot 2024-07-26 174039.png')}" alt="Future Dashboard Placeholder">
         <figcaption>Future Dashboard Placeholder</figcaption>
         </figure>
         </div>
@@ -307,6 +391,7 @@ def show_contacts_page():
 def show_toolbar():
     # Header bar with HTML and CSS
     # st.subheader("One step can save lifes")        
+    paw_icon = image_src('resources/icons/footprints.png')
     
     st.markdown(
         f"""
@@ -353,12 +438,13 @@ def show_toolbar():
                 <!-- Title Text -->
                 FourPaws - Where Every Paw Finds a Home
                 <!-- Icons -->
-                <img src="data:image/png;base64,{get_base64_image('resources/icons/footprints.png')}" alt="Paw Icon">
-                <img src="data:image/png;base64,{get_base64_image('resources/icons/footprints.png')}" alt="Paw Icon">                
+                <img src="{paw_icon}" alt="Paw Icon">
+                <img src="{paw_icon}" alt="Paw Icon">                
             </div>
             <div class="nav-links">
                 <a href="/?page=about">About</a>
                 <a href="/?page=home">Home</a>
+                <a href="/?page=match">Match an adopter</a>
                 <a href="/?page=analytics and reporting">Analytics and reporting</a>
                  <!-- <a href="/?page=contact">Contact</a> -->
             </div>
@@ -367,18 +453,39 @@ def show_toolbar():
         unsafe_allow_html=True
     )
 
+PAGES = {
+    "home": show_main_page,
+    "about": show_about_page,
+    "match": show_match_page,
+    "analytics and reporting": show_dashboard_page,
+    # "contact": show_contacts_page,
+}
+
 def display_selected_page(page):
-    if page == "home":
-        show_main_page()
-    elif page == "about":
-        show_about_page()
-    elif page == "analytics and reporting":
-        show_dashboard_page()
-    # elif page == "contact":
-    #     show_contacts_page()
-    else:
-        st.title("Page not found")
-        st.write("The page you're looking for does not exist.")
+    #Unknown pages share one metrics label, so random URLs can't grow the label set
+    with page_render(page if page in PAGES else "not found", debug=st.query_params.get("debug") == "1") as spans:
+        if page in PAGES:
+            PAGES[page]()
+        else:
+            st.title("Page not found")
+            st.write("The page you're looking for does not exist.")
+
+    if spans is not None:
+        show_debug_panel(spans)
+        show_memory_report()
+
+def show_debug_panel(spans):
+    #Timings of this rerun, nested spans indented under the operation that called them
+    import pandas as pd
+    with st.expander("Timings", expanded=True):
+        rows = [{"operation": "\u2003" * depth + operation, "ms": round(seconds * 1000, 2)} for started, depth, operation, seconds in sorted(spans)]
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+        cache = catalog_store().search_cache.stats()
+        hit_rate = f"{cache['hit_rate']:.0%}" if cache['hit_rate'] is not None else "-"
+        st.caption(f"Search cache: {cache['entries']}/{cache['capacity']} entries, {cache['hits']} hits, {cache['misses']} misses ({hit_rate}), "
+                   f"{cache['evictions']} evictions, {cache['invalidations']} invalidations")
+        jobs = model_jobs_stats()
+        st.caption(f"Model results: {jobs['results']} memoized, {jobs['pending']} pending or running")
 
 
 def show_social_media(pet):
@@ -388,11 +495,6 @@ def show_social_media(pet):
     facebook_link = pet['facebook_url']
     
 
-    # Read the SVG content
-    def load_svg(file_path):
-        with open(file_path, "r") as file:
-            return file.read()
-        
     st.write("")
     st.write("Share this profile at social media:")   
 
@@ -422,14 +524,58 @@ def show_social_media(pet):
         }}
         </style>
         <div class="icon-button-container">
-            <a href="{twitter_link}" target="_blank">{load_svg("resources/icons/twitter.svg")}</a>
-            <a href="{pinterest_link}" target="_blank">{load_svg("resources/icons/pinterest.svg")}</a>
-            <a href="{facebook_link}" target="_blank">{load_svg("resources/icons/facebook.svg")}</a>
+            <a href="{twitter_link}" target="_blank">{svg_asset("resources/icons/twitter.svg")}</a>
+            <a href="{pinterest_link}" target="_blank">{svg_asset("resources/icons/pinterest.svg")}</a>
+            <a href="{facebook_link}" target="_blank">{svg_asset("resources/icons/facebook.svg")}</a>
         </div>
         """,
         unsafe_allow_html=True
     )       
 
+def show_similar_pets(row):
+    #Neighbour lists are precomputed for the whole catalog, so the panel is one lookup per rerun
+    with span('similar_pets'):
+        store = catalog_store()
+        similar = similar_pets(store)
+        rows, scores = similar.similar(row)
+        pets = [(i, store.record(neighbour), score) for i, (neighbour, score) in enumerate(zip(rows, scores))]
+        pets = [(i, pet, score) for i, pet, score in pets if pet is not None]
+    if not similar.ready:
+        #The lists are still being built in the background
+        st.caption("No similar pets yet")
+        return
+    if not pets:
+        return
+    st.write("### Similar pets")
+    columns = st.columns(len(pets))
+    for column, (i, pet, score) in zip(columns, pets):
+        with column:
+            st.markdown(f'<img src="{pet_picture(pet, "thumbnail")}" width="100%">', unsafe_allow_html=True)
+            st.caption(f"{pet['pet_name']}, {pet['primary_breed']}  \n{pet['age']} • {score:.0%}")
+            #Browsing continues through the pet and its neighbours, starting at the chosen one
+            st.button("View", key=f"similar_{i}", on_click=browse_similar, args=(similar.browse_rows(row), i + 1, store.generation))
+
+def browse_similar(rows, index, generation):
+    st.session_state.match_rows = rows
+    st.session_state.match_rows_generation = generation
+    st.session_state.index = index
+
+def carry_match_rows(store):
+    #Rows are positions in the store that found them: after a catalog reload they are mapped to the new
+    #store by pet id, dropping pets that are gone, and the search is reset when they can't be mapped
+    generation = st.session_state.get('match_rows_generation')
+    if generation == store.generation:
+        return
+    carried = store.carry_rows(generation, st.session_state.match_rows)
+    if carried is None:
+        del st.session_state.match_rows
+        st.session_state.index = 0
+        return
+    kept = carried >= 0
+    st.session_state.index = int(kept[:st.session_state.index].sum())
+    st.session_state.match_rows = carried[kept]
+    st.session_state.match_rows_generation = store.generation
+
 def show_navigation_buttons( ):
     col1, col2, col3, col4, col5, col6 = st.columns([4, 1, 1, 1, 1, 1])
 
@@ -444,32 +590,63 @@ def show_navigation_buttons( ):
     with col6: 
         #"Next" button functionality
         if st.button('Next Pet', key="right"):
-            if st.session_state.index + 1 < len(st.session_state.match_pets):
+            if st.session_state.index + 1 < len(st.session_state.match_rows):
                 st.session_state.index += 1
             else:
                 st.write("No more pets.")        
 
+def prefetch_next_pets():
+    #Warm the image cache for the next pets while the current one is on screen
+    store = catalog_store()
+    next_rows = st.session_state.match_rows[st.session_state.index + 1:st.session_state.index + 1 + PREFETCH_AHEAD]
+    next_pets = [store.record(row) for row in next_rows]
+    prefetch([pet["image_url"] for pet in next_pets if pet is not None])
+
 def show_model_buttons(pet):
     col1, col2, col3, col4, col5, col6 = st.columns([1, 1, 1, 2, 1, 1])
 
-    # with col1:
-    recomendations = {}
+    #Model calls run on the shared worker pool: the page renders right away and the result fills in when ready.
+    #The session keeps the pet and the future of its last request per button.
+    requests = st.session_state.setdefault("model_requests", {})
 
     with col3:
          #Adoption model
         if st.button("Predict addoption"):
-            probability_of_adoption = prediction_model_result(pet)
-            st.write(f"Probability of adoption: {probability_of_adoption:.1%}")
+            requests["adoption"] = (pet["pet_id"], submit_pet(adoption_key, prediction_model_result, pet))
+        show_model_result(requests.get("adoption"), pet, lambda probability_of_adoption: st.write(f"Probability of adoption: {probability_of_adoption:.1%}"))
     
         
     with col4: 
         #"Owner prediction model
         if st.button("Recommended owners"):
-            recomendations = recommendation_engine(pet)
+            requests["owners"] = (pet["pet_id"], submit_pet(owners_key, recommendation_engine, pet))
+        show_model_result(requests.get("owners"), pet, show_recommendations)
+
+def show_recommendations(recomendations):
+    if recomendations:
+        for key, value in recomendations.items():
+            st.write(f"**{key.replace('_', ' ').capitalize()}**: {value}")
+
+def show_model_result(request, pet, show):
+    if request is None or request[0] != pet["pet_id"]:
+        return
+    future = request[1]
+    if not future.done():
+        wait_for_model_result(future)
+    elif future.exception() is not None:
+        st.write("Couldn't calculate this right now, please try again.")
+    else:
+        show(future.result())
 
-            if recomendations:
-                for key, value in recomendations.items():
-                    st.write(f"**{key.replace('_', ' ').capitalize()}**: {value}")
+#st.experimental_fragment became st.fragment in Streamlit 1.37
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+@fragment(run_every=0.5)
+def wait_for_model_result(future):
+    #Only this placeholder reruns while the model works; once it is done the page reruns and shows the result
+    if future.done():
+        st.rerun()
+    st.write("Calculating...")
 
 
 def apply_custom_cursor(cursor_path):
@@ -482,196 +659,17 @@ def apply_custom_cursor(cursor_path):
     """
     st.markdown(custom_css, unsafe_allow_html=True)
 
-##Recomendation engine:
-
-def load_data():
-    data = pd.read_excel('survey_results_modified.xlsx')
-    # Making all data between 0-1
-    data['age'] = (data['age'] - 19) / (52 - 19)
-    data['gender'] = data['gender'].replace({'Male': 0, 'Female': 1})
-    data['living'] = data['living'].replace({'Apartment': 0, 'Other:Flat': 0, 'House': 1, 'Other:Apartment with garden ': 1})
-    data['activity'] = (data['activity'].fillna(1) - 1) / 8
-    data['experience'] = data['experience'].replace({'Experienced': 0, 'First-time owner': 1})
-    data['dog'] = data['type'].replace({'Dog': 1, 'Cat': 0, 'Other:Keine': 1, 'Other': 0, 'Other:crocodile': 0})
-    data['cat'] = data['type'].replace({'Dog': 0, 'Cat': 1, 'Other:Keine': 0, 'Other': 0, 'Other:crocodile': 0})
-    data['pet_male'] = data['gender_pet'].fillna('Any').replace({'Male': 1, 'Female': 0, 'Any': 0})
-    data['pet_female'] = data['gender_pet'].fillna('Any').replace({'Male': 0, 'Female': 1, 'Any': 0})
-    data['age_pet'] = data['age_pet'].replace({'Young': 0, 'Adult': 1})
-    data['vaccine_pet'] = data['vaccine_pet'].replace({'No, vaccination is not so important for me': 0, "Yes, i'm ready to take only vaccinated pet": 1})
-    data['allergies_pet'] = data['allergies_pet'].replace({'No': 0, 'Yes': 1})
-    data['shelter_time'] = data['shelter_time'].replace({1: 0, 2: 0.5, 3: 1})
-    data['special_needs?'] = data['special_needs?'].replace({'No': 0, 'Yes': 1})
-    data = data.drop(columns=['type', 'gender_pet', 'size_pet'])
-    return data
-
-def transform_data_pets(row):
-    # json_file_path = 'D:\IronHack\Study\Bootcamp\Project6_Pet_tinder\PETS/cats_and_dogs.json'
-    # with open(json_file_path, 'r') as file:
-    #     data = json.load(file)
-    # row = data[600]
-    age_group = 0.33 if row['age'] == 'Baby' else 0 if row['age'] == 'Young' else 1 if row['age'] == 'Adult' else 0.66 if row['age'] == 'Senior' else -1
-    cat_type = 1 if row['pet_type'] == 'Cat' else 0
-    dog_type = 1 if row['pet_type'] == 'Dog' else 0
-    allergies = 0
-    size = 0 if row['size'] == 'Small' else 1 if row['size'] == 'Medium' else 2
-    shelter_period_category = 0 if '>30' in row['days_on_petfinder'] else 0.5
-    health_condition = 0 if row['medical_care'] == 'no special needs' else 1
-    vaccination = 1 if 'Shots Current' in row.get('characteristics', []) else 0
-    pet_gender_male = 1 if row['gender'] == 'Male' else 0
-    pet_gender_female = 1 if row['gender'] == 'Female' else 0
-
-    new_pet = {
-        'age_pet': age_group,
-        'vaccine_pet': vaccination,
-        'allergies_pet': allergies,
-        'cat': cat_type,
-        'dog': dog_type,
-        'Size': size,
-        'shelter_time': shelter_period_category,
-        'special_needs?': health_condition,
-        'pet_male': pet_gender_male,
-        'pet_female': pet_gender_female
-    }
-    return new_pet
-
-def compare_new_pet_with_pet_in_database(row, new_pet):
-    distance = np.sqrt(
-        (new_pet['age_pet'] - row['age_pet'])**2 +
-        (new_pet['vaccine_pet'] - row['vaccine_pet'])**2 +
-        (new_pet['allergies_pet'] - row['allergies_pet'])**2 +
-        (new_pet['shelter_time'] - row['shelter_time'])**2 +
-        (new_pet['special_needs?'] - row['special_needs?'])**2 +
-        (new_pet['dog'] - row['dog'])**2 +
-        (new_pet['cat'] - row['cat'])**2 +
-        (new_pet['pet_male'] - row['pet_male'])**2 +
-        (new_pet['pet_female'] - row['pet_female'])**2
-    )
-    similarity = 1 / (distance + 1)
-    return similarity**2
-
-def compare_new_pet_with_all_database(pet_properties_database, new_pet):
-    return pet_properties_database.apply(lambda x: compare_new_pet_with_pet_in_database(x, new_pet), axis=1)
-
-def recommendation_engine(pet):
-    data = load_data()
-    pet_properties_database = data[['age_pet', 'vaccine_pet', 'allergies_pet', 'shelter_time', 'special_needs?', 'dog', 'cat', 'pet_male', 'pet_female']]
-    
-    new_pet = transform_data_pets(pet)
-    similarities = compare_new_pet_with_all_database(pet_properties_database, new_pet)
-    
-    def predict_feature_weighted_average(feature):
-        weighted_sum = (data[feature] * similarities).sum()
-        average_weighted = weighted_sum / similarities.sum()
-        return average_weighted
-
-    # Predicting age
-    average_weighted_age = predict_feature_weighted_average('age')
-    recommended_owner_age = (average_weighted_age * (52 - 19)) + 19
-
-    # Predicting gender
-    average_weighted_gender = predict_feature_weighted_average('gender')
-    recommended_gender = 'Female' if average_weighted_gender >= 0.5 else 'Male'
-
-    # Predicting living situation
-    average_weighted_living = predict_feature_weighted_average('living')
-    recommended_living = 'House or Apartment with garden' if average_weighted_living >= 0.5 else 'Apartment'
-
-    # Predicting activity level
-    average_weighted_activity = predict_feature_weighted_average('activity')
-    recommended_activity = (average_weighted_activity * 8) + 1
-
-    # Predicting experience
-    average_weighted_experience = predict_feature_weighted_average('experience')
-    recommended_experience = 'First-time owner' if average_weighted_experience >= 0.5 else 'Experienced'
-
-    # Predicting concerns about time in shelter
-    average_weighted_concern = predict_feature_weighted_average('shelter_time')
-    if average_weighted_concern < 0.5:
-        recommended_concerns = 'Not concerned'
-    elif 0.5 <= average_weighted_concern < 0.75:
-        recommended_concerns = 'Slightly concerned'
-    else:
-        recommended_concerns = 'Extremely concerned'
-
-    # Predicting readiness to take a pet with special needs
-    average_weighted_readiness = predict_feature_weighted_average('special_needs?')
-    recommended_readiness = 'Yes' if average_weighted_readiness >= 0.5 else 'No'
-    return { "recommended_owner_age": recommended_owner_age,
-            "recommended_gender": recommended_gender,
-            "recommended_activity": recommended_activity,
-            "recommended_living conditions": recommended_living,
-            "recommended_experience with pets": recommended_experience,
-            "recommended_concerns about time in shelter": recommended_concerns
-            # "recommended_readiness": recommended_readiness
-    }
- 
-
-
 ## Predict adoption:
 
 def transform_data(row):
-         # Predict probabilities for new data
-    # json_file_path = r'D:\IronHack\Study\Bootcamp\Project6_Pet_tinder\PETS/cats_and_dogs.json'
-
-    # with open(json_file_path, 'r') as file:
-    #     data = json.load(file)
-
-    # row = data[2]
-
-        # Function to transform the JSON data into the required format
-    age_group = 0 if row['age'] == 'Baby' else 1 if row['age'] == 'Young' else 2 if row['age'] == 'Adult' else 3 if row['age'] == 'Senior' else -1
-    pet_type = 3 if row['pet_type'] == 'Cat' else 2
-    size = 0 if row['size'] == 'Small' else 1 if row['size'] == 'Medium' else 2
-    shelter_period_category = 0 if '>30' in row['days_on_petfinder'] else 1
-    health_condition = 0 if row['medical_care'] == 'no special needs' else 1
-    adoption_fee = row['adoption_fee'] if row['adoption_fee'] is not None else 0
-    previous_owner = 1 if 'House trained' in row.get('characteristics', []) else 0  
-
-    a =  pd.DataFrame({
-            'age_group': [age_group],
-            'PetType': [pet_type],
-            'Size': [size],
-            'shelter_period_category': [shelter_period_category],
-            'HealthCondition': [health_condition],
-            'AdoptionFee': [adoption_fee],
-            'PreviousOwner': [previous_owner]
-                    })
-    return a
+    # Function to transform the JSON data into the required format
+    import pandas as pd
+    return pd.DataFrame([pet_features(row)], columns=FEATURE_SPEC["features"])
 
 
+@timed('prediction_model_result')
 def prediction_model_result(pet_row):
-    train_csv = pd.read_csv("pet_adoption_data.csv")
-    train_csv.drop("PetID",axis=1, inplace = True)
-    train_csv["PetType"]=train_csv["PetType"].map({"Bird":0,"Rabbit":1,"Dog":2,"Cat":3})
-    train_csv["Size"]=train_csv["Size"].map({"Small":0,"Large":2,"Medium":1})
-    train_csv['shelter_period_category'] = train_csv['TimeInShelterDays'].apply(lambda x: 0 if x > 30 else 1)
-    bins = [0, 6, 18, 60, float('inf')]
-    labels = [0, 1, 2, 3]  
-    train_csv['age_group'] = pd.cut(train_csv['AgeMonths'], bins=bins, labels=labels, right=True)
-    train_csv.drop(["Breed","Color","AgeMonths","WeightKg","TimeInShelterDays"],axis=1, inplace = True)
-    target = train_csv['AdoptionLikelihood']
-    train_csv=train_csv.drop('AdoptionLikelihood', axis=1)
- 
-    features = train_csv[['age_group', 'PetType', 'Size', 'shelter_period_category', 'HealthCondition', 'AdoptionFee', 'PreviousOwner' ]]
-
-    scaler = StandardScaler()
-
-    # X = scaler.fit_transform(features)
-    X  = features
-    y = target
-
-
-
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-    model = RandomForestClassifier()
-    model.fit(X_train, y_train)
-
-    probabilities = model.predict_proba(transform_data(pet_row))
-
-    return probabilities[0][1]
-
-
-
-
+    # Trained once per data/spec version, compiled to flat arrays and shared by every session
+    probabilities = predict_adoption(encode_pets([pet_row]))
 
+    return probabilities[0]
@@ -0,0 +1,100 @@
+# Timing spans for the page renders and the data/model hot paths.
+#
+#   FOURPAWS_METRICS_PORT=9464 streamlit run app.py    Prometheus scrape endpoint at :9464/metrics
+#   http://localhost:8501/?debug=1                      timing panel under the rendered page
+#
+# With neither of them on, a timed function costs one flag check per call and
+# prometheus_client is never imported.
+
+import contextlib
+import functools
+import os
+import threading
+import time
+
+METRICS_PORT = os.environ.get('FOURPAWS_METRICS_PORT')
+# Seconds; spans range from sub-millisecond index lookups to a cold Excel parse
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_histogram = None
+# Number of renders currently collecting spans for a debug panel
+_tracing = 0
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def start_exporter(port):
+    # One histogram and one scrape endpoint per process, whatever the number of sessions
+    global _histogram
+    with _lock:
+        if _histogram is None:
+            from prometheus_client import Histogram, start_http_server
+            _histogram = Histogram('fourpaws_operation_seconds', 'Time spent per page render and hot-path operation',
+                                   ['page', 'operation'], buckets=BUCKETS)
+            start_http_server(int(port))
+    return _histogram
+
+
+def record(operation, started, depth):
+    seconds = time.perf_counter() - started
+    page = getattr(_local, 'page', None) or 'none'
+    if _histogram is not None:
+        _histogram.labels(page, operation).observe(seconds)
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append((started, depth, operation, seconds))
+
+
+@contextlib.contextmanager
+def span(operation):
+    if _histogram is None and not _tracing:
+        yield
+        return
+
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        record(operation, started, depth)
+
+
+def timed(operation):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _histogram is None and not _tracing:
+                return function(*args, **kwargs)
+            with span(operation):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def page_render(page, debug=False):
+    # Labels every span of this rerun with the page; with debug on, also collects them
+    # as (started, depth, operation, seconds) for the debug panel
+    global _tracing
+    _local.page = page
+    _local.depth = 0
+    spans = [] if debug else None
+    _local.spans = spans
+    if debug:
+        with _lock:
+            _tracing += 1
+    try:
+        with span('render'):
+            yield spans
+    finally:
+        if debug:
+            with _lock:
+                _tracing -= 1
+        _local.spans = None
+        _local.page = None
+
+
+if METRICS_PORT:
+    start_exporter(METRICS_PORT)
@@ -0,0 +1,327 @@
+# Load test of the real app: many concurrent visitor sessions driving app.py headlessly through Streamlit's
+# app-testing API, all in this process like the sessions of one server.
+#
+#   python load_test.py --sessions 200 --duration 120
+#   python load_test.py --sessions 25,50,100,200 --mix browse=3,adopt=1 --output load.json
+#
+# Every session repeats scenarios picked by the mix weights: a list of steps (search, next, previous, similar,
+# predict, recommend) with a random think time between them. Each stage of --sessions runs for --duration and
+# reports rerun latency percentiles per step, reruns per second, and the process's memory and CPU over time,
+# so the stages show where latency starts to climb. Pet images come from an empty local mirror: the whole run
+# stays offline on the bundled data files.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+IMAGE_MIRROR_DIR = os.path.join('.cache', 'load_test', 'images')
+SCENARIOS = {
+    'browse': ['search', 'next', 'next', 'previous', 'similar', 'next'],
+    'adopt': ['search', 'next', 'predict', 'recommend'],
+    'full': ['search', 'next', 'previous', 'predict', 'recommend'],
+}
+DEFAULT_MIX = 'browse=2,adopt=1,full=1'
+PET_TYPES = ['Any', 'Cat', 'Dog']
+SEARCH_QUERIES = ['', '', 'calm senior cat good with kids', 'playful puppy', 'house trained', 'friendly dog good with cats']
+# How often a waiting session reruns while a model result is calculating, like the page's polling fragment
+POLL_INTERVAL = 0.5
+PERCENTILES = [50, 90, 95, 99]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def rss_mb():
+    # Current resident memory from /proc; the peak where /proc isn't available
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+class Recorder:
+    # Latencies and errors of every step, shared by the session threads
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.messages = []
+        self.reruns = 0
+        self.scenarios = 0
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def record(self, step, seconds, error=None):
+        with self._lock:
+            self.latencies[step].append(seconds)
+            self.reruns += 1
+            if error:
+                self.errors[step] += 1
+                if len(self.messages) < 20:
+                    self.messages.append(f"{step}: {error}")
+
+    def add_result(self, step, seconds):
+        # Time from a model button click until its result is on the page; not a rerun of its own
+        with self._lock:
+            self.latencies[step].append(seconds)
+
+    def step_stats(self):
+        stats = {}
+        for step, seconds in sorted(self.latencies.items()):
+            ms = np.array(seconds) * 1000
+            stats[step] = dict({"count": len(ms), "errors": self.errors.get(step, 0), "mean_ms": float(ms.mean()),
+                                "max_ms": float(ms.max())},
+                               **{f"p{q}_ms": float(np.percentile(ms, q)) for q in PERCENTILES})
+        return stats
+
+
+def share_test_runtime():
+    # AppTest installs a mock Runtime for each run and removes it when the run ends, which with concurrent
+    # sessions pulls it from under the runs still going: keep the last one installed for those
+    from streamlit.runtime.runtime import Runtime
+    instance = Runtime.instance.__func__
+    last = []
+
+    def shared_instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+        return cls._instance or (last[0] if last else instance(cls))
+    Runtime.instance = classmethod(shared_instance)
+
+
+class Session:
+    # One visitor: an AppTest of app.py with its own session state
+
+    def __init__(self, recorder, rng, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.recorder = recorder
+        self.rng = rng
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def run(self, step, prepare=None):
+        started = time.perf_counter()
+        error = None
+        try:
+            if prepare:
+                prepare()
+            self.app.run()
+            if self.app.exception:
+                error = self.app.exception[0].message
+        except Exception as exc:
+            error = repr(exc)
+        self.recorder.record(step, time.perf_counter() - started, error)
+        return error is None
+
+    def button(self, key=None, label=None):
+        for button in self.app.button:
+            if (key is not None and button.key == key) or (label is not None and button.label == label):
+                return button
+        return None
+
+    def calculating(self):
+        return any(element.value == "Calculating..." for element in self.app.markdown)
+
+    def search(self):
+        def prepare():
+            self.app.sidebar.selectbox(key="filter_pet_type").set_value(self.rng.choice(PET_TYPES))
+            self.app.sidebar.text_input[0].input(self.rng.choice(SEARCH_QUERIES))
+            self.button(label="Search").click()
+        self.run('search', prepare)
+
+    def click(self, step, button):
+        if button is not None:
+            self.run(step, button.click)
+
+    def model(self, step, label):
+        button = self.button(label=label)
+        if button is None:
+            return
+        started = time.perf_counter()
+        if self.run(step, button.click):
+            while self.calculating() and self.run('poll'):
+                time.sleep(POLL_INTERVAL)
+            self.recorder.add_result(f"{step}_result", time.perf_counter() - started)
+
+    def step(self, name):
+        if name == 'search':
+            self.search()
+        elif name == 'next':
+            self.click(name, self.button(key="right"))
+        elif name == 'previous':
+            self.click(name, self.button(key="left"))
+        elif name == 'similar':
+            similar = [button for button in self.app.button if (button.key or '').startswith('similar_')]
+            self.click(name, self.rng.choice(similar) if similar else None)
+        elif name == 'predict':
+            self.model(name, "Predict addoption")
+        elif name == 'recommend':
+            self.model(name, "Recommended owners")
+
+
+def run_session(recorder, mix, deadline, think, timeout, seed):
+    rng = random.Random(seed)
+    with recorder._lock:
+        recorder.active += 1
+    try:
+        session = Session(recorder, rng, timeout)
+        session.run('load')
+        names, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            for step in SCENARIOS[rng.choices(names, weights)[0]]:
+                if think > 0:
+                    time.sleep(min(rng.expovariate(1 / think), max(0.0, deadline - time.monotonic())))
+                if time.monotonic() >= deadline:
+                    return
+                session.step(step)
+            with recorder._lock:
+                recorder.scenarios += 1
+    finally:
+        with recorder._lock:
+            recorder.active -= 1
+
+
+def sample(recorder, started, stop, interval, timeline):
+    # Process memory, CPU and throughput every interval seconds while the stage runs
+    last_time, last_cpu, last_reruns = time.perf_counter(), cpu_seconds(), 0
+    while not stop.wait(interval):
+        now, cpu = time.perf_counter(), cpu_seconds()
+        with recorder._lock:
+            reruns, active = recorder.reruns, recorder.active
+        timeline.append({
+            "t_s": round(now - started, 2),
+            "sessions": active,
+            "reruns_per_s": (reruns - last_reruns) / (now - last_time),
+            "cpu_percent": 100 * (cpu - last_cpu) / (now - last_time),
+            "rss_mb": rss_mb(),
+            "threads": threading.active_count(),
+        })
+        last_time, last_cpu, last_reruns = now, cpu, reruns
+
+
+def run_stage(sessions, mix, duration, ramp, think, timeout, interval, seed):
+    recorder = Recorder()
+    timeline = []
+    started = time.perf_counter()
+    deadline = time.monotonic() + duration
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample, args=(recorder, started, stop, interval, timeline), daemon=True)
+    sampler.start()
+
+    threads = []
+    for i in range(sessions):
+        thread = threading.Thread(target=run_session, args=(recorder, mix, deadline, think, timeout, seed + i),
+                                  name=f"load-session-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+        if ramp > 0:
+            time.sleep(ramp / sessions)
+    for thread in threads:
+        thread.join()
+    stop.set()
+    sampler.join()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "sessions": sessions,
+        "elapsed_s": elapsed,
+        "reruns": recorder.reruns,
+        "reruns_per_s": recorder.reruns / elapsed,
+        "scenarios_completed": recorder.scenarios,
+        "peak_rss_mb": max([point["rss_mb"] for point in timeline] or [rss_mb()]),
+        "mean_cpu_percent": float(np.mean([point["cpu_percent"] for point in timeline])) if timeline else None,
+        "steps": recorder.step_stats(),
+        "errors": recorder.messages,
+        "timeline": timeline,
+    }
+
+
+def print_stage(stage):
+    print(f"{stage['sessions']} sessions: {stage['reruns_per_s']:.1f} reruns/s, {stage['scenarios_completed']} scenarios, "
+          f"peak RSS {stage['peak_rss_mb']:.0f} MB, mean CPU {stage['mean_cpu_percent'] or 0:.0f}%", file=sys.stderr)
+    print(f"  {'step':<18} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}", file=sys.stderr)
+    for step, stats in stage["steps"].items():
+        print(f"  {step:<18} {stats['count']:>6} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} ms"
+              f"{'  errors: %d' % stats['errors'] if stats['errors'] else ''}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the 4Paws app with concurrent headless sessions.")
+    parser.add_argument("--sessions", default="20", help="comma-separated concurrent session counts, one stage each (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per stage (default: %(default)s)")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which a stage's sessions start (default: %(default)s)")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between steps in seconds (default: %(default)s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights out of {', '.join(SCENARIOS)} (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds one rerun may take (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between memory/CPU samples (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    # Before the app is imported: image prefetching reads the (empty) mirror instead of the network
+    os.makedirs(IMAGE_MIRROR_DIR, exist_ok=True)
+    os.environ.setdefault('FOURPAWS_IMAGE_MIRROR', os.path.abspath(IMAGE_MIRROR_DIR))
+    # Every headless session warns about its missing browser connection, every missing image about the mirror
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(
+        lambda record: 'missing ScriptRunContext' not in record.getMessage())
+    logging.getLogger('pet_images').setLevel(logging.ERROR)
+    share_test_runtime()
+
+    stages = []
+    for sessions in [int(count) for count in args.sessions.split(',')]:
+        stage = run_stage(sessions, mix, args.duration, args.ramp, args.think, args.timeout, args.interval, args.seed)
+        print_stage(stage)
+        stages.append(stage)
+
+    report = {
+        "meta": {
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mix": mix,
+            "duration_s": args.duration,
+            "ramp_s": args.ramp,
+            "think_s": args.think,
+        },
+        "stages": stages,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
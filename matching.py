@@ -0,0 +1,156 @@
+import threading
+
+import numpy as np
+
+from catalog import intersect_sorted, merge_postings
+from instrumentation import timed
+from recommender import OWNER_FEATURES, SIMILARITY_FEATURES, encode_survey, load_encoded_survey, pet_vectors, \
+    similarity_kernel, weighted_averages
+
+
+# Adopter -> pets, the reverse of recommendation_engine. A pet sits at its transform_data_pets features
+# followed by the owner profile the survey predicts for it; an adopter sits at their own answers for the
+# same survey columns. Distances are Euclidean, scores use the recommender's (1 / (distance + 1)) ** 2.
+MATCH_FEATURES = SIMILARITY_FEATURES + [f"owner_{feature}" for feature in OWNER_FEATURES]
+# Nearest distinct points fetched from the tree per round while looking for k matching pets
+FETCH_POINTS = 8
+
+
+def adopter_vector(answers):
+    # answers: one survey response in the columns of survey_results_modified.xlsx
+    import pandas as pd
+    row = encode_survey(pd.DataFrame([answers])).iloc[0]
+    return np.array([row[feature] for feature in SIMILARITY_FEATURES + OWNER_FEATURES], dtype=np.float64)
+
+
+class PetMatcher:
+    # Pet features are a handful of categorical flags, so the whole catalog collapses onto a few hundred
+    # distinct points. The KD-tree is built over those points and each point keeps a sorted array of the
+    # catalog rows placed on it, so a query costs a few tree lookups plus the rows it returns,
+    # independent of the catalog size. Filters are applied by intersecting each visited point's rows with
+    # the (index-backed) search result instead of scanning the catalog.
+
+    def __init__(self, store):
+        self.store = store
+        self.pet_points = np.empty((0, len(SIMILARITY_FEATURES)), dtype=np.float64)
+        self.point_ids = {}
+        self.postings = []
+        self.row_points = np.empty(0, dtype=np.int32)
+        self.survey = None
+        self.tree = None
+        self._lock = threading.RLock()
+        with store.lock:
+            self.rebuild()
+            store.subscribe(self.on_catalog_change, lambda store: self.rebuild())
+
+    def rebuild(self):
+        with self.store.lock, self._lock:
+            rows = self.store.index.all_rows
+            vectors = pet_vectors([self.store.records[row] for row in rows])
+            points, inverse = np.unique(vectors, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.searchsorted(inverse[order], np.arange(len(points) + 1))
+
+            self.pet_points = points
+            self.point_ids = {tuple(point): i for i, point in enumerate(points)}
+            self.postings = [rows[order[bounds[i]:bounds[i + 1]]] for i in range(len(points))]
+            self.row_points = np.full(len(self.store.records), -1, dtype=np.int32)
+            self.row_points[rows] = inverse
+            self.build_tree()
+
+    def build_tree(self):
+        # Owner profiles depend on the survey, so they are recomputed (per distinct point) with the tree
+        from scipy.spatial import cKDTree
+        self.survey = load_encoded_survey()
+        pet_matrix, owner_columns = self.survey
+        profiles = weighted_averages(similarity_kernel(pet_matrix, self.pet_points), owner_columns)
+        self.tree = cKDTree(np.hstack([self.pet_points, profiles])) if len(self.pet_points) else None
+
+    def point_id(self, vector):
+        key = tuple(vector)
+        point = self.point_ids.get(key)
+        if point is None:
+            point = self.point_ids[key] = len(self.postings)
+            self.pet_points = np.vstack([self.pet_points, vector])
+            self.postings.append(np.empty(0, dtype=np.int32))
+        return point
+
+    def on_catalog_change(self, store, changed_rows):
+        # Moves changed rows between points; the tree is only rebuilt when a pet lands on a new point
+        with self._lock:
+            if len(store.records) > len(self.row_points):
+                grow = len(store.records) - len(self.row_points)
+                self.row_points = np.concatenate([self.row_points, np.full(grow, -1, dtype=np.int32)])
+
+            points_before = len(self.postings)
+            removed = {}
+            added = {}
+            for row in changed_rows:
+                record = store.records[row]
+                old = int(self.row_points[row])
+                new = -1 if record is None else self.point_id(pet_vectors([record])[0])
+                if old == new:
+                    continue
+                if old >= 0:
+                    removed.setdefault(old, []).append(row)
+                if new >= 0:
+                    added.setdefault(new, []).append(row)
+                self.row_points[row] = new
+
+            for point in set(removed) | set(added):
+                self.postings[point] = merge_postings(self.postings[point], removed.get(point), added.get(point))
+            if len(self.postings) != points_before:
+                self.build_tree()
+
+    def ensure_current(self):
+        if load_encoded_survey() is not self.survey:
+            with self._lock:
+                self.build_tree()
+
+    def match(self, vector, k=10, allowed=None):
+        # [(row, score)] of the k pets closest to vector, best first; allowed limits them to a sorted row array.
+        # Pets on the same point are equally close and come in catalog order.
+        self.ensure_current()
+        with self._lock:
+            if self.tree is None:
+                return []
+            n_points = len(self.postings)
+            matches = []
+            visited = 0
+            fetch = min(n_points, FETCH_POINTS)
+            while len(matches) < k and visited < n_points:
+                distances, points = self.tree.query(vector, k=fetch)
+                distances, points = np.atleast_1d(distances), np.atleast_1d(points)
+                for distance, point in zip(distances[visited:], points[visited:]):
+                    rows = self.postings[point]
+                    if allowed is not None:
+                        rows = intersect_sorted(rows, allowed)
+                    score = (1 / (distance + 1)) ** 2
+                    matches.extend((int(row), float(score)) for row in rows[:k - len(matches)])
+                    if len(matches) >= k:
+                        break
+                visited = fetch
+                fetch = min(n_points, fetch * 4)
+            return matches
+
+
+_matchers = []
+_matchers_lock = threading.Lock()
+
+
+def pet_matcher(store):
+    # Matcher for the current catalog store, kept up to date through its delta listener
+    with _matchers_lock:
+        if _matchers and _matchers[0].store is store:
+            return _matchers[0]
+        matcher = PetMatcher(store)
+        _matchers[:] = [matcher]
+        return matcher
+
+
+@timed('match_pets')
+def match_pets(store, answers, k=10, **criterias):
+    # Top-k pets of the catalog for one adopter's survey answers, optionally within search criterias
+    allowed = store.search(**criterias) if criterias else None
+    return pet_matcher(store).match(adopter_vector(answers), k, allowed)
@@ -0,0 +1,74 @@
+# Model calls behind the pet page buttons, run on a small worker pool shared by all sessions so a slow
+# prediction never holds up a page render. Results are memoized per pet and model version: repeated and
+# concurrent requests for the same pet share one computation.
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from adoption_model import artifact_key, flat_artifact_path, pet_features, stamp_or_none
+from recommender import SURVEY_PATH, pet_vectors
+
+logger = logging.getLogger(__name__)
+
+# Model calls running at once; the rest queue, whatever the number of sessions clicking
+MODEL_WORKERS = 2
+# Finished results kept, least recently used dropped first
+RESULTS_SIZE = 4096
+
+_executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix='model-jobs')
+_results = OrderedDict()
+_lock = threading.Lock()
+
+
+def adoption_key(pet):
+    # The model version is read from a stat() of its artifact, so building the key never loads or trains it.
+    # The model inputs are part of the key too: a pet edited by a delta gets a fresh prediction.
+    model_key = artifact_key()
+    return ('adoption', pet['pet_id'], model_key, stamp_or_none(flat_artifact_path(model_key)), tuple(pet_features(pet)))
+
+
+def owners_key(pet):
+    return ('owners', pet['pet_id'], stamp_or_none(SURVEY_PATH), tuple(pet_vectors([pet])[0]))
+
+
+def forget_failed(key, future):
+    # A failed call isn't memoized, so the next request retries it
+    if future.exception() is not None:
+        with _lock:
+            if _results.get(key) is future:
+                del _results[key]
+
+
+def submit(key, function, *args):
+    # Future of function(*args), shared by everyone asking for the same key
+    with _lock:
+        future = _results.get(key)
+        if future is not None:
+            _results.move_to_end(key)
+            return future
+        future = _results[key] = _executor.submit(function, *args)
+        while len(_results) > RESULTS_SIZE:
+            _results.popitem(last=False)
+    future.add_done_callback(lambda done: forget_failed(key, done))
+    return future
+
+
+def submit_pet(make_key, function, pet):
+    # submit() keyed by make_key(pet). The key is built during the page render: if that fails, the returned
+    # future fails like the job would, so the page shows its error message instead of crashing the rerun.
+    try:
+        key = make_key(pet)
+    except Exception as error:
+        logger.exception("Could not build the model job key of pet %s", pet.get('pet_id'))
+        future = Future()
+        future.set_exception(error)
+        return future
+    return submit(key, function, pet)
+
+
+def stats():
+    with _lock:
+        pending = sum(1 for future in _results.values() if not future.done())
+        return {"results": len(_results) - pending, "pending": pending}
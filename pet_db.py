@@ -0,0 +1,305 @@
+# Optional SQLite home for the pet catalog, for deployments where staff edit pets while visitors browse.
+#
+#   python pet_db.py import [cats_and_dogs.json] [--db cats_and_dogs.db]    (re)load the catalog from JSON
+#   python pet_db.py apply edits.jsonl [--db cats_and_dogs.db]              apply add/update/remove events
+#   python pet_db.py find --pet_type Cat --age Adult [--db cats_and_dogs.db]
+#   FOURPAWS_CATALOG_DB=cats_and_dogs.db streamlit run app.py
+#
+# The database runs in WAL mode: any number of readers work on a consistent snapshot while one writer
+# commits. Every write is logged in pet_changes, and the app's catalog store follows that log
+# instead of re-reading the catalog.
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import uuid
+
+from catalog import CATALOG_PATH, FIELDS, CatalogStore, normalize
+
+DB_PATH = 'cats_and_dogs.db'
+# Sidebar filters, each backed by its own index
+FILTER_FIELDS = ('pet_type', 'primary_breed', 'age', 'gender', 'size', 'coat_length', 'medical_care')
+# Stored as JSON text; characteristics live in their own table
+JSON_FIELDS = ('good_with', 'tags')
+BOOLEAN_FIELDS = ('mixed_breed',)
+COLUMNS = tuple(field for field in FIELDS if field != 'characteristics')
+# Seconds a writer waits for another writer before giving up
+BUSY_TIMEOUT = 10
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    # catalog_row is the pet's position in the catalog; pet_id isn't unique in cats_and_dogs.json
+    "CREATE TABLE IF NOT EXISTS pets (catalog_row INTEGER PRIMARY KEY AUTOINCREMENT, "
+    + ", ".join(f"{field} {'INTEGER' if field in ('pet_id', 'adoption_fee') + BOOLEAN_FIELDS else 'TEXT'}"
+                + (" COLLATE NOCASE" if field in FILTER_FIELDS else "") for field in COLUMNS)
+    + ", extra TEXT)",
+    "CREATE TABLE IF NOT EXISTS pet_characteristics (catalog_row INTEGER NOT NULL REFERENCES pets(catalog_row) ON DELETE CASCADE, "
+    "position INTEGER NOT NULL, characteristic TEXT NOT NULL COLLATE NOCASE, PRIMARY KEY (catalog_row, position))",
+    "CREATE INDEX IF NOT EXISTS pet_characteristics_characteristic ON pet_characteristics (characteristic, catalog_row)",
+    "CREATE INDEX IF NOT EXISTS pets_pet_id ON pets (pet_id)",
+    *[f"CREATE INDEX IF NOT EXISTS pets_{field} ON pets ({field})" for field in FILTER_FIELDS],
+    "CREATE TABLE IF NOT EXISTS pet_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, pet_id INTEGER NOT NULL)",
+]
+
+
+def pet_values(pet):
+    # Column values of one pet dict, in COLUMNS order, followed by the fields outside the schema
+    values = []
+    for field in COLUMNS:
+        value = pet.get(field)
+        if field in JSON_FIELDS and value is not None:
+            value = json.dumps(value)
+        elif field in BOOLEAN_FIELDS and value is not None:
+            value = int(value)
+        values.append(value)
+    extra = {key: value for key, value in pet.items() if key not in FIELDS}
+    return values + [json.dumps(extra) if extra else None]
+
+
+def pet_from_row(values, characteristics):
+    columns = dict(zip(COLUMNS, values))
+    pet = {}
+    for field in FIELDS:
+        value = characteristics if field == 'characteristics' else columns[field]
+        if field in JSON_FIELDS and value is not None:
+            value = json.loads(value)
+        elif field in BOOLEAN_FIELDS and value is not None:
+            value = bool(value)
+        pet[field] = value
+    if values[len(COLUMNS)]:
+        pet.update(json.loads(values[len(COLUMNS)]))
+    return pet
+
+
+class PetDatabase:
+    # One connection per thread; sqlite3 connections can't be shared between threads
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self.transaction() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('catalog_id', ?)", (uuid.uuid4().hex,))
+
+    def connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode, NORMAL only syncs at checkpoints: a power cut can lose the last commits, never corrupt
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            self._local.db = db
+        return db
+
+    def transaction(self, write=True):
+        # BEGIN IMMEDIATE takes the write lock up front, so two writers queue instead of failing mid-way
+        return Transaction(self.connection(), "BEGIN IMMEDIATE" if write else "BEGIN")
+
+    def insert(self, db, pet, row=None):
+        cursor = db.execute(f"INSERT INTO pets (catalog_row, {', '.join(COLUMNS)}, extra) VALUES ({', '.join('?' * (len(COLUMNS) + 2))})",
+                            [row] + pet_values(pet))
+        db.executemany("INSERT INTO pet_characteristics VALUES (?, ?, ?)",
+                       [(cursor.lastrowid, position, value) for position, value in enumerate(pet.get('characteristics') or [])])
+
+    def read_pets(self, db, where="", params=(), with_rows=False):
+        # Pets in catalog order; (catalog_row, pet) pairs with_rows
+        rows = db.execute(f"SELECT catalog_row, {', '.join(COLUMNS)}, extra FROM pets {where} ORDER BY catalog_row", params).fetchall()
+        characteristics = {}
+        if rows:
+            selected = "" if not where else f"WHERE catalog_row IN (SELECT catalog_row FROM pets {where})"
+            for row, value in db.execute(f"SELECT catalog_row, characteristic FROM pet_characteristics {selected} ORDER BY catalog_row, position", params):
+                characteristics.setdefault(row, []).append(value)
+        pets = [pet_from_row(values[1:], characteristics.get(values[0], [])) for values in rows]
+        return list(zip([values[0] for values in rows], pets)) if with_rows else pets
+
+    def import_json(self, path=CATALOG_PATH):
+        # Replaces the whole catalog in one transaction; readers keep the previous catalog until it commits
+        with open(path, 'r') as f:
+            pets = json.load(f)
+        with self.transaction() as db:
+            db.execute("DELETE FROM pet_characteristics")
+            db.execute("DELETE FROM pets")
+            for row, pet in enumerate(pets):
+                self.insert(db, pet, row)
+            db.execute("UPDATE meta SET value = ? WHERE key = 'catalog_id'", (uuid.uuid4().hex,))
+        self.connection().execute("ANALYZE")
+        return len(pets)
+
+    def apply_events(self, events):
+        # add/update/remove events keyed by pet_id, with the delta feed's semantics; all or nothing
+        changed = []
+        with self.transaction() as db:
+            for event in events:
+                op = event.get('op')
+                pet_id = event.get('pet_id')
+                pet = event.get('pet') or {}
+                if op not in ('add', 'update', 'remove'):
+                    raise ValueError(f"Unknown catalog event op: {op!r}")
+                current = self.read_pets(db, "WHERE pet_id = ?", (pet_id,))
+                rows = [row for (row,) in db.execute("SELECT catalog_row FROM pets WHERE pet_id = ? ORDER BY catalog_row", (pet_id,))]
+                db.execute("DELETE FROM pets WHERE pet_id = ?", (pet_id,))
+                if op != 'remove':
+                    for row, old in zip(rows or [None], current or [None]):
+                        fields = dict(pet) if op == 'add' or old is None else {**old, **pet}
+                        fields['pet_id'] = pet_id
+                        self.insert(db, fields, row)
+                db.execute("INSERT INTO pet_changes (pet_id) VALUES (?)", (pet_id,))
+                changed.append(pet_id)
+        return changed
+
+    def find_pets(self, **criterias):
+        # Pets matching the sidebar criterias, in catalog order; 'any' leaves a field unfiltered.
+        # Each criteria is an indexed equality (case-insensitive, like the in-memory index).
+        clauses = []
+        params = []
+        for field, value in criterias.items():
+            if normalize(value) == 'any':
+                continue
+            if field in FILTER_FIELDS:
+                clauses.append(f"{field} = ?")
+            elif field == 'characteristics':
+                clauses.append("catalog_row IN (SELECT catalog_row FROM pet_characteristics WHERE characteristic = ?)")
+            else:
+                raise ValueError(f"Pets can't be searched by {field!r}")
+            params.append(str(value))
+        with self.transaction(write=False) as db:
+            return self.read_pets(db, "WHERE " + " AND ".join(clauses) if clauses else "", params)
+
+    def snapshot(self):
+        # (catalog_id, last change seq, [(catalog_row, pet)]) read in one transaction
+        with self.transaction(write=False) as db:
+            catalog_id, seq = self.position(db)
+            return catalog_id, seq, self.read_pets(db, with_rows=True)
+
+    def position(self, db):
+        catalog_id = db.execute("SELECT value FROM meta WHERE key = 'catalog_id'").fetchone()[0]
+        seq = db.execute("SELECT COALESCE(MAX(seq), 0) FROM pet_changes").fetchone()[0]
+        return catalog_id, seq
+
+    def changes_since(self, seq):
+        # (catalog_id, seq, events) bringing a reader at seq up to date: for every changed pet_id either a remove,
+        # or one add per row it has now, with that row's pet and catalog_row (pet_id isn't unique)
+        with self.transaction(write=False) as db:
+            catalog_id, last = self.position(db)
+            pet_ids = list(dict.fromkeys(pet_id for (pet_id,) in db.execute(
+                "SELECT pet_id FROM pet_changes WHERE seq > ? ORDER BY seq", (seq,))))
+            events = []
+            for pet_id in pet_ids:
+                rows = self.read_pets(db, "WHERE pet_id = ?", (pet_id,), with_rows=True)
+                events.extend({'op': 'add', 'pet_id': pet_id, 'pet': pet, 'catalog_row': row} for row, pet in rows)
+                if not rows:
+                    events.append({'op': 'remove', 'pet_id': pet_id})
+            return catalog_id, last, events
+
+
+class Transaction:
+
+    def __init__(self, db, begin):
+        self.db = db
+        self.begin = begin
+
+    def __enter__(self):
+        self.db.execute(self.begin)
+        return self.db
+
+    def __exit__(self, kind, value, traceback):
+        self.db.execute("COMMIT" if kind is None else "ROLLBACK")
+
+
+_databases = {}
+_stores = {}
+_lock = threading.Lock()
+
+
+def pet_database(path=DB_PATH):
+    with _lock:
+        if path not in _databases:
+            _databases[path] = PetDatabase(path)
+        return _databases[path]
+
+
+def store_events(store, rows, events):
+    # Database changes as catalog store events: each add targets the store row holding its catalog_row.
+    # A pet whose catalog rows are new (removed and added again) loses its old store rows and gets new ones
+    # at the end, like the new rows at the end of the table. rows: catalog_row -> store row, kept up to date.
+    changes = {}
+    for event in events:
+        changes.setdefault(event['pet_id'], []).append(event)
+    translated = []
+    next_row = len(store.records)
+    for pet_id, pet_events in changes.items():
+        if pet_events[0]['op'] == 'remove':
+            translated.append({'op': 'remove', 'pet_id': pet_id})
+            continue
+        current = store.rows_by_pet_id.get(pet_id) or []
+        if sorted(rows.get(event['catalog_row'], -1) for event in pet_events) != sorted(current):
+            if current:
+                translated.append({'op': 'remove', 'pet_id': pet_id})
+            for event in pet_events:
+                rows[event['catalog_row']] = next_row
+                next_row += 1
+        translated.extend({'op': 'add', 'pet_id': pet_id, 'pet': event['pet'], 'row': rows[event['catalog_row']]}
+                          for event in pet_events)
+    return translated
+
+
+def database_store(path=DB_PATH, previous=None):
+    # Catalog store of the database: read whole once per import, then kept current from the change log.
+    # previous: the store of the last import, whose rows the new one carries over.
+    db = pet_database(path)
+    cached = _stores.get(path)
+    if cached is None:
+        with _lock:
+            cached = _stores.get(path)
+            if cached is None:
+                catalog_id, seq, pets = db.snapshot()
+                store = CatalogStore([pet for row, pet in pets], previous=previous)
+                store.source = f"sqlite:{catalog_id}"
+                store.delta_offset = seq
+                cached = _stores[path] = (catalog_id, store, {row: position for position, (row, pet) in enumerate(pets)})
+
+    catalog_id, store, rows = cached
+    with store.lock:
+        current_id, seq, events = db.changes_since(store.delta_offset)
+        if current_id != catalog_id:
+            # Re-imported: start over from the new catalog
+            _stores.pop(path, None)
+            return database_store(path, previous=store)
+        if events:
+            store.apply_events(store_events(store, rows, events))
+        store.delta_offset = seq
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite storage for the 4Paws pet catalog.")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="replace the catalog with a cats_and_dogs.json file")
+    importer.add_argument("json", nargs="?", default=CATALOG_PATH)
+    apply = commands.add_parser("apply", help="apply a JSON Lines file of add/update/remove events")
+    apply.add_argument("events")
+    find = commands.add_parser("find", help="print the pets matching the given filters as JSON Lines")
+    for field in FILTER_FIELDS + ('characteristics',):
+        find.add_argument(f"--{field}", default="Any")
+    args = parser.parse_args()
+
+    db = PetDatabase(args.db)
+    if args.command == "import":
+        print(f"Imported {db.import_json(args.json)} pets into {args.db}")
+    elif args.command == "apply":
+        with open(args.events, 'r') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        print(f"Applied {len(db.apply_events(events))} events to {args.db}")
+    else:
+        criterias = {field: getattr(args, field) for field in FILTER_FIELDS + ('characteristics',)}
+        for pet in db.find_pets(**criterias):
+            sys.stdout.write(json.dumps(pet) + "\n")
+
+
+if __name__ == "__main__":
+    main()
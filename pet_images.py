@@ -0,0 +1,145 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from assets import STATIC_DIR, STATIC_URL, data_uri
+from file_versions import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Originals, stored once under the hash of their content
+ORIGINALS_DIR = os.path.join('.cache', 'images')
+# Resized variants live under static/ so Streamlit can serve them directly
+VARIANTS_DIR = os.path.join(STATIC_DIR, 'pets')
+# Square sizes: the pet page shows a 700px circle
+VARIANTS = {'thumbnail': 200, 'display': 700}
+# Optional local stand-in for the image CDN: a directory or base URL that mirrors the original URL paths
+IMAGE_MIRROR = os.environ.get('FOURPAWS_IMAGE_MIRROR')
+# How many pets ahead of the current one get their images warmed
+PREFETCH_AHEAD = 3
+# URLs that failed are not fetched again for this many seconds; at most FAILED_LIMIT of them are remembered
+FAILED_TTL = 600
+FAILED_LIMIT = 4096
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='pet-images')
+_pending = {}
+_ready = {}
+# url -> (monotonic time it may be retried, failures so far), oldest first
+_failed = OrderedDict()
+_lock = threading.Lock()
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:24]
+
+
+def variant_path(content_hash, variant):
+    return os.path.join(VARIANTS_DIR, f"{content_hash}-{variant}.jpg")
+
+
+def url_index_path(url):
+    # Small pointer file: source URL -> content hash of what it served
+    return os.path.join(ORIGINALS_DIR, 'urls', url_key(url))
+
+
+def fetch_source(url):
+    if IMAGE_MIRROR:
+        path = urllib.parse.urlparse(url).path.lstrip('/')
+        if os.path.isdir(IMAGE_MIRROR):
+            with open(os.path.join(IMAGE_MIRROR, path), 'rb') as f:
+                return f.read()
+        url = f"{IMAGE_MIRROR.rstrip('/')}/{path}"
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read()
+
+
+def render_variant(original, size):
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(original))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+def build_variants(url):
+    # Fetch once, store the original by content hash and write every resized variant
+    index_path = url_index_path(url)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            content_hash = f.read().strip()
+        if all(os.path.exists(variant_path(content_hash, variant)) for variant in VARIANTS):
+            return content_hash
+
+    original = fetch_source(url)
+    content_hash = hashlib.sha256(original).hexdigest()[:24]
+    original_path = os.path.join(ORIGINALS_DIR, content_hash)
+    if not os.path.exists(original_path):
+        write_atomic(original_path, lambda f: f.write(original))
+
+    for variant, size in VARIANTS.items():
+        path = variant_path(content_hash, variant)
+        if not os.path.exists(path):
+            rendered = render_variant(original, size)
+            write_atomic(path, lambda f: f.write(rendered))
+
+    write_atomic(index_path, lambda f: f.write(content_hash.encode()))
+    return content_hash
+
+
+def record_failure(url, error):
+    # Only the first failure of a URL is a warning; its retries after FAILED_TTL log at debug level
+    with _lock:
+        failures = _failed.pop(url, (0, 0))[1] + 1
+        _failed[url] = (time.monotonic() + FAILED_TTL, failures)
+        while len(_failed) > FAILED_LIMIT:
+            _failed.popitem(last=False)
+    if failures == 1:
+        logger.warning("Could not cache pet image %s: %s", url, error)
+    else:
+        logger.debug("Could not cache pet image %s (failure %d): %s", url, failures, error)
+
+
+def process(url):
+    try:
+        content_hash = build_variants(url)
+        with _lock:
+            _ready[url] = content_hash
+            _failed.pop(url, None)
+    except Exception as error:
+        record_failure(url, error)
+    finally:
+        with _lock:
+            _pending.pop(url, None)
+
+
+def prefetch(urls):
+    # Queues images for the worker pool; already cached or queued ones are skipped, and so are recent failures
+    now = time.monotonic()
+    with _lock:
+        for url in urls:
+            if url and url not in _ready and url not in _pending and _failed.get(url, (0, 0))[0] <= now:
+                _pending[url] = _executor.submit(process, url)
+
+
+def pet_image_src(url, variant='display'):
+    # Local resized copy when it is ready; otherwise queue it and let the browser use the original this time
+    content_hash = _ready.get(url)
+    if content_hash is None:
+        prefetch([url])
+        return url
+
+    path = variant_path(content_hash, variant)
+    if st.get_option('server.enableStaticServing'):
+        return f"{STATIC_URL}/pets/{os.path.basename(path)}"
+    return data_uri(path)
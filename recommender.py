@@ -0,0 +1,213 @@
+import os
+import threading
+
+import numpy as np
+
+from file_versions import file_fingerprint, file_stamp, write_atomic
+from instrumentation import timed
+from shared_artifacts import load_arrays
+
+
+SURVEY_PATH = 'survey_results_modified.xlsx'
+CACHE_DIR = '.cache'
+
+# Bump when load_data or survey_arrays change how the survey is encoded
+SURVEY_ENCODING_VERSION = 1
+
+# Columns the pet is compared on, and the owner attributes predicted from the most similar answers
+SIMILARITY_FEATURES = ['age_pet', 'vaccine_pet', 'allergies_pet', 'shelter_time', 'special_needs?', 'dog', 'cat', 'pet_male', 'pet_female']
+OWNER_FEATURES = ['age', 'gender', 'living', 'activity', 'experience', 'shelter_time', 'special_needs?']
+
+# Upper bound on pets x survey rows held in the broadcast distance block at once
+KERNEL_BLOCK_SIZE = 1 << 20
+
+_encoded_surveys = {}
+_lock = threading.Lock()
+
+
+@timed('load_data')
+def load_data(path=SURVEY_PATH):
+    # Only runs to (re)build the encoded survey cache, so pandas stays out of a warm start
+    import pandas as pd
+    return encode_survey(pd.read_excel(path))
+
+
+def encode_survey(data):
+    # Survey responses in the columns of survey_results_modified.xlsx
+    # Making all data between 0-1
+    data['age'] = (data['age'] - 19) / (52 - 19)
+    data['gender'] = data['gender'].replace({'Male': 0, 'Female': 1})
+    data['living'] = data['living'].replace({'Apartment': 0, 'Other:Flat': 0, 'House': 1, 'Other:Apartment with garden ': 1})
+    data['activity'] = (data['activity'].fillna(1) - 1) / 8
+    data['experience'] = data['experience'].replace({'Experienced': 0, 'First-time owner': 1})
+    data['dog'] = data['type'].replace({'Dog': 1, 'Cat': 0, 'Other:Keine': 1, 'Other': 0, 'Other:crocodile': 0})
+    data['cat'] = data['type'].replace({'Dog': 0, 'Cat': 1, 'Other:Keine': 0, 'Other': 0, 'Other:crocodile': 0})
+    data['pet_male'] = data['gender_pet'].fillna('Any').replace({'Male': 1, 'Female': 0, 'Any': 0})
+    data['pet_female'] = data['gender_pet'].fillna('Any').replace({'Male': 0, 'Female': 1, 'Any': 0})
+    data['age_pet'] = data['age_pet'].replace({'Young': 0, 'Adult': 1})
+    data['vaccine_pet'] = data['vaccine_pet'].replace({'No, vaccination is not so important for me': 0, "Yes, i'm ready to take only vaccinated pet": 1})
+    data['allergies_pet'] = data['allergies_pet'].replace({'No': 0, 'Yes': 1})
+    data['shelter_time'] = data['shelter_time'].replace({1: 0, 2: 0.5, 3: 1})
+    data['special_needs?'] = data['special_needs?'].replace({'No': 0, 'Yes': 1})
+    data = data.drop(columns=['type', 'gender_pet', 'size_pet'])
+    return data
+
+
+def transform_data_pets(row):
+    # Missing fields (None or absent, e.g. from a partial delta) encode like an unrecognised value
+    age = row.get('age')
+    age_group = 0.33 if age == 'Baby' else 0 if age == 'Young' else 1 if age == 'Adult' else 0.66 if age == 'Senior' else -1
+    cat_type = 1 if row.get('pet_type') == 'Cat' else 0
+    dog_type = 1 if row.get('pet_type') == 'Dog' else 0
+    allergies = 0
+    size = 0 if row.get('size') == 'Small' else 1 if row.get('size') == 'Medium' else 2
+    shelter_period_category = 0 if '>30' in (row.get('days_on_petfinder') or '') else 0.5
+    health_condition = 0 if row.get('medical_care') == 'no special needs' else 1
+    vaccination = 1 if 'Shots Current' in (row.get('characteristics') or ()) else 0
+    pet_gender_male = 1 if row.get('gender') == 'Male' else 0
+    pet_gender_female = 1 if row.get('gender') == 'Female' else 0
+
+    new_pet = {
+        'age_pet': age_group,
+        'vaccine_pet': vaccination,
+        'allergies_pet': allergies,
+        'cat': cat_type,
+        'dog': dog_type,
+        'Size': size,
+        'shelter_time': shelter_period_category,
+        'special_needs?': health_condition,
+        'pet_male': pet_gender_male,
+        'pet_female': pet_gender_female
+    }
+    return new_pet
+
+
+def survey_arrays(data):
+    # Contiguous float blocks: survey rows x similarity features, and owner attributes x survey rows
+    pet_matrix = np.ascontiguousarray(data[SIMILARITY_FEATURES].to_numpy(dtype=np.float64))
+    owner_columns = np.ascontiguousarray(data[OWNER_FEATURES].to_numpy(dtype=np.float64).T)
+    return pet_matrix, owner_columns
+
+
+def encoded_survey_path(fingerprint):
+    return os.path.join(CACHE_DIR, f"survey-v{SURVEY_ENCODING_VERSION}-{fingerprint[:16]}.npz")
+
+
+def build_encoded_survey(path=SURVEY_PATH):
+    pet_matrix, owner_columns = survey_arrays(load_data(path))
+    cache_path = encoded_survey_path(file_fingerprint(path))
+    write_atomic(cache_path, lambda f: np.savez(f, pet_matrix=pet_matrix, owner_columns=owner_columns))
+    return pet_matrix, owner_columns
+
+
+def load_encoded_survey(path=SURVEY_PATH):
+    # Parsed workbook kept in memory for the whole process; only a stat() per call while the file is unchanged
+    stamp = file_stamp(path)
+    cached = _encoded_surveys.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with _lock:
+        cached = _encoded_surveys.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        cache_path = encoded_survey_path(file_fingerprint(path))
+        if os.path.exists(cache_path):
+            arrays = load_arrays(cache_path)
+            survey = (arrays['pet_matrix'], arrays['owner_columns'])
+        else:
+            survey = build_encoded_survey(path)
+        _encoded_surveys[path] = (stamp, survey)
+        return survey
+
+
+def pet_vectors(pets):
+    rows = [transform_data_pets(pet) for pet in pets]
+    return np.array([[row[feature] for feature in SIMILARITY_FEATURES] for row in rows], dtype=np.float64).reshape(len(rows), len(SIMILARITY_FEATURES))
+
+
+def similarity_kernel(pet_matrix, vectors):
+    # similarity = (1 / (euclidean distance + 1)) ** 2 for every (pet, survey row) pair.
+    # Squares are accumulated feature by feature, in the same order as the original per-row formula.
+    similarities = np.empty((len(vectors), len(pet_matrix)), dtype=np.float64)
+    step = max(1, KERNEL_BLOCK_SIZE // max(1, len(pet_matrix)))
+    for start in range(0, len(vectors), step):
+        block = vectors[start:start + step]
+        squared = np.zeros((len(block), len(pet_matrix)), dtype=np.float64)
+        for k in range(pet_matrix.shape[1]):
+            squared += (block[:, k, None] - pet_matrix[None, :, k]) ** 2
+        similarities[start:start + step] = (1 / (np.sqrt(squared) + 1)) ** 2
+    return similarities
+
+
+def weighted_averages(similarities, owner_columns):
+    # One weighted product for every owner attribute of every pet: (pets x rows) against (attributes x rows)
+    averages = np.empty((len(similarities), len(owner_columns)), dtype=np.float64)
+    step = max(1, KERNEL_BLOCK_SIZE // max(1, owner_columns.size))
+    for start in range(0, len(similarities), step):
+        block = similarities[start:start + step]
+        weighted_sum = (block[:, None, :] * owner_columns[None, :, :]).sum(axis=2)
+        averages[start:start + step] = weighted_sum / block.sum(axis=1)[:, None]
+    return averages
+
+
+def describe_owner(averages):
+    average_weighted_age, average_weighted_gender, average_weighted_living, average_weighted_activity, \
+        average_weighted_experience, average_weighted_concern, average_weighted_readiness = averages
+
+    # Predicting age
+    recommended_owner_age = (average_weighted_age * (52 - 19)) + 19
+
+    # Predicting gender
+    recommended_gender = 'Female' if average_weighted_gender >= 0.5 else 'Male'
+
+    # Predicting living situation
+    recommended_living = 'House or Apartment with garden' if average_weighted_living >= 0.5 else 'Apartment'
+
+    # Predicting activity level
+    recommended_activity = (average_weighted_activity * 8) + 1
+
+    # Predicting experience
+    recommended_experience = 'First-time owner' if average_weighted_experience >= 0.5 else 'Experienced'
+
+    # Predicting concerns about time in shelter
+    if average_weighted_concern < 0.5:
+        recommended_concerns = 'Not concerned'
+    elif 0.5 <= average_weighted_concern < 0.75:
+        recommended_concerns = 'Slightly concerned'
+    else:
+        recommended_concerns = 'Extremely concerned'
+
+    # Predicting readiness to take a pet with special needs
+    recommended_readiness = 'Yes' if average_weighted_readiness >= 0.5 else 'No'
+    return { "recommended_owner_age": recommended_owner_age,
+            "recommended_gender": recommended_gender,
+            "recommended_activity": recommended_activity,
+            "recommended_living conditions": recommended_living,
+            "recommended_experience with pets": recommended_experience,
+            "recommended_concerns about time in shelter": recommended_concerns
+            # "recommended_readiness": recommended_readiness
+    }
+
+
+def owner_profiles(vectors, data=None):
+    # One owner profile per row of encoded pets (see pet_vectors)
+    if data is None:
+        pet_matrix, owner_columns = load_encoded_survey()
+    else:
+        pet_matrix, owner_columns = survey_arrays(data)
+
+    similarities = similarity_kernel(pet_matrix, vectors)
+    averages = weighted_averages(similarities, owner_columns)
+    return [describe_owner(row) for row in averages]
+
+
+def recommend_owners(pets, data=None):
+    # Batch entry point: one owner profile per pet
+    return owner_profiles(pet_vectors(pets), data)
+
+
+@timed('recommendation_engine')
+def recommendation_engine(pet):
+    return recommend_owners([pet])[0]
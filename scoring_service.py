@@ -0,0 +1,227 @@
+# Headless JSON API for the adoption model and the owner recommender, no Streamlit needed.
+# Concurrent requests are micro-batched into one vectorized model call per batch.
+#
+#   python scoring_service.py --port 8600
+#
+#   POST /predict/adoption    {"pet": {...}} or {"pets": [{...}, ...]}  (records in the cats_and_dogs.json schema)
+#                             -> {"probability": p} or {"probabilities": [p, ...]}
+#   POST /recommend/owners    same body -> {"profile": {...}} or {"profiles": [{...}, ...]}
+#   GET  /stats               latency percentiles, batch sizes and rejections per endpoint
+#   GET  /health
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tornado.web
+
+from adoption_model import load_flat_forest, pet_features, predict_adoption
+from recommender import load_encoded_survey, owner_profiles, pet_vectors
+
+
+LATENCY_WINDOW = 10000
+
+
+class QueueFull(Exception):
+    pass
+
+
+class MicroBatcher:
+    # Collects the rows of concurrent requests for up to max_wait seconds (or max_batch rows)
+    # and scores them with a single call on a worker thread. The queue is bounded; when it is full
+    # new requests are rejected instead of piling up.
+
+    def __init__(self, name, score, max_batch=256, max_wait=0.002, queue_size=10000):
+        self.name = name
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batch-{name}")
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.rows = 0
+
+    async def submit(self, rows):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((rows, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFull(self.name)
+        return await future
+
+    def take_batch(self, batch, count):
+        while count < self.max_batch and not self.queue.empty():
+            item = self.queue.get_nowait()
+            batch.append(item)
+            count += len(item[0])
+        return count
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            count = self.take_batch(batch, len(batch[0][0]))
+            if count < self.max_batch and self.max_wait:
+                # Give requests that are already in flight a moment to join this batch
+                await asyncio.sleep(self.max_wait)
+                count = self.take_batch(batch, count)
+
+            rows = np.vstack([item_rows for item_rows, future in batch])
+            try:
+                results = await loop.run_in_executor(self.executor, self.score, rows)
+            except Exception as error:
+                self.failed_batches += 1
+                for item_rows, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self.batches += 1
+            self.rows += len(rows)
+            offset = 0
+            for item_rows, future in batch:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(item_rows)])
+                offset += len(item_rows)
+
+    def stats(self):
+        latencies = np.array(self.latencies, dtype=np.float64) * 1000
+        percentiles = np.percentile(latencies, [50, 90, 99]) if len(latencies) else [None] * 3
+        return {
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "mean_batch_rows": self.rows / self.batches if self.batches else None,
+            "latency_ms": {
+                "p50": percentiles[0],
+                "p90": percentiles[1],
+                "p99": percentiles[2],
+                "max": float(latencies.max()) if len(latencies) else None,
+                "window": len(latencies),
+            },
+        }
+
+
+def score_adoption(rows):
+    return [float(p) for p in predict_adoption(rows)]
+
+
+def score_owners(rows):
+    return owner_profiles(rows)
+
+
+class ScoringHandler(tornado.web.RequestHandler):
+    # Turns request pets into finite float model rows up front, so a malformed pet fails only its own
+    # request with a 400 and every batch holds rows the model can score
+
+    def initialize(self, batcher, encode, result_key, results_key):
+        self.batcher = batcher
+        self.encode = encode
+        self.result_key = result_key
+        self.results_key = results_key
+
+    async def post(self):
+        started = time.perf_counter()
+        self.batcher.requests += 1
+        try:
+            body = json.loads(self.request.body)
+            single = 'pet' in body
+            pets = [body['pet']] if single else body['pets']
+            if not isinstance(pets, list) or not all(isinstance(pet, dict) for pet in pets):
+                raise TypeError("pets must be a list of objects")
+            rows = np.array(self.encode(pets), dtype=np.float64).reshape(len(pets), -1) if pets else None
+            if rows is not None and not np.isfinite(rows).all():
+                raise ValueError("feature values must be finite numbers")
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            self.set_status(400)
+            self.finish({"error": f"invalid pet record: {error!r}"})
+            return
+        if rows is None:
+            self.finish({self.results_key: []})
+            return
+
+        try:
+            results = await self.batcher.submit(rows)
+        except QueueFull:
+            self.set_status(503)
+            self.set_header("Retry-After", "1")
+            self.finish({"error": "scoring queue is full"})
+            return
+        except Exception as error:
+            # The whole batch failed: an error for each of its requests, timed like any other response
+            self.batcher.errors += 1
+            self.batcher.latencies.append(time.perf_counter() - started)
+            self.set_status(500)
+            self.finish({"error": f"scoring failed: {error!r}"})
+            return
+
+        self.batcher.latencies.append(time.perf_counter() - started)
+        self.finish({self.result_key: results[0]} if single else {self.results_key: results})
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, batchers):
+        self.batchers = batchers
+
+    def get(self):
+        self.finish({name: batcher.stats() for name, batcher in self.batchers.items()})
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.finish({"status": "ok"})
+
+
+def make_app(max_batch=256, max_wait=0.002, queue_size=10000):
+    adoption = MicroBatcher("adoption", score_adoption, max_batch, max_wait, queue_size)
+    owners = MicroBatcher("owners", score_owners, max_batch, max_wait, queue_size)
+    app = tornado.web.Application([
+        (r"/predict/adoption", ScoringHandler,
+         dict(batcher=adoption, encode=lambda pets: [pet_features(pet) for pet in pets],
+              result_key="probability", results_key="probabilities")),
+        (r"/recommend/owners", ScoringHandler,
+         dict(batcher=owners, encode=pet_vectors, result_key="profile", results_key="profiles")),
+        (r"/stats", StatsHandler, dict(batchers={"adoption": adoption, "owners": owners})),
+        (r"/health", HealthHandler),
+    ])
+    return app, [adoption, owners]
+
+
+async def serve(port, max_batch, max_wait, queue_size):
+    # Load the model and the encoded survey before accepting traffic
+    load_flat_forest()
+    load_encoded_survey()
+
+    app, batchers = make_app(max_batch, max_wait, queue_size)
+    workers = [asyncio.create_task(batcher.run()) for batcher in batchers]
+    app.listen(port)
+    print(f"Scoring service listening on http://localhost:{port}")
+    await asyncio.gather(*workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless adoption and owner scoring service.")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--max-batch", type=int, default=256, help="rows per model call (default: %(default)s)")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="time a batch waits for more requests (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=10000, help="queued requests before rejecting with 503 (default: %(default)s)")
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.port, args.max_batch, args.max_wait_ms / 1000, args.queue_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Approximate memory held in st.session_state, for this session and for every session on the server.
+# Sizes are deep: containers include their items, numpy arrays their buffers. Objects referenced
+# more than once inside one state are counted once; arrays shared between sessions are counted in each.
+
+import sys
+
+import numpy as np
+import streamlit as st
+
+
+def deep_size(value, seen=None):
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    # numpy arrays report their own buffer here, views (slices of shared arrays) only their header
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    return size
+
+
+def state_footprint(state):
+    # key -> bytes, largest first
+    seen = set()
+    sizes = {key: deep_size(state[key], seen) for key in list(state.keys())}
+    return dict(sorted(sizes.items(), key=lambda item: -item[1]))
+
+
+def sessions_footprint():
+    # session id -> total bytes of its state. Reads Streamlit's runtime internals, so it returns None
+    # when they aren't available (bare mode, or a Streamlit version that moved them)
+    try:
+        from streamlit.runtime import Runtime
+        sessions = Runtime.instance()._session_mgr.list_active_sessions()
+        footprint = {}
+        for info in sessions:
+            session = info.session
+            state = getattr(session, 'session_state', None) or session._session_state
+            footprint[session.id] = sum(state_footprint(state.filtered_state).values())
+        return footprint
+    except Exception:
+        return None
+
+
+def show_memory_report():
+    with st.expander("Session memory", expanded=True):
+        own = state_footprint(st.session_state)
+        st.write(f"This session: {sum(own.values()) / 1024:.1f} KiB")
+        st.table([{"key": key, "KiB": round(size / 1024, 2)} for key, size in own.items()])
+
+        sessions = sessions_footprint()
+        if sessions:
+            sizes = np.array(list(sessions.values()), dtype=np.float64) / 1024
+            st.write(f"All sessions: {len(sizes)} active, {sizes.sum():.1f} KiB total, "
+                     f"{np.median(sizes):.1f} KiB median, {sizes.max():.1f} KiB largest")
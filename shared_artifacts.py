@@ -0,0 +1,91 @@
+# Deployment mode for several app processes per host: the catalog, the encoded survey and the adoption model
+# are serialized once into .npz artifacts whose arrays every process maps read-only instead of loading its
+# own copy, so the OS page cache holds one copy per host however many workers run.
+#
+#   python shared_artifacts.py                                  (re)publish the artifacts of the current data
+#   FOURPAWS_SHARED_ARTIFACTS=1 streamlit run app.py --server.port 8501
+#   FOURPAWS_SHARED_ARTIFACTS=1 streamlit run app.py --server.port 8502 ...
+#
+# Artifacts are published with write_atomic, i.e. by rename: a worker keeps the version it has mapped until
+# it notices the new file on its next stat() and maps that one, without a restart.
+
+import os
+import struct
+import time
+import zipfile
+
+import numpy as np
+
+SHARED_ARTIFACTS = bool(os.environ.get('FOURPAWS_SHARED_ARTIFACTS'))
+# Fixed part of a zip local file header, before the member's name and extra field
+ZIP_HEADER_SIZE = 30
+
+
+def map_npz(path, writable=False):
+    # name -> array for every member of an .npz written by np.savez. Members are stored uncompressed, so each
+    # array is a view on the file's pages; writable maps copy-on-write, changes stay private to the process.
+    # Members that can't be mapped are read into memory, and are read-only as well unless writable.
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = read_member(archive, info, writable)
+                continue
+
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(ZIP_HEADER_SIZE)[26:30])
+            f.seek(info.header_offset + ZIP_HEADER_SIZE + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if dtype.hasobject or not shape or 0 in shape:
+                # Scalars and empty arrays can't be mapped and are tiny anyway
+                arrays[name] = read_member(archive, info, writable)
+                continue
+            mapped = np.memmap(path, dtype=dtype, mode='c' if writable else 'r', offset=f.tell(), shape=shape,
+                               order='F' if fortran_order else 'C')
+            arrays[name] = np.asarray(mapped)
+    return arrays
+
+
+def read_member(archive, info, writable):
+    array = np.load(archive.open(info))
+    array.flags.writeable = writable
+    return array
+
+
+def load_arrays(path, writable=False):
+    # Arrays of an .npz artifact: mapped in the shared deployment mode, read into process memory otherwise
+    if SHARED_ARTIFACTS:
+        return map_npz(path, writable)
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def main():
+    # Imported here: those modules read their artifacts through load_arrays
+    import adoption_model
+    import catalog_columns
+    import recommender
+
+    started = time.perf_counter()
+    path = catalog_columns.publish_columns()
+    print(f"catalog columns -> {path} ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    recommender.build_encoded_survey()
+    print(f"encoded survey  -> {recommender.encoded_survey_path(recommender.file_fingerprint(recommender.SURVEY_PATH))} "
+          f"({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    version, forest = adoption_model.load_flat_model()
+    print(f"adoption model  -> {adoption_model.flat_artifact_path(adoption_model.artifact_key())} "
+          f"({forest.nbytes / 2 ** 20:.1f} MiB, {time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
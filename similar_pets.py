@@ -0,0 +1,334 @@
+# "More like this": each pet's most similar pets of the same type, precomputed once per catalog
+# and kept current as catalog deltas arrive.
+#
+#   python similar_pets.py        precompute the lists for the current catalog into .cache/
+#
+# Pets are compared on breed, age, size, colour, coat length, characteristics and good_with:
+# every value becomes a weighted, hashed column of a sparse vector and similarity is the cosine.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from catalog import CATALOG_PATH, catalog_store, normalize
+from file_versions import file_fingerprint, write_atomic
+from shared_artifacts import load_arrays
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = '.cache'
+# Bump when the encoding, the weights or the cache layout change
+SIMILAR_VERSION = 2
+# Neighbours kept per pet
+SIMILAR_COUNT = 8
+FEATURE_WEIGHTS = {
+    'primary_breed': 3.0,
+    'age': 2.0,
+    'size': 1.5,
+    'primary_color': 1.0,
+    'coat_length': 1.0,
+    'characteristics': 0.5,
+    'good_with': 1.0,
+}
+# Hashed columns: values never seen before (from deltas) need no vocabulary rebuild
+HASH_DIM = 1 << 20
+# Upper bound on (pets in a block) x (candidate pets) similarity cells computed at once
+BLOCK_CELLS = 1 << 24
+
+
+def encode_pet(pet):
+    # (columns, weights) of the unit-length feature vector of one pet, columns sorted; empty for a removed pet
+    columns = {}
+    if pet is not None:
+        for field, weight in FEATURE_WEIGHTS.items():
+            values = pet.get(field)
+            for value in values if isinstance(values, (list, tuple)) else [values]:
+                if value is not None:
+                    column = zlib.crc32(f"{field}={normalize(value)}".encode()) % HASH_DIM
+                    columns[column] = columns.get(column, 0.0) + weight
+    columns = dict(sorted(columns.items()))
+    weights = np.array(list(columns.values()), dtype=np.float32)
+    if len(weights):
+        weights /= np.linalg.norm(weights)
+    return np.array(list(columns), dtype=np.int32), weights
+
+
+def pet_type_of(pet):
+    # Pets are only compared within their type; None for a removed pet
+    return None if pet is None else normalize(pet.get('pet_type') or '')
+
+
+def vector_fingerprint(vector, pet_type):
+    # Identifies what a row's list was computed from, so cached lists can be checked row by row
+    columns, weights = vector
+    return zlib.crc32(columns.tobytes() + weights.tobytes() + str(pet_type).encode())
+
+
+class SimilarLists:
+    # Feature vectors and neighbour lists of one catalog. Vectors are padded rows (rows x width arrays of
+    # columns and weights, weight 0 as padding), so a changed pet rewrites only its own row and any set of
+    # rows is a CSR matrix without re-encoding anything. neighbours[row] holds the rows of the most similar
+    # pets, best first, padded with -1; scores[row] their cosine similarity.
+
+    def __init__(self, vectors, types):
+        count = len(vectors)
+        width = max([len(columns) for columns, weights in vectors] + [1])
+        self.columns = np.zeros((count, width), dtype=np.int32)
+        self.weights = np.zeros((count, width), dtype=np.float32)
+        for row, (columns, weights) in enumerate(vectors):
+            self.columns[row, :len(columns)] = columns
+            self.weights[row, :len(weights)] = weights
+        self.type_codes = {}
+        self.types = np.array([self.type_code(pet_type) for pet_type in types], dtype=np.int32)
+        self.neighbours = np.full((count, SIMILAR_COUNT), -1, dtype=np.int32)
+        self.scores = np.zeros((count, SIMILAR_COUNT), dtype=np.float32)
+
+    def type_code(self, pet_type):
+        # -1 for removed pets, which are nobody's candidates
+        return -1 if pet_type is None else self.type_codes.setdefault(pet_type, len(self.type_codes))
+
+    def matrix(self, rows):
+        from scipy.sparse import csr_matrix
+        width = self.columns.shape[1]
+        return csr_matrix((self.weights[rows].ravel(), self.columns[rows].ravel(),
+                           np.arange(0, len(rows) * width + 1, width)), shape=(len(rows), HASH_DIM))
+
+    def grow(self, count):
+        missing = count - len(self.types)
+        if missing > 0:
+            self.columns = np.vstack([self.columns, np.zeros((missing, self.columns.shape[1]), dtype=np.int32)])
+            self.weights = np.vstack([self.weights, np.zeros((missing, self.weights.shape[1]), dtype=np.float32)])
+            self.types = np.concatenate([self.types, np.full(missing, -1, dtype=np.int32)])
+            self.neighbours = np.vstack([self.neighbours, np.full((missing, SIMILAR_COUNT), -1, dtype=np.int32)])
+            self.scores = np.vstack([self.scores, np.zeros((missing, SIMILAR_COUNT), dtype=np.float32)])
+
+    def compute(self, rows):
+        # Fresh top lists for the given rows, by sparse products against the pets of their type in blocks.
+        # Pets with identical vectors share one computation; removed pets get empty lists.
+        rows = np.asarray(rows, dtype=np.int32)
+        self.neighbours[rows] = -1
+        self.scores[rows] = 0
+        rows = rows[self.types[rows] >= 0]
+        for code in np.unique(self.types[rows]):
+            own = rows[self.types[rows] == code]
+            candidates = np.flatnonzero(self.types == code).astype(np.int32)
+            candidate_matrix = self.matrix(candidates).T.tocsr()
+            keys = np.hstack([self.columns[own], self.weights[own].view(np.int32)])
+            _, first, members = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+            profiles = own[first]
+            # One extra neighbour per profile: a pet drops itself from its profile's list, or else the weakest
+            count = min(SIMILAR_COUNT + 1, len(candidates))
+            top = np.empty((len(profiles), count), dtype=np.int32)
+            top_scores = np.empty((len(profiles), count), dtype=np.float32)
+            step = max(1, BLOCK_CELLS // len(candidates))
+            for start in range(0, len(profiles), step):
+                similarity = (self.matrix(profiles[start:start + step]) @ candidate_matrix).toarray()
+                best = np.argpartition(-similarity, count - 1, axis=1)[:, :count]
+                top[start:start + step] = candidates[best]
+                top_scores[start:start + step] = np.take_along_axis(similarity, best, axis=1)
+
+            top, top_scores = top[members.reshape(-1)], top_scores[members.reshape(-1)]
+            top_scores[top == own[:, None]] = -1
+            order = np.argsort(-top_scores, axis=1, kind='stable')[:, :SIMILAR_COUNT]
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            # Pets sharing no feature value are not similar
+            self.neighbours[own, :top.shape[1]] = np.where(top_scores > 0, top, -1)
+            self.scores[own, :top.shape[1]] = np.where(top_scores > 0, top_scores, 0)
+
+    def update(self, rows, vectors, types):
+        # New vectors and types (None: removed) of the given rows. Changed pets and pets that listed one are
+        # recomputed; every other pet of the same type only checks whether a changed pet now beats its weakest
+        # neighbour, from one sparse product of the changed rows against them.
+        rows = np.asarray(rows, dtype=np.int32)
+        self.grow(int(rows.max()) + 1)
+        width = max(len(columns) for columns, weights in vectors)
+        if width > self.columns.shape[1]:
+            extra = width - self.columns.shape[1]
+            self.columns = np.hstack([self.columns, np.zeros((len(self.columns), extra), dtype=np.int32)])
+            self.weights = np.hstack([self.weights, np.zeros((len(self.weights), extra), dtype=np.float32)])
+        for row, (columns, weights), pet_type in zip(rows, vectors, types):
+            self.columns[row] = 0
+            self.weights[row] = 0
+            self.columns[row, :len(columns)] = columns
+            self.weights[row, :len(weights)] = weights
+            self.types[row] = self.type_code(pet_type)
+
+        affected = np.union1d(np.flatnonzero(np.isin(self.neighbours, rows).any(axis=1)), rows).astype(np.int32)
+        self.compute(affected)
+
+        live = rows[self.types[rows] >= 0]
+        for code in np.unique(self.types[live]):
+            changed = live[self.types[live] == code]
+            others = np.setdiff1d(np.flatnonzero(self.types == code), affected).astype(np.int32)
+            if not len(others):
+                continue
+            similarity = (self.matrix(changed) @ self.matrix(others).T).toarray()
+            for row, scores in zip(changed, similarity):
+                better = scores > self.scores[others, -1]
+                for other, score in zip(others[better], scores[better]):
+                    position = np.searchsorted(-self.scores[other], -score, side='right')
+                    self.neighbours[other] = np.insert(self.neighbours[other], position, row)[:SIMILAR_COUNT]
+                    self.scores[other] = np.insert(self.scores[other], position, score)[:SIMILAR_COUNT]
+
+
+class SimilarPets:
+    # The lists of one catalog store. They are built, or loaded from the cache and brought up to date, from a
+    # snapshot of the catalog on a background thread: the store lock is only held to copy the records list,
+    # and similar() is empty until the lists are ready. Delta batches that arrive meanwhile are applied when
+    # the build is installed; afterwards each batch updates the lists incrementally.
+
+    def __init__(self, store, path=CATALOG_PATH):
+        self.store = store
+        self.path = path
+        self.lists = None
+        self.pending = set()
+        self.failed = False
+        self.builds = 0
+        self.thread = None
+        self._lock = threading.RLock()
+        with store.lock:
+            store.subscribe(self.on_catalog_change, lambda store: self.start())
+            self.start()
+
+    @property
+    def ready(self):
+        return self.lists is not None
+
+    def cache_key(self):
+        # The catalog the store was loaded from, not the deltas applied since: cached lists are checked row by row
+        parts = [SIMILAR_VERSION, self.store.source or file_fingerprint(self.path), FEATURE_WEIGHTS, SIMILAR_COUNT, HASH_DIM]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+    def cache_path(self):
+        return os.path.join(CACHE_DIR, f"similar-{self.cache_key()}.npz")
+
+    def start(self):
+        # (Re)builds the lists in the background, superseding a build still running
+        with self._lock:
+            self.lists = None
+            self.pending = set()
+            self.failed = False
+            self.builds += 1
+            self.thread = threading.Thread(target=self.build, args=(self.builds,), name='similar-pets', daemon=True)
+            self.thread.start()
+            return self.thread
+
+    def wait(self, timeout=None):
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.ready
+
+    def load(self, lists, fingerprints):
+        # Cached lists into lists; returns the rows whose vectors differ from the cached ones, or None when
+        # there is no usable cache or recomputing everything is cheaper
+        path = self.cache_path()
+        if not os.path.exists(path):
+            return None
+        arrays = load_arrays(path)
+        cached = arrays['fingerprints']
+        if len(cached) > len(fingerprints):
+            return None
+        changed = np.concatenate([np.flatnonzero(cached != fingerprints[:len(cached)]),
+                                  np.arange(len(cached), len(fingerprints))]).astype(np.int32)
+        if len(changed) > len(fingerprints) // 2:
+            return None
+        lists.neighbours[:len(cached)] = arrays['neighbours']
+        lists.scores[:len(cached)] = arrays['scores']
+        return changed
+
+    def save(self, lists, fingerprints):
+        write_atomic(self.cache_path(), lambda f: np.savez(f, neighbours=lists.neighbours, scores=lists.scores,
+                                                           fingerprints=fingerprints))
+
+    def build(self, build):
+        try:
+            with self.store.lock:
+                records = list(self.store.records)
+            vectors = [encode_pet(record) for record in records]
+            types = [pet_type_of(record) for record in records]
+            fingerprints = np.array([vector_fingerprint(vector, pet_type) for vector, pet_type in zip(vectors, types)],
+                                    dtype=np.uint32)
+            lists = SimilarLists(vectors, types)
+            changed = self.load(lists, fingerprints)
+            if changed is None:
+                lists.compute(np.arange(len(records), dtype=np.int32))
+            elif len(changed):
+                lists.update(changed, [vectors[row] for row in changed], [types[row] for row in changed])
+            if changed is None or len(changed):
+                self.save(lists, fingerprints)
+        except Exception:
+            logger.exception("Building the similar pets lists failed, retrying with the next catalog change")
+            with self._lock:
+                self.failed = build == self.builds
+            return
+
+        with self.store.lock, self._lock:
+            if build != self.builds:
+                return
+            if self.pending:
+                self.apply(lists, self.store, self.pending)
+                self.pending = set()
+            self.lists = lists
+
+    def apply(self, lists, store, rows):
+        rows = sorted(rows)
+        records = [store.records[row] for row in rows]
+        lists.update(rows, [encode_pet(record) for record in records], [pet_type_of(record) for record in records])
+
+    def on_catalog_change(self, store, changed_rows):
+        with self._lock:
+            if self.failed:
+                self.start()
+            elif self.lists is None:
+                self.pending.update(changed_rows)
+            else:
+                self.apply(self.lists, store, changed_rows)
+
+    def similar(self, row):
+        # (rows, scores) of the pets most similar to row, best first; empty while the lists are being built
+        with self._lock:
+            lists = self.lists
+            if lists is None or not 0 <= row < len(lists.neighbours):
+                return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+            neighbours = lists.neighbours[row]
+            count = int((neighbours >= 0).sum())
+            return neighbours[:count].copy(), lists.scores[row][:count].copy()
+
+    def browse_rows(self, row):
+        # The pet followed by its neighbours, as a read-only row array for st.session_state.match_rows
+        rows = np.concatenate([[row], self.similar(row)[0]]).astype(np.int32)
+        rows.flags.writeable = False
+        return rows
+
+
+_similar = []
+_similar_lock = threading.Lock()
+
+
+def similar_pets(store, path=CATALOG_PATH):
+    # Lists for the current catalog store, built in the background (see SimilarPets)
+    with _similar_lock:
+        if _similar and _similar[0].store is store:
+            return _similar[0]
+        similar = SimilarPets(store, path)
+        _similar[:] = [similar]
+        return similar
+
+
+def main():
+    started = time.perf_counter()
+    store = catalog_store()
+    similar = SimilarPets(store)
+    similar.wait()
+    print(f"Similar pets for {len(store)} pets in {time.perf_counter() - started:.1f}s -> {similar.cache_path()}")
+
+
+if __name__ == "__main__":
+    main()
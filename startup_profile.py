@@ -0,0 +1,85 @@
+# Where cold-start time goes: import cost of the app modules by package, and the first render
+# of each page in a fresh interpreter with the heavy packages it ended up loading.
+#
+#   python startup_profile.py
+#   python startup_profile.py --top 25 --json startup.json
+#
+# Every measurement runs in its own subprocess, so nothing is warm from a previous one.
+
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+
+PAGES = ["home", "about", "match", "analytics and reporting"]
+HEAVY_PACKAGES = ["numpy", "pandas", "pyarrow", "sklearn", "scipy", "matplotlib", "seaborn", "PIL", "openpyxl", "prometheus_client"]
+
+# Renders one page in Streamlit's bare mode (widgets return their defaults) and reports what it cost
+RENDER_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import functions
+imported = time.perf_counter()
+functions.display_selected_page(sys.argv[1])
+rendered = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "render_s": rendered - imported,
+    "loaded": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def import_times(module):
+    # python -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    by_package = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        by_package[name.split(".")[0]] += int(self_us)
+        total += int(self_us)
+    return total / 1e6, {package: us / 1e6 for package, us in by_package.items()}
+
+
+def first_render(page):
+    logs = subprocess.run([sys.executable, "-c", RENDER_SCRIPT, page, *HEAVY_PACKAGES],
+                          capture_output=True, text=True, check=True)
+    return json.loads(logs.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import and first-render profile of the 4Paws app.")
+    parser.add_argument("--module", default="functions", help="module to profile the imports of (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=15, help="packages to list (default: %(default)s)")
+    parser.add_argument("--json", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    total, by_package = import_times(args.module)
+    report = {
+        "module": args.module,
+        "import_s": total,
+        "import_by_package_s": dict(sorted(by_package.items(), key=lambda item: -item[1])),
+        "pages": {page: first_render(page) for page in PAGES},
+    }
+
+    print(f"import {args.module}: {total * 1000:.0f} ms")
+    for package, seconds in list(report["import_by_package_s"].items())[:args.top]:
+        print(f"  {package:<24} {seconds * 1000:8.1f} ms  {seconds / total:6.1%}")
+    print()
+    print(f"{'page':<26} {'import':>9} {'render':>9}  heavy packages loaded")
+    for page, result in report["pages"].items():
+        print(f"{page:<26} {result['import_s'] * 1000:7.0f}ms {result['render_s'] * 1000:7.0f}ms  {', '.join(result['loaded']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
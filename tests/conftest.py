@@ -0,0 +1,44 @@
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import catalog  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def pets():
+    # The bundled catalog, with its duplicated pet_ids and missing fields
+    with open(os.path.join(REPO_DIR, catalog.CATALOG_PATH)) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def catalog_dir(tmp_path, monkeypatch):
+    # Working directory with a copy of the bundled catalog; caches and deltas are written next to it
+    shutil.copyfile(os.path.join(REPO_DIR, catalog.CATALOG_PATH), tmp_path / catalog.CATALOG_PATH)
+    monkeypatch.chdir(tmp_path)
+    catalog._stores.clear()
+    yield tmp_path
+    catalog._stores.clear()
+
+
+@pytest.fixture
+def survey_dir(catalog_dir):
+    # catalog_dir with the bundled survey as well; its encoded cache is written next to it
+    import recommender
+    shutil.copyfile(os.path.join(REPO_DIR, recommender.SURVEY_PATH), catalog_dir / recommender.SURVEY_PATH)
+    recommender._encoded_surveys.clear()
+    yield catalog_dir
+    recommender._encoded_surveys.clear()
+
+
+def write_deltas(events, path=catalog.CATALOG_PATH):
+    with open(catalog.delta_path_for(path), 'a') as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+
+import adoption_model
+from adoption_model import CatalogScores, pet_features
+from catalog import CatalogStore
+
+
+class FeeForest:
+    # Scores are the adoption fee / 1000, so the tests run without training a model
+    classes = np.array([0, 1])
+
+    def predict_proba(self, features):
+        return np.column_stack([1 - features[:, 5] / 1000, features[:, 5] / 1000])
+
+
+def fake_model(monkeypatch, forest=None):
+    model = ('test', forest or FeeForest())
+    monkeypatch.setattr(adoption_model, 'load_flat_model', lambda: model)
+    monkeypatch.setattr(adoption_model, 'resident_flat_model', lambda: model)
+    monkeypatch.setattr(adoption_model, 'model_version', lambda: model[0])
+
+
+def test_pet_features_of_missing_fields():
+    assert pet_features({}) == [-1, 2, 2, 1, 1, 0, 0]
+    assert pet_features({'age': None, 'days_on_petfinder': None, 'characteristics': None, 'adoption_fee': None}) == \
+        [-1, 2, 2, 1, 1, 0, 0]
+    assert pet_features({'age': 'Senior', 'pet_type': 'Cat', 'days_on_petfinder': '>30 days',
+                         'characteristics': ['House trained'], 'adoption_fee': 50}) == [3, 3, 2, 0, 1, 50, 1]
+
+
+def test_catalog_scores_follow_deltas_with_incomplete_pets(pets, monkeypatch):
+    fake_model(monkeypatch)
+    store = CatalogStore(pets[:50])
+    scores = CatalogScores(store)
+    store.apply_events([
+        {'op': 'add', 'pet_id': 1, 'pet': {'pet_name': 'Partial'}},
+        {'op': 'add', 'pet_id': 2, 'pet': {'pet_name': 'Odd fee', 'adoption_fee': 'call us'}},
+        {'op': 'update', 'pet_id': pets[0]['pet_id'], 'pet': {'adoption_fee': 120, 'days_on_petfinder': None}},
+    ])
+    assert scores.probability(store.rows_by_pet_id[1][0]) == 0
+    assert np.isnan(scores.probability(store.rows_by_pet_id[2][0]))
+    assert scores.probability(store.rows_by_pet_id[pets[0]['pet_id']][0]) == 0.12
+    assert not store.stale_listeners
+
+
+def test_failed_prediction_is_rescored_later(pets, monkeypatch):
+    fake_model(monkeypatch)
+    store = CatalogStore(pets[:50])
+    scores = CatalogScores(store)
+
+    class BrokenForest(FeeForest):
+        def predict_proba(self, features):
+            raise RuntimeError("model unavailable")
+    with monkeypatch.context() as patch:
+        patch.setattr(adoption_model, 'resident_flat_model', lambda: ('test', BrokenForest()))
+        store.apply_events([{'op': 'update', 'pet_id': pets[0]['pet_id'], 'pet': {'adoption_fee': 300}}])
+    assert not store.stale_listeners
+    assert scores.probability(0) == 0.3
+
+
+def test_models_load_outside_the_store_lock(pets, monkeypatch):
+    fake_model(monkeypatch)
+    store = CatalogStore(pets[:50])
+    scores = CatalogScores(store)
+    loads = []
+
+    def load_flat_model():
+        # Stands in for training on a cold cache: other sessions must still get the store lock meanwhile
+        acquired = []
+
+        def lookup():
+            if store.lock.acquire(timeout=2):
+                store.lock.release()
+                acquired.append(True)
+        other = threading.Thread(target=lookup)
+        other.start()
+        other.join()
+        loads.append(acquired == [True])
+        return 'new', FeeForest()
+    monkeypatch.setattr(adoption_model, 'load_flat_model', load_flat_model)
+    monkeypatch.setattr(adoption_model, 'model_version', lambda: 'new')
+    # A delta batch doesn't load a model that isn't resident yet: its rows wait for the next lookup
+    monkeypatch.setattr(adoption_model, 'resident_flat_model', lambda: None)
+    store.apply_events([{'op': 'update', 'pet_id': pets[0]['pet_id'], 'pet': {'adoption_fee': 250}}])
+    assert not loads and np.isnan(scores.probabilities[0])
+
+    assert scores.probability(0) == 0.25
+    assert loads == [True] and scores.model_version == 'new'
@@ -0,0 +1,43 @@
+import random
+
+import catalog_columns
+import shared_artifacts
+from catalog import CATALOG_PATH, CatalogStore, read_catalog
+from catalog_columns import ColumnRecords, columns_store
+from test_catalog_deltas import random_events
+from test_catalog_index import random_criterias
+
+FACET_FIELDS = ['pet_type', 'age', 'gender', 'size', 'coat_length', 'tags']
+
+
+def assert_same_store(store, expected, pets, rng):
+    assert len(store.records) == len(expected.records)
+    for record, other in zip(store.records, expected.records):
+        assert (record and record.to_dict()) == (other and other.to_dict())
+    for pet_id in {pet['pet_id'] for pet in pets} | set(range(90000000, 90000200)):
+        assert store.rows_by_pet_id.get(pet_id) == expected.rows_by_pet_id.get(pet_id), pet_id
+    assert store.search().tolist() == expected.search().tolist()
+    for _ in range(200):
+        criterias = random_criterias(pets, rng)
+        assert store.search(**criterias).tolist() == expected.search(**criterias).tolist(), criterias
+        criterias = random_criterias(pets, rng, FACET_FIELDS, 2)
+        assert store.facet_counts(FACET_FIELDS, **criterias) == expected.facet_counts(FACET_FIELDS, **criterias), criterias
+
+
+def test_column_store_matches_a_plain_store(catalog_dir, pets, monkeypatch):
+    # The columns are mapped, as in the shared deployment mode
+    monkeypatch.setattr(shared_artifacts, 'SHARED_ARTIFACTS', True)
+    monkeypatch.setattr(catalog_columns, '_stores', {})
+    store = columns_store()
+    assert isinstance(store.records, ColumnRecords)
+    assert not store.records.columns.arrays['pet_type.codes'].flags.writeable
+    expected = CatalogStore(read_catalog(CATALOG_PATH))
+    rng = random.Random(24)
+    assert_same_store(store, expected, pets, rng)
+
+    for _ in range(3):
+        events = random_events(pets, rng, 60)
+        store.apply_events(events)
+        expected.apply_events(events)
+        assert_same_store(store, expected, pets, rng)
+    assert store.records.changed_rows()
@@ -0,0 +1,169 @@
+import json
+import os
+import random
+
+import pytest
+
+import catalog
+from catalog import FIELDS, LIST_FIELDS, CatalogStore
+from conftest import write_deltas
+from test_catalog_index import random_criterias, scan
+
+
+def complete(pet):
+    # A pet as PetRecord.to_dict returns it: every field, missing ones as None and missing lists empty
+    fields = {field: pet.get(field) or [] if field in LIST_FIELDS else pet.get(field) for field in FIELDS}
+    return dict(fields, **{key: value for key, value in pet.items() if key not in FIELDS})
+
+
+def replay(pets, events):
+    # The delta feed's semantics, applied the slow way to a list of dicts
+    pets = [complete(pet) for pet in pets]
+    for event in events:
+        rows = [row for row, pet in enumerate(pets) if pet is not None and pet['pet_id'] == event['pet_id']]
+        if event['op'] == 'remove':
+            for row in rows:
+                pets[row] = None
+            continue
+        if not rows:
+            pets.append(None)
+            rows = [len(pets) - 1]
+        for row in rows:
+            fields = complete(event['pet']) if event['op'] == 'add' or pets[row] is None else {**pets[row], **event['pet']}
+            pets[row] = dict(fields, pet_id=event['pet_id'])
+    return pets
+
+
+def random_events(pets, rng, count):
+    pet_ids = [pet['pet_id'] for pet in pets]
+    duplicated = [pet_id for pet_id in set(pet_ids) if pet_ids.count(pet_id) > 1]
+    events = []
+    for i in range(count):
+        source = pets[rng.randrange(len(pets))]
+        kind = rng.random()
+        if kind < 0.3:
+            field = rng.choice(['age', 'size', 'tags', 'characteristics', 'description', 'coat_length'])
+            events.append({'op': 'update', 'pet_id': rng.choice(pet_ids), 'pet': {field: source.get(field)}})
+        elif kind < 0.5:
+            events.append({'op': 'remove', 'pet_id': rng.choice(pet_ids)})
+        elif kind < 0.7:
+            events.append({'op': 'add', 'pet_id': rng.choice(duplicated), 'pet': dict(source)})
+        else:
+            events.append({'op': 'add', 'pet_id': 90000000 + i, 'pet': dict(source)})
+    return events
+
+
+def assert_store_equals(store, expected):
+    assert len(store.records) == len(expected)
+    for record, pet in zip(store.records, expected):
+        assert (record and record.to_dict()) == pet
+    rows_by_pet_id = {}
+    for row, pet in enumerate(expected):
+        if pet is not None:
+            rows_by_pet_id.setdefault(pet['pet_id'], []).append(row)
+    for pet_id, rows in rows_by_pet_id.items():
+        assert store.rows_by_pet_id.get(pet_id) == rows
+    rng = random.Random(6)
+    pets = [pet for pet in expected if pet is not None]
+    for _ in range(100):
+        criterias = random_criterias(pets, rng)
+        assert store.search(**criterias).tolist() == scan(expected, **criterias), criterias
+    assert store.search().tolist() == [row for row, pet in enumerate(expected) if pet is not None]
+
+
+def test_incremental_deltas_match_replay(pets):
+    store = CatalogStore(pets)
+    # Index every searched field up front, so the incremental posting updates are what gets checked
+    assert_store_equals(store, replay(pets, []))
+    rng = random.Random(6)
+    events = []
+    for _ in range(5):
+        batch = random_events(pets, rng, 40)
+        store.apply_events(batch)
+        events += batch
+        assert_store_equals(store, replay(pets, events))
+
+
+def test_bad_events_are_skipped_and_missing_fields_completed(pets):
+    store = CatalogStore(pets)
+    sparse = {'pet_name': 'Sparse', 'pet_type': 'Cat'}
+    changed = store.apply_events([
+        {'op': 'add', 'pet_id': 91000001, 'pet': sparse},
+        {'op': 'add', 'pet_id': 91000002, 'pet': {'tags': 'Calm'}},
+        {'op': 'update', 'pet_id': pets[0]['pet_id'], 'pet': {'description': 42}},
+        {'op': 'rename', 'pet_id': pets[0]['pet_id']},
+        {'op': 'remove'},
+        ['not', 'an', 'event'],
+        {'op': 'update', 'pet_id': pets[1]['pet_id'], 'pet': {'age': 'Senior'}},
+    ])
+    assert len(changed) == 1 + len(store.rows_by_pet_id[pets[1]['pet_id']])
+    assert store.get(91000001).to_dict() == complete(dict(sparse, pet_id=91000001))
+    assert store.get(91000002) is None
+    assert store.get(pets[0]['pet_id']).to_dict() == complete(pets[0])
+    assert store.get(pets[1]['pet_id'])['age'] == 'Senior'
+
+
+def test_failing_listener_is_rebuilt_and_others_still_notified(pets):
+    store = CatalogStore(pets)
+    seen = []
+    rebuilds = []
+    failures = [True, True, False]
+
+    def failing(store, rows):
+        raise RuntimeError("listener bug")
+
+    def rebuild(store):
+        rebuilds.append(len(store))
+        if failures.pop(0):
+            raise RuntimeError("rebuild bug")
+
+    store.subscribe(failing, rebuild)
+    store.subscribe(lambda store, rows: seen.append(rows), lambda store: None)
+
+    store.apply_events([{'op': 'remove', 'pet_id': pets[0]['pet_id']}])
+    assert seen and rebuilds == [len(store)]
+    assert rebuild in store.stale_listeners
+    # The next batch retries the rebuild instead of the incremental update
+    store.apply_events([{'op': 'remove', 'pet_id': pets[1]['pet_id']}])
+    assert len(seen) == 2 and len(rebuilds) == 2 and rebuild in store.stale_listeners
+    store.apply_events([{'op': 'remove', 'pet_id': pets[2]['pet_id']}])
+    assert len(rebuilds) == 3 and not store.stale_listeners
+
+
+def test_delta_offset_only_moves_after_the_batch_applied(catalog_dir, pets, monkeypatch):
+    store = catalog.catalog_store()
+    write_deltas([{'op': 'remove', 'pet_id': pets[0]['pet_id']}])
+
+    def broken(events):
+        raise RuntimeError("apply failed")
+    with monkeypatch.context() as patch:
+        patch.setattr(store, 'apply_events', broken)
+        with pytest.raises(RuntimeError):
+            catalog.catalog_store()
+    assert store.delta_offset == 0
+
+    assert catalog.catalog_store() is store
+    assert store.get(pets[0]['pet_id']) is None and store.delta_offset > 0
+
+
+def test_rows_carry_over_to_a_reloaded_store(catalog_dir, pets):
+    store = catalog.catalog_store()
+    duplicated = next(rows for rows in store.rows_by_pet_id.values() if len(rows) > 1)
+    kept, removed = pets[5]['pet_id'], pets[7]['pet_id']
+    rows = [store.rows_by_pet_id[kept][0], store.rows_by_pet_id[removed][0], duplicated[1], len(store.records) + 3]
+
+    # The catalog file is rewritten with the pets in another order and one of them gone
+    reordered = [pet for pet in reversed(pets) if pet['pet_id'] != removed]
+    with open(catalog.CATALOG_PATH, 'w') as f:
+        json.dump(reordered, f)
+    os.utime(catalog.CATALOG_PATH, (1, 1))
+    reloaded = catalog.catalog_store()
+    assert reloaded is not store and reloaded.generation != store.generation
+
+    carried = reloaded.carry_rows(store.generation, rows).tolist()
+    assert reloaded.record(carried[0]).to_dict() == store.record(rows[0]).to_dict()
+    assert carried[1:] == [-1, reloaded.rows_by_pet_id[store.record(duplicated[1]).pet_id][1], -1]
+    assert reloaded.carry_rows(reloaded.generation, rows).tolist() == rows
+    # Rows of a store older than the one replaced can't be mapped; rows past the end resolve to nothing
+    assert reloaded.carry_rows(store.generation - 1, rows) is None
+    assert reloaded.record(len(reloaded.records)) is None and reloaded.record(-1) is None
@@ -0,0 +1,106 @@
+import random
+
+import numpy as np
+
+from catalog import CATEGORICAL_FIELDS, LIST_FIELDS, CatalogStore, SearchCache
+
+
+def scan(pets, **criterias):
+    # find_pets before the index: one pass over every pet
+    def matches(pet, key, value):
+        if value.lower() == 'any':
+            return True
+        if key not in pet:
+            return False
+        if isinstance(pet[key], (list, tuple)):
+            return value.lower() in (item.lower() for item in pet[key])
+        return str(pet[key]).lower() == str(value).lower()
+    # Removed pets (None) match nothing, not even 'Any'
+    return [row for row, pet in enumerate(pets)
+            if pet is not None and all(matches(pet, key, value) for key, value in criterias.items())]
+
+
+def random_criterias(pets, rng, fields=CATEGORICAL_FIELDS + LIST_FIELDS, count=3):
+    criterias = {}
+    for field in rng.sample(fields, count):
+        value = pets[rng.randrange(len(pets))].get(field)
+        if isinstance(value, list):
+            value = value[0] if value else 'Any'
+        # Mixed case and 'Any' both have to work
+        criterias[field] = 'Any' if value is None or rng.random() < 0.2 else rng.choice([str(value), str(value).upper()])
+    return criterias
+
+
+def test_search_matches_scan(pets):
+    store = CatalogStore(pets)
+    rng = random.Random(4)
+    for _ in range(300):
+        criterias = random_criterias(pets, rng)
+        assert store.search(**criterias).tolist() == scan(pets, **criterias), criterias
+    assert store.search(pet_type='Any').tolist() == list(range(len(pets)))
+    assert store.search(pet_type='Parrot').tolist() == []
+
+
+def test_facet_counts_match_per_option_searches(pets):
+    store = CatalogStore(pets)
+    fields = ['pet_type', 'age', 'gender', 'size', 'coat_length']
+    rng = random.Random(18)
+    for _ in range(50):
+        criterias = random_criterias(pets, rng, fields, 2)
+        counts = store.facet_counts(fields, **criterias)
+        for field in fields:
+            others = {key: value for key, value in criterias.items() if key != field}
+            assert counts[field]['any'] == len(scan(pets, **others))
+            for value, count in counts[field].items():
+                if value != 'any':
+                    assert count == len(scan(pets, **dict(others, **{field: value}))), (field, value, criterias)
+            # Every option with matching pets is listed
+            values = {str(pets[row].get(field)).lower() for row in scan(pets, **others)}
+            assert set(counts[field]) - {'any'} == values
+
+
+def test_search_results_are_shared_read_only(pets):
+    store = CatalogStore(pets)
+    rows = store.search(pet_type='Cat')
+    assert rows is store.search(pet_type='cat')
+    assert not rows.flags.writeable
+    assert rows.dtype == np.int32
+
+
+def test_search_cache_evicts_the_least_recently_used():
+    cache = SearchCache(capacity=3)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert cache.get('a') == 'A'
+    cache.put('d', 'D')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['A', 'C', 'D']
+    cache.put('a', 'A2')
+    cache.put('e', 'E')
+    assert list(cache.entries) == ['d', 'a', 'e']
+    assert cache.stats() == {"entries": 3, "capacity": 3, "hits": 4, "misses": 1, "hit_rate": 0.8,
+                             "evictions": 2, "invalidations": 0}
+
+
+def test_search_cache_is_cleared_by_delta_batches(pets):
+    store = CatalogStore(pets)
+    cats = store.search(pet_type='Cat')
+    counts = store.facet_counts(['age'], pet_type='Cat')
+    assert store.search(pet_type='Cat') is cats and store.facet_counts(['age'], pet_type='Cat') is counts
+    stats = store.search_cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 2, 2)
+
+    # A batch that changes nothing keeps the cache
+    store.apply_events([{'op': 'remove', 'pet_id': 1}])
+    assert store.search(pet_type='Cat') is cats and store.search_cache.stats()["invalidations"] == 0
+
+    row = int(cats[0])
+    store.apply_events([{'op': 'update', 'pet_id': pets[row]['pet_id'], 'pet': {'pet_type': 'Dog'}}])
+    stats = store.search_cache.stats()
+    assert stats["invalidations"] == 1 and stats["entries"] == 0
+    current = [record and record.to_dict() for record in store.records]
+    assert row not in store.search(pet_type='Cat')
+    assert store.search(pet_type='Cat').tolist() == scan(current, pet_type='Cat')
+    counts = store.facet_counts(['age'], pet_type='Cat')['age']
+    assert counts['any'] == len(scan(current, pet_type='Cat'))
+    assert counts[pets[row]['age'].lower()] == len(scan(current, pet_type='Cat', age=pets[row]['age']))
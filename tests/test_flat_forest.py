@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from adoption_model import TRAINING_DATA_PATH, encode_pets, train_adoption_model
+from conftest import REPO_DIR
+from flat_forest import FlatForest
+
+
+@pytest.fixture(scope="module")
+def model():
+    return train_adoption_model(os.path.join(REPO_DIR, TRAINING_DATA_PATH))
+
+
+def random_rows(pets, rng, count):
+    # Every feature drawn from a bit beyond the range the catalog covers, including thresholds' neighbourhoods
+    features = encode_pets(pets)
+    low, high = features.min(axis=0) - 1, features.max(axis=0) + 1
+    rows = rng.uniform(low, high, size=(count, features.shape[1]))
+    rows[:count // 2] = np.round(rows[:count // 2])
+    return rows
+
+
+def test_flat_forest_matches_sklearn(model, pets):
+    forest = FlatForest.from_sklearn(model)
+    rng = np.random.default_rng(8)
+    for X in (encode_pets(pets), random_rows(pets, rng, 5000)):
+        expected = model.predict_proba(pd.DataFrame(X, columns=model.feature_names_in_))
+        np.testing.assert_allclose(forest.predict_proba(X), expected, rtol=0, atol=1e-7)
+        # The same once written out and loaded back as arrays
+        loaded = FlatForest.from_arrays(forest.arrays())
+        np.testing.assert_allclose(loaded.predict_proba(X), expected, rtol=0, atol=1e-7)
+    assert list(forest.classes) == list(model.classes_)
@@ -0,0 +1,24 @@
+import matching
+from catalog import CatalogStore
+from matching import match_pets
+
+ADOPTER = {'age': 29, 'gender': 'Female', 'living': 'Apartment', 'activity': 7.0, 'experience': 'Experienced', 'type': 'Cat',
+           'gender_pet': 'Any', 'size_pet': 'Any', 'age_pet': 'Young', 'vaccine_pet': "Yes, i'm ready to take only vaccinated pet",
+           'allergies_pet': 'No', 'shelter_time': 1, 'special_needs?': 'No'}
+
+
+def test_partially_added_pets_are_matched(survey_dir, pets):
+    store = CatalogStore(pets)
+    match_pets(store, ADOPTER)
+    matcher = matching._matchers[0]
+    store.apply_events([{'op': 'add', 'pet_id': 1, 'pet': {'pet_name': 'X', 'pet_type': 'Cat'}},
+                        {'op': 'add', 'pet_id': 2, 'pet': {'pet_name': 'Y'}}])
+    assert not store.stale_listeners
+    rows = store.rows_by_pet_id[1] + store.rows_by_pet_id[2]
+    assert all(matcher.row_points[row] >= 0 for row in rows)
+
+    # A matcher built from scratch for a catalog that already holds them
+    matching._matchers.clear()
+    matches = match_pets(store, ADOPTER, k=len(store), pet_type='Cat')
+    assert rows[0] in [row for row, score in matches]
+    assert matching._matchers[0].row_points[rows[1]] >= 0
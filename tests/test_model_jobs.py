@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+import pytest
+
+import model_jobs
+import recommender
+from model_jobs import owners_key, submit, submit_pet
+
+
+@pytest.fixture(autouse=True)
+def results():
+    model_jobs._results.clear()
+    yield model_jobs._results
+    model_jobs._results.clear()
+
+
+def test_requests_for_the_same_key_share_one_call():
+    calls = []
+    release = threading.Event()
+
+    def job(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    first = submit(('test', 1), job, 21)
+    assert submit(('test', 1), job, 21) is first
+    release.set()
+    assert first.result(5) == 42
+    assert submit(('test', 1), job, 21) is first and calls == [21]
+    assert submit(('test', 2), job, 1).result(5) == 2 and calls == [21, 1]
+
+
+def test_failed_jobs_are_forgotten_and_resubmitted():
+    outcomes = [RuntimeError("model unavailable"), 0.5]
+
+    def job():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    failed = submit(('test', 'flaky'), job)
+    with pytest.raises(RuntimeError):
+        failed.result(5)
+    # Done callbacks run right after the result is set
+    deadline = time.monotonic() + 5
+    while ('test', 'flaky') in model_jobs._results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ('test', 'flaky') not in model_jobs._results
+    retried = submit(('test', 'flaky'), job)
+    assert retried is not failed and retried.result(5) == 0.5
+    assert submit(('test', 'flaky'), job) is retried
+
+
+def test_owners_key_changes_with_the_survey(survey_dir, pets):
+    key = owners_key(pets[0])
+    assert owners_key(pets[0]) == key
+    stat = os.stat(recommender.SURVEY_PATH)
+    os.utime(recommender.SURVEY_PATH, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert owners_key(pets[0]) != key
+
+
+def test_keys_of_partial_pets_and_key_failures():
+    # A pet added by a partial delta has its missing fields as None
+    assert owners_key({'pet_id': 1, 'pet_name': 'X', 'pet_type': 'Cat', 'days_on_petfinder': None, 'characteristics': None})
+
+    def broken_key(pet):
+        raise TypeError("bad pet")
+    future = submit_pet(broken_key, lambda pet: 1, {'pet_id': 1})
+    assert future.done() and isinstance(future.exception(), TypeError)
+    assert not model_jobs._results
@@ -0,0 +1,60 @@
+import random
+
+import pet_db
+from pet_db import PetDatabase, database_store
+from test_catalog_deltas import complete, random_events
+from test_catalog_index import random_criterias, scan
+
+
+def assert_store_equals_database(store, db):
+    catalog_id, seq, rows = db.snapshot()
+    pets = [complete(pet) for row, pet in rows]
+    # Live store rows in order are the database's rows in catalog_row order
+    assert [record.to_dict() for record in store.records if record is not None] == pets
+    live = {row: position for position, row in enumerate(row for row, record in enumerate(store.records) if record is not None)}
+    for pet_id in {pet['pet_id'] for pet in pets}:
+        assert [live[row] for row in store.rows_by_pet_id.get(pet_id)] == \
+            [position for position, pet in enumerate(pets) if pet['pet_id'] == pet_id]
+    rng = random.Random(21)
+    for _ in range(50):
+        criterias = random_criterias(pets, rng)
+        assert [live[row] for row in store.search(**criterias).tolist()] == scan(pets, **criterias), criterias
+
+
+def test_database_store_follows_the_change_log(catalog_dir, pets, monkeypatch):
+    monkeypatch.setattr(pet_db, '_stores', {})
+    db = PetDatabase(str(catalog_dir / 'pets.db'))
+    db.import_json()
+    monkeypatch.setitem(pet_db._databases, db.path, db)
+    store = database_store(db.path)
+    assert_store_equals_database(store, db)
+
+    rng = random.Random(21)
+    for _ in range(4):
+        for event in random_events(pets, rng, 30):
+            db.apply_events([event])
+        assert database_store(db.path) is store
+        assert_store_equals_database(store, db)
+
+
+def test_updates_of_duplicated_pet_ids_keep_each_row(catalog_dir, pets, monkeypatch):
+    monkeypatch.setattr(pet_db, '_stores', {})
+    db = PetDatabase(str(catalog_dir / 'pets.db'))
+    db.import_json()
+    monkeypatch.setitem(pet_db._databases, db.path, db)
+    store = database_store(db.path)
+    pet_ids = [pet['pet_id'] for pet in pets]
+    duplicated = next(pet_id for pet_id in pet_ids if pet_ids.count(pet_id) > 1)
+    names = [store.record(row)['pet_name'] for row in store.rows_by_pet_id[duplicated]]
+
+    db.apply_events([{'op': 'update', 'pet_id': duplicated, 'pet': {'age': 'Senior'}}])
+    database_store(db.path)
+    records = [store.record(row) for row in store.rows_by_pet_id[duplicated]]
+    assert [record['pet_name'] for record in records] == names
+    assert all(record['age'] == 'Senior' for record in records)
+
+    # Removed and added again: one new row at the end, like in the table
+    db.apply_events([{'op': 'remove', 'pet_id': duplicated}, {'op': 'add', 'pet_id': duplicated, 'pet': {'pet_name': 'Back'}}])
+    database_store(db.path)
+    assert store.rows_by_pet_id[duplicated] == [len(store.records) - 1]
+    assert_store_equals_database(store, db)
@@ -0,0 +1,33 @@
+import logging
+
+import pet_images
+
+
+def test_failed_urls_are_skipped_until_their_ttl_and_warned_once(tmp_path, monkeypatch, caplog):
+    # An empty local mirror: every fetch fails
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pet_images, 'IMAGE_MIRROR', str(tmp_path))
+    monkeypatch.setattr(pet_images, '_failed', pet_images.OrderedDict())
+    monkeypatch.setattr(pet_images, 'FAILED_LIMIT', 2)
+    url = 'https://example.org/photos/1.jpg'
+    submitted = []
+    monkeypatch.setattr(pet_images._executor, 'submit', lambda fn, url: submitted.append(url))
+
+    with caplog.at_level(logging.DEBUG, logger='pet_images'):
+        pet_images.process(url)
+        pet_images.prefetch([url])
+        assert submitted == []
+
+        monkeypatch.setattr(pet_images, 'FAILED_TTL', -1)
+        pet_images.process(url)
+        pet_images.prefetch([url])
+        assert submitted == [url]
+
+    warnings = [record for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1 and warnings[0].exc_info is None
+    assert pet_images._failed[url][1] == 2
+
+    # Bounded: the oldest failures are forgotten first
+    pet_images.process('https://example.org/photos/2.jpg')
+    pet_images.process('https://example.org/photos/3.jpg')
+    assert list(pet_images._failed) == ['https://example.org/photos/2.jpg', 'https://example.org/photos/3.jpg']
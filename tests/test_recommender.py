@@ -0,0 +1,56 @@
+import numpy as np
+
+from recommender import SIMILARITY_FEATURES, load_data, owner_profiles, pet_vectors, recommend_owners, \
+    similarity_kernel, survey_arrays, transform_data_pets
+
+SAMPLE_ROWS = [0, 1, 17, 250, 600, 1100]
+
+
+def original_similarities(data, new_pet):
+    # The per-row loop recommend_owners replaced, as it was
+    def compare_new_pet_with_pet_in_database(row, new_pet):
+        distance = np.sqrt(
+            (new_pet['age_pet'] - row['age_pet'])**2 +
+            (new_pet['vaccine_pet'] - row['vaccine_pet'])**2 +
+            (new_pet['allergies_pet'] - row['allergies_pet'])**2 +
+            (new_pet['shelter_time'] - row['shelter_time'])**2 +
+            (new_pet['special_needs?'] - row['special_needs?'])**2 +
+            (new_pet['dog'] - row['dog'])**2 +
+            (new_pet['cat'] - row['cat'])**2 +
+            (new_pet['pet_male'] - row['pet_male'])**2 +
+            (new_pet['pet_female'] - row['pet_female'])**2
+        )
+        similarity = 1 / (distance + 1)
+        return similarity**2
+    return data[SIMILARITY_FEATURES].apply(lambda x: compare_new_pet_with_pet_in_database(x, new_pet), axis=1)
+
+
+def original_averages(data, similarities):
+    return {feature: (data[feature] * similarities).sum() / similarities.sum()
+            for feature in ['age', 'gender', 'living', 'activity', 'experience', 'shelter_time', 'special_needs?']}
+
+
+def test_vectorized_recommendations_match_the_per_row_loop(survey_dir, pets):
+    data = load_data()
+    sample = [pets[row] for row in SAMPLE_ROWS]
+    pet_matrix, owner_columns = survey_arrays(data)
+    similarities = similarity_kernel(pet_matrix, pet_vectors(sample))
+    profiles = recommend_owners(sample)
+    assert profiles == owner_profiles(pet_vectors(sample), data)
+
+    for pet, scores, profile in zip(sample, similarities, profiles):
+        expected = original_similarities(data, transform_data_pets(pet)).to_numpy()
+        np.testing.assert_array_equal(scores, expected)
+        assert np.argsort(-scores, kind='stable').tolist() == np.argsort(-expected, kind='stable').tolist()
+
+        averages = original_averages(data, expected)
+        assert profile['recommended_owner_age'] == averages['age'] * (52 - 19) + 19
+        assert profile['recommended_activity'] == averages['activity'] * 8 + 1
+        assert profile['recommended_gender'] == ('Female' if averages['gender'] >= 0.5 else 'Male')
+        assert profile['recommended_living conditions'] == \
+            ('House or Apartment with garden' if averages['living'] >= 0.5 else 'Apartment')
+        assert profile['recommended_experience with pets'] == \
+            ('First-time owner' if averages['experience'] >= 0.5 else 'Experienced')
+        concern = averages['shelter_time']
+        assert profile['recommended_concerns about time in shelter'] == \
+            ('Not concerned' if concern < 0.5 else 'Slightly concerned' if concern < 0.75 else 'Extremely concerned')
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+tornado_testing = pytest.importorskip("tornado.testing")
+
+import scoring_service  # noqa: E402
+from catalog import CATALOG_PATH, read_catalog  # noqa: E402
+from conftest import REPO_DIR  # noqa: E402
+
+
+class ScoringServiceTest(tornado_testing.AsyncHTTPTestCase):
+    # The batchers score with stand-in functions, so only the request handling is under test
+
+    def get_app(self):
+        app, self.batchers = scoring_service.make_app(max_wait=0)
+        self.adoption, self.owners = self.batchers
+        self.adoption.score = lambda rows: [float(row[5]) for row in rows]
+        self.owners.score = lambda rows: [{"rows": len(rows)} for row in rows]
+        for batcher in self.batchers:
+            asyncio.get_event_loop().create_task(batcher.run())
+        return app
+
+    def post(self, path, body):
+        response = self.fetch(path, method="POST", body=body if isinstance(body, str) else json.dumps(body),
+                              raise_error=False)
+        return response.code, json.loads(response.body)
+
+    def test_single_and_plural_keys(self):
+        assert self.post("/predict/adoption", {"pet": {"adoption_fee": 50}}) == (200, {"probability": 50.0})
+        assert self.post("/predict/adoption", {"pets": [{"adoption_fee": 1}, {}]}) == (200, {"probabilities": [1.0, 0.0]})
+        assert self.post("/predict/adoption", {"pets": []}) == (200, {"probabilities": []})
+        code, body = self.post("/recommend/owners", {"pets": read_catalog(os.path.join(REPO_DIR, CATALOG_PATH))[:2]})
+        assert code == 200 and body == {"profiles": [{"rows": 2}, {"rows": 2}]}
+
+    def test_invalid_pets_are_rejected_before_batching(self):
+        for body in ['not json', {"pets": "x"}, {"pets": [1]}, {"pet": {"adoption_fee": "call us"}},
+                     {"pet": {"adoption_fee": float("nan")}}, {"nothing": 1}]:
+            code, response = self.post("/predict/adoption", body)
+            assert code == 400, body
+        assert self.adoption.batches == 0 and self.adoption.rows == 0
+
+    def test_failed_batches_count_as_errors(self):
+        def broken(rows):
+            raise RuntimeError("model unavailable")
+        self.adoption.score = broken
+        code, body = self.post("/predict/adoption", {"pet": {}})
+        assert code == 500 and "model unavailable" in body["error"]
+        stats = self.adoption.stats()
+        assert stats["errors"] == 1 and stats["failed_batches"] == 1 and stats["latency_ms"]["window"] == 1
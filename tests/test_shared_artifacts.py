@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from shared_artifacts import map_npz
+
+ARRAYS = {
+    'ints': np.arange(24, dtype=np.int32).reshape(4, 6),
+    'fortran': np.asfortranarray(np.random.default_rng(2).random((5, 3))),
+    'strings': np.array(['cat', 'dog', 'good_with_child']),
+    'flags': np.array([True, False, True]),
+    'scalar': np.array(7),
+    'empty': np.empty((0, 3), dtype=np.float32),
+}
+
+
+@pytest.mark.parametrize('save', [np.savez, np.savez_compressed])
+def test_mapped_arrays_equal_np_load_and_are_read_only(tmp_path, save):
+    path = tmp_path / 'arrays.npz'
+    save(path, **ARRAYS)
+    mapped = map_npz(str(path))
+    with np.load(path) as loaded:
+        assert sorted(mapped) == sorted(loaded.files)
+        for name in loaded.files:
+            assert mapped[name].dtype == loaded[name].dtype and mapped[name].shape == loaded[name].shape
+            np.testing.assert_array_equal(mapped[name], loaded[name])
+    for name, array in mapped.items():
+        assert not array.flags.writeable, name
+        with pytest.raises(ValueError):
+            array[...] = 0
+
+
+def test_writable_maps_are_private_copies(tmp_path):
+    path = tmp_path / 'arrays.npz'
+    np.savez(path, **ARRAYS)
+    mapped = map_npz(str(path), writable=True)
+    mapped['ints'][0, 0] = 99
+    assert map_npz(str(path))['ints'][0, 0] == 0
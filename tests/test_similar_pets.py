@@ -0,0 +1,99 @@
+import random
+import threading
+
+import numpy as np
+
+import catalog
+from catalog import CatalogStore
+from conftest import write_deltas
+from similar_pets import SIMILAR_COUNT, SimilarLists, SimilarPets, encode_pet, pet_type_of
+from test_catalog_deltas import random_events
+
+
+def rebuilt(store):
+    # The lists computed from scratch for the store's current records
+    records = list(store.records)
+    lists = SimilarLists([encode_pet(record) for record in records], [pet_type_of(record) for record in records])
+    lists.compute(np.arange(len(records)))
+    return lists
+
+
+def assert_exact(similar, store):
+    # Every list holds the best-scoring pets of the same type by brute-force cosine, ties in any order
+    records = list(store.records)
+    vectors = [encode_pet(record) for record in records]
+    types = np.array([str(pet_type_of(record)) for record in records])
+    used = np.unique(np.concatenate([columns for columns, weights in vectors]))
+    dense = np.zeros((len(records), len(used)))
+    for row, (columns, weights) in enumerate(vectors):
+        dense[row, np.searchsorted(used, columns)] = weights
+    similarity = dense @ dense.T
+
+    reference = rebuilt(store)
+    for row, record in enumerate(records):
+        neighbours, scores = similar.similar(row)
+        if record is None:
+            assert len(neighbours) == 0
+            continue
+        others = (types == types[row]) & (similarity[row] > 0) & (np.arange(len(records)) != row)
+        expected = np.sort(similarity[row][others])[::-1][:SIMILAR_COUNT]
+        assert np.allclose(scores, expected, atol=1e-5), row
+        assert np.allclose(similarity[row, neighbours], scores, atol=1e-5), row
+        assert row not in neighbours and len(set(neighbours.tolist())) == len(neighbours)
+        assert np.allclose(scores, reference.scores[row][:len(scores)], atol=1e-5)
+
+
+def test_full_build_matches_brute_force(catalog_dir, pets):
+    store = CatalogStore(pets)
+    similar = SimilarPets(store)
+    assert similar.wait(60)
+    assert_exact(similar, store)
+
+
+def test_incremental_lists_match_a_rebuild(catalog_dir, pets):
+    store = CatalogStore(pets)
+    similar = SimilarPets(store)
+    assert similar.wait(60)
+    rng = random.Random(20)
+    for _ in range(4):
+        store.apply_events(random_events(pets, rng, 25))
+        assert_exact(similar, store)
+
+
+def test_cached_lists_survive_deltas_and_catch_up(catalog_dir, pets, monkeypatch):
+    store = catalog.catalog_store()
+    first = SimilarPets(store)
+    assert first.wait(60)
+    cache_path = first.cache_path()
+
+    # A restart with deltas in the feed: same cache file, only the changed rows are recomputed
+    write_deltas(random_events(pets, random.Random(21), 30))
+    catalog._stores.clear()
+    store = catalog.catalog_store()
+    assert store.delta_offset > 0
+    computed = []
+    compute = SimilarLists.compute
+    monkeypatch.setattr(SimilarLists, 'compute', lambda lists, rows: computed.append(len(rows)) or compute(lists, rows))
+    second = SimilarPets(store)
+    assert second.wait(60)
+    assert second.cache_path() == cache_path
+    assert computed and max(computed) < len(pets) // 2
+    assert_exact(second, store)
+
+
+def test_lists_build_outside_the_store_lock(catalog_dir, pets, monkeypatch):
+    release = threading.Event()
+    compute = SimilarLists.compute
+
+    def slow_compute(lists, rows):
+        assert release.wait(60)
+        compute(lists, rows)
+    monkeypatch.setattr(SimilarLists, 'compute', slow_compute)
+    store = CatalogStore(pets)
+    similar = SimilarPets(store)
+    assert not similar.ready and len(similar.similar(0)[0]) == 0
+    # Deltas go through while the lists are building and are applied once they are in
+    store.apply_events(random_events(pets, random.Random(22), 10))
+    release.set()
+    assert similar.wait(60)
+    assert_exact(similar, store)
@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+
+import catalog
+import text_search
+from catalog import CatalogStore
+from conftest import write_deltas
+from test_catalog_deltas import random_events
+from text_search import TextIndex, tokenize
+
+QUERIES = ["calm senior cat good with kids", "playful puppy", "house trained", "zebra striped", "dog"]
+
+
+def rebuilt(store, directory, monkeypatch):
+    # An index built from scratch for the store's current records
+    with monkeypatch.context() as patch:
+        patch.setattr(text_search, 'CACHE_DIR', str(directory))
+        return TextIndex(store)
+
+
+def assert_matches(index, reference, pets, rng):
+    words = [word for pet in rng.sample(pets, 20) for word in (pet.get('description') or '').split()[:3]]
+    queries = QUERIES + [' '.join(rng.sample(words, 3)) for _ in range(20)]
+    for query in queries:
+        terms = list(dict.fromkeys(tokenize(query)))
+        expected = reference.scores(terms)
+        assert np.allclose(index.scores(terms), expected, rtol=1e-5, atol=1e-6), query
+        # Same best scores, in order; rows with equal scores may come in either order
+        result = index.search(query, 10)
+        assert np.allclose(expected[result], np.sort(expected)[::-1][:len(result)], rtol=1e-5), query
+        assert len(result) == min(10, np.count_nonzero(expected))
+
+
+def events_with_new_terms(pets, rng, count):
+    events = random_events(pets, rng, count)
+    events.append({'op': 'update', 'pet_id': pets[3]['pet_id'], 'pet': {'description': 'A zebra striped tabby'}})
+    return events
+
+
+def test_deltas_match_a_rebuild(catalog_dir, pets, monkeypatch):
+    store = CatalogStore(pets)
+    index = TextIndex(store)
+    rng = random.Random(22)
+    for batch in range(4):
+        store.apply_events(events_with_new_terms(pets, rng, 40))
+        assert index.overlay and index.folding is None
+        assert_matches(index, rebuilt(store, catalog_dir / f"rebuild-{batch}", monkeypatch), pets, rng)
+
+
+def test_overlay_is_folded_into_a_new_base(catalog_dir, pets, monkeypatch):
+    monkeypatch.setattr(text_search, 'OVERLAY_LIMIT', 20)
+    store = CatalogStore(pets)
+    index = TextIndex(store)
+    base = index.base
+    rng = random.Random(7)
+    store.apply_events(events_with_new_terms(pets, rng, 80))
+    index.wait()
+    assert index.base is not base and not index.overlay and index.folding is None
+    assert_matches(index, rebuilt(store, catalog_dir / 'rebuild', monkeypatch), pets, rng)
+
+
+def test_cached_base_is_kept_across_deltas(catalog_dir, pets, monkeypatch):
+    store = catalog.catalog_store()
+    path = TextIndex(store).cache_path()
+    rng = random.Random(3)
+    write_deltas(events_with_new_terms(pets, rng, 40))
+    assert catalog.catalog_store() is store and store.delta_offset > 0
+
+    # A restarted index loads the cached base and moves the pets the deltas changed to its overlay
+    index = TextIndex(store)
+    assert index.cache_path() == path and index.overlay
+    assert index.base.size == len(pets)
+    assert_matches(index, rebuilt(store, catalog_dir / 'rebuild', monkeypatch), pets, rng)
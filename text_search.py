@@ -0,0 +1,403 @@
+# Free-text pet search: "calm senior cat good with kids" ranked with BM25 over an inverted index of the
+# descriptions, tags, breed labels and characteristics (plus type, age and good_with, which visitors type too).
+#
+#   python text_search.py                      build the index for the current catalog into .cache/
+#   python text_search.py "calm senior cat"    ... and print the best matches
+#
+# The index is a CSR matrix of term -> (rows, frequencies): a query weighs the postings of its terms with BM25
+# and sums them with a bincount, never a scan of the descriptions.
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+import numpy as np
+
+from catalog import CATALOG_PATH, catalog_store
+from file_versions import file_fingerprint, write_atomic
+from instrumentation import timed
+from shared_artifacts import load_arrays
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = '.cache'
+# Bump when tokenization or field weights change
+TEXT_INDEX_VERSION = 2
+# Term frequencies count this many times per occurrence in each field; short fields are the most telling
+FIELD_WEIGHTS = {
+    'description': 1.0,
+    'tags': 2.0,
+    'breeds_label': 2.0,
+    'characteristics': 2.0,
+    'pet_type': 2.0,
+    'age': 2.0,
+    'good_with': 2.0,
+}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Pets a text search returns, best first
+TEXT_RESULTS = 100
+# Changed pets the overlay holds before a new base is built in the background
+OVERLAY_LIMIT = 500
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("a an and are as at be but by for from has have he her him his i if in into is it its me my "
+                      "no not of on or our she so than that the their them then there they this to too up us was "
+                      "we were who will with you your".split())
+SYNONYMS = {'kid': 'child', 'children': 'child', 'kitty': 'kitten', 'pup': 'puppy', 'doggy': 'dog', 'elderly': 'senior'}
+# Query words naming a pet type; "cat" is in most listings, so as a ranked term it would barely count
+PET_TYPE_TERMS = {'cat': 'Cat', 'kitten': 'Cat', 'dog': 'Dog', 'puppy': 'Dog'}
+
+
+def stem(token):
+    # Plural folding is enough for pet listings: cats -> cat, puppies -> puppy, but not glass -> glas
+    if len(token) > 4 and token.endswith('ies'):
+        token = token[:-3] + 'y'
+    elif len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        token = token[:-1]
+    return SYNONYMS.get(token, token)
+
+
+def tokenize(text):
+    # "good with kids" is one term (good_with_child), so a dog that is good with cats doesn't match "cat"
+    tokens = TOKEN.findall(text.lower())
+    terms = []
+    position = 0
+    while position < len(tokens):
+        token = tokens[position]
+        if token == 'good' and tokens[position + 1:position + 2] == ['with'] and position + 2 < len(tokens):
+            terms.append(f"good_with_{stem(tokens[position + 2])}")
+            position += 3
+            continue
+        if token not in STOPWORDS:
+            terms.append(stem(token))
+        position += 1
+    return terms
+
+
+def query_criterias(query):
+    # Search criterias the query implies: the pet type, when it names exactly one
+    pet_types = {PET_TYPE_TERMS[term] for term in tokenize(query) if term in PET_TYPE_TERMS}
+    return {'pet_type': pet_types.pop()} if len(pet_types) == 1 else {}
+
+
+def field_text(pet, field):
+    value = pet.get(field)
+    if field == 'good_with' and isinstance(value, dict):
+        # {"good_with_children": true} reads as "good with children"
+        value = [key.replace('_', ' ') for key, good in value.items() if good]
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(str(item) for item in value)
+    return '' if value is None else str(value)
+
+
+def document_terms(pet):
+    # term -> weighted frequency, and the weighted length of the document
+    frequencies = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(field_text(pet, field)):
+            frequencies[term] = frequencies.get(term, 0.0) + weight
+    return frequencies, sum(frequencies.values())
+
+
+def idf(document_frequency, document_count):
+    return math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def record_fingerprint(record):
+    # Identifies the indexed text of a row, so a cached base can be checked row by row
+    if record is None:
+        return 0
+    return zlib.crc32(json.dumps([field_text(record, field) for field in FIELD_WEIGHTS]).encode())
+
+
+class TextBase:
+    # Inverted index of a catalog snapshot: term -> (rows, frequencies) as CSR, plus the term ids of every row
+    # (row -> terms), so the terms a changed pet had can be taken back out of the statistics
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.terms = {term: i for i, term in enumerate(arrays['terms'].tolist())}
+        self.offsets, self.rows, self.frequencies = arrays['offsets'], arrays['rows'], arrays['frequencies']
+        self.row_offsets, self.row_terms = arrays['row_offsets'], arrays['row_terms']
+        self.lengths, self.live, self.fingerprints = arrays['lengths'], arrays['live'], arrays['fingerprints']
+
+    @property
+    def size(self):
+        return len(self.lengths)
+
+    @classmethod
+    def from_records(cls, records):
+        # Postings are collected in row order, so a stable sort by term leaves each term's rows sorted
+        terms = {}
+        posting_terms, frequencies = array('i'), array('f')
+        counts = np.zeros(len(records), dtype=np.int64)
+        lengths = np.zeros(len(records), dtype=np.float32)
+        for row, record in enumerate(records):
+            if record is None:
+                continue
+            document, lengths[row] = document_terms(record)
+            posting_terms.extend([terms.setdefault(term, len(terms)) for term in document])
+            frequencies.extend(document.values())
+            counts[row] = len(document)
+
+        row_terms = np.frombuffer(posting_terms, dtype=np.int32)
+        order = np.argsort(row_terms, kind='stable')
+        document_frequencies = np.bincount(row_terms, minlength=len(terms))
+        return cls({
+            'terms': np.array(list(terms), dtype=str),
+            'offsets': np.concatenate([[0], np.cumsum(document_frequencies)]).astype(np.int64),
+            'rows': np.repeat(np.arange(len(records), dtype=np.int32), counts)[order],
+            'frequencies': np.frombuffer(frequencies, dtype=np.float32)[order],
+            'row_offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            'row_terms': row_terms,
+            'lengths': lengths,
+            'live': np.array([record is not None for record in records], dtype=bool),
+            'fingerprints': np.array([record_fingerprint(record) for record in records], dtype=np.uint32),
+        })
+
+
+class TextIndex:
+    # A base index of a catalog snapshot plus an overlay for the pets changed since: their base postings are
+    # masked out and their current terms sit in a small CSR of their own. Document frequencies, the document
+    # count and the total length are kept exact as pets change and BM25 is applied at query time to the
+    # postings of the query's terms, so results are those of a fresh build. Past OVERLAY_LIMIT changed pets
+    # a new base is built from a snapshot on a background thread; changes that arrive meanwhile go to its overlay.
+
+    def __init__(self, store, path=CATALOG_PATH):
+        self.store = store
+        self.path = path
+        self.builds = 0
+        self.thread = None
+        self.folding = None
+        self._lock = threading.RLock()
+        self.install(TextBase.from_records([]))
+        with store.lock, self._lock:
+            store.subscribe(self.on_catalog_change, lambda store: self.rebuild())
+            records = self.snapshot()
+        self.fold(self.builds, records, load=True)
+
+    def cache_path(self):
+        # The catalog the store was loaded from, not the deltas applied since: a cached base is checked row by row
+        parts = [TEXT_INDEX_VERSION, self.store.source or file_fingerprint(self.path), FIELD_WEIGHTS]
+        key = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(CACHE_DIR, f"text-index-{key}.npz")
+
+    def load(self, records):
+        # (cached base, rows that changed since it was built), or None when there is no usable cache
+        path = self.cache_path()
+        if not os.path.exists(path):
+            return None
+        base = TextBase(load_arrays(path))
+        if base.size > len(records):
+            return None
+        fingerprints = np.array([record_fingerprint(record) for record in records], dtype=np.uint32)
+        changed = np.concatenate([np.flatnonzero(base.fingerprints != fingerprints[:base.size]),
+                                  np.arange(base.size, len(records))])
+        if len(changed) > OVERLAY_LIMIT:
+            return None
+        return base, changed.tolist()
+
+    def save(self, base):
+        write_atomic(self.cache_path(), lambda f: np.savez(f, **base.arrays))
+
+    def snapshot(self):
+        # Called under the store lock: the records a new base is built from; changes from here on are collected
+        self.builds += 1
+        self.folding = set()
+        return list(self.store.records)
+
+    def fold(self, build, records, load=False):
+        # Builds a base from records (or loads the cached one), outside the store lock, and installs it with
+        # the rows changed since the snapshot in its overlay
+        cached = self.load(records) if load else None
+        if cached is None:
+            base, changed = TextBase.from_records(records), []
+            self.save(base)
+        else:
+            base, changed = cached
+
+        with self.store.lock, self._lock:
+            if build != self.builds:
+                return
+            changed = sorted(self.folding.union(changed))
+            self.folding = None
+            self.install(base)
+            self.apply(changed)
+
+    def start_fold(self):
+        records = self.snapshot()
+        self.thread = threading.Thread(target=self.fold_in_background, args=(self.builds, records),
+                                       name='text-index', daemon=True)
+        self.thread.start()
+
+    def fold_in_background(self, build, records):
+        try:
+            self.fold(build, records)
+        except Exception:
+            logger.exception("Building the text index failed, retrying with the next catalog change")
+            with self._lock:
+                if build == self.builds:
+                    self.folding = None
+
+    def wait(self, timeout=None):
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def rebuild(self):
+        # After a failed update the overlay can't be trusted: a new base, built in place
+        with self.store.lock, self._lock:
+            self.builds += 1
+            self.folding = None
+            self.install(TextBase.from_records(list(self.store.records)))
+            self.save(self.base)
+
+    def install(self, base):
+        with self._lock:
+            self.base = base
+            self.terms = dict(base.terms)
+            self.document_frequencies = np.diff(base.offsets)
+            self.document_count = int(base.live.sum())
+            self.total_length = float(base.lengths.sum(dtype=np.float64))
+            self.lengths = base.lengths.copy()
+            self.stale = np.zeros(base.size, dtype=bool)
+            self.overlay = {}
+            self.overlay_postings = None
+
+    def term_id(self, term):
+        term_id = self.terms.setdefault(term, len(self.terms))
+        if term_id == len(self.document_frequencies):
+            self.document_frequencies = np.concatenate([self.document_frequencies, np.zeros(term_id + 1, dtype=np.int64)])
+        return term_id
+
+    def apply(self, rows):
+        # Moves rows out of the base into the overlay with their current terms, keeping the statistics exact
+        base = self.base
+        records = self.store.records
+        if len(self.lengths) < len(records):
+            self.lengths = np.concatenate([self.lengths, np.zeros(len(records) - len(self.lengths), dtype=np.float32)])
+        for row in rows:
+            previous = self.overlay.pop(row, None)
+            if previous is None and row < base.size and base.live[row] and not self.stale[row]:
+                previous = base.row_terms[base.row_offsets[row]:base.row_offsets[row + 1]], None, base.lengths[row]
+            if previous is not None:
+                self.document_frequencies[previous[0]] -= 1
+                self.document_count -= 1
+                self.total_length -= float(previous[2])
+            if row < base.size:
+                self.stale[row] = True
+
+            record = records[row]
+            self.lengths[row] = 0
+            if record is not None:
+                document, self.lengths[row] = document_terms(record)
+                term_ids = np.array([self.term_id(term) for term in document], dtype=np.int64)
+                self.overlay[row] = term_ids, np.array(list(document.values()), dtype=np.float32), self.lengths[row]
+                self.document_frequencies[term_ids] += 1
+                self.document_count += 1
+                self.total_length += float(self.lengths[row])
+        self.overlay_postings = None
+        if len(self.overlay) > OVERLAY_LIMIT and self.folding is None:
+            self.start_fold()
+
+    def on_catalog_change(self, store, changed_rows):
+        with self._lock:
+            if self.folding is not None:
+                self.folding.update(changed_rows)
+            self.apply(changed_rows)
+
+    def postings(self):
+        # The overlay as CSR: (term ids, offsets, rows, frequencies), rebuilt on the first search after a change
+        if self.overlay_postings is None:
+            rows = sorted(self.overlay)
+            term_ids = np.concatenate([self.overlay[row][0] for row in rows] or [np.empty(0, dtype=np.int64)])
+            frequencies = np.concatenate([self.overlay[row][1] for row in rows] or [np.empty(0, dtype=np.float32)])
+            counts = [len(self.overlay[row][0]) for row in rows]
+            order = np.argsort(term_ids, kind='stable')
+            keys, starts = np.unique(term_ids[order], return_index=True)
+            self.overlay_postings = (keys, np.append(starts, len(order)),
+                                     np.repeat(np.array(rows, dtype=np.int32), counts)[order], frequencies[order])
+        return self.overlay_postings
+
+    def impact(self, frequency, length, average_length):
+        # BM25 term-frequency part; multiplied by the term's idf it is the posting's share of the score
+        return frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+
+    def scores(self, terms):
+        # BM25 score of every row: the postings of each term, base rows that changed left out, then the overlay's
+        with self._lock:
+            base = self.base
+            keys, offsets, overlay_rows, overlay_frequencies = self.postings()
+            document_count = max(self.document_count, 1)
+            average_length = self.total_length / document_count or 1.0
+            rows, impacts = [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=np.float32)]
+            for term in terms:
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    continue
+                term_idf = idf(self.document_frequencies[term_id], document_count)
+                if term_id < len(base.offsets) - 1:
+                    start, end = base.offsets[term_id], base.offsets[term_id + 1]
+                    current = ~self.stale[base.rows[start:end]]
+                    rows.append(base.rows[start:end][current])
+                    impacts.append(term_idf * self.impact(base.frequencies[start:end][current], self.lengths[rows[-1]], average_length))
+                position = np.searchsorted(keys, term_id)
+                if position < len(keys) and keys[position] == term_id:
+                    start, end = offsets[position], offsets[position + 1]
+                    rows.append(overlay_rows[start:end])
+                    impacts.append(term_idf * self.impact(overlay_frequencies[start:end], self.lengths[rows[-1]], average_length))
+            return np.bincount(np.concatenate(rows), np.concatenate(impacts), minlength=len(self.lengths))
+
+    @timed('text_search')
+    def search(self, query, k=TEXT_RESULTS, allowed=None):
+        # Read-only int32 rows of the k best matches, best first; allowed limits them to a sorted row array.
+        # Equal scores keep catalog order.
+        scores = self.scores(list(dict.fromkeys(tokenize(query))))
+        if allowed is None:
+            candidates = np.flatnonzero(scores)
+        else:
+            allowed = allowed[allowed < len(scores)]
+            candidates = allowed[scores[allowed] > 0]
+        if len(candidates) > k:
+            candidates = np.sort(candidates[np.argpartition(-scores[candidates], k - 1)[:k]])
+        result = candidates[np.argsort(-scores[candidates], kind='stable')].astype(np.int32)
+        result.flags.writeable = False
+        return result
+
+
+_text_indexes = []
+_text_indexes_lock = threading.Lock()
+
+
+def text_index(store, path=CATALOG_PATH):
+    # Index for the current catalog store, loaded from .cache/ when it was built for the same catalog
+    with _text_indexes_lock:
+        if _text_indexes and _text_indexes[0].store is store:
+            return _text_indexes[0]
+        index = TextIndex(store, path)
+        _text_indexes[:] = [index]
+        return index
+
+
+def main():
+    started = time.perf_counter()
+    store = catalog_store()
+    index = TextIndex(store)
+    print(f"Text index of {len(store)} pets, {len(index.terms)} terms in {time.perf_counter() - started:.1f}s -> {index.cache_path()}")
+    if len(sys.argv) > 1:
+        for row in index.search(' '.join(sys.argv[1:]), 10):
+            pet = store.record(row)
+            print(f"  {pet['pet_name']}: {pet['pet_type']}, {pet['age']}, {pet['breeds_label']}")
+
+
+if __name__ == "__main__":
+    main()
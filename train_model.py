@@ -0,0 +1,103 @@
+# Offline training for the adoption model: cross-validated hyperparameter search on all cores,
+# holdout report, and a published artifact that running apps pick up on their next prediction.
+#
+#   python train_model.py --folds 5 --iterations 30
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+from sklearn.calibration import calibration_curve
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, brier_score_loss, log_loss, roc_auc_score
+from sklearn.model_selection import RandomizedSearchCV, StratifiedKFold
+
+from adoption_model import (FEATURE_SPEC, TRAINING_DATA_PATH, artifact_key, prepare_training_data, publish_model,
+                            split_training_data)
+
+
+PARAM_GRID = {
+    "n_estimators": [100, 200, 400],
+    "max_depth": [None, 6, 10, 16],
+    "min_samples_leaf": [1, 2, 5, 10],
+    "max_features": ["sqrt", "log2", None],
+    "class_weight": [None, "balanced"],
+}
+
+
+def expected_calibration_error(y_true, probabilities, bins):
+    edges = np.linspace(0, 1, bins + 1)
+    bucket = np.clip(np.digitize(probabilities, edges[1:-1]), 0, bins - 1)
+    error = 0.0
+    for b in range(bins):
+        in_bucket = bucket == b
+        if in_bucket.any():
+            error += in_bucket.mean() * abs(y_true[in_bucket].mean() - probabilities[in_bucket].mean())
+    return error
+
+
+def holdout_report(model, X_test, y_test, bins=10):
+    probabilities = model.predict_proba(X_test)[:, list(model.classes_).index(1)]
+    y_true = np.asarray(y_test)
+    fraction_positive, mean_predicted = calibration_curve(y_true, probabilities, n_bins=bins)
+    return {
+        "rows": int(len(y_true)),
+        "accuracy": float(accuracy_score(y_true, probabilities >= 0.5)),
+        "roc_auc": float(roc_auc_score(y_true, probabilities)),
+        "brier_score": float(brier_score_loss(y_true, probabilities)),
+        "log_loss": float(log_loss(y_true, probabilities, labels=[0, 1])),
+        "expected_calibration_error": float(expected_calibration_error(y_true, probabilities, bins)),
+        "calibration_curve": {
+            "mean_predicted": [float(v) for v in mean_predicted],
+            "fraction_positive": [float(v) for v in fraction_positive],
+        },
+    }
+
+
+def train(csv_path=TRAINING_DATA_PATH, folds=5, iterations=30, jobs=-1, seed=42, publish=True):
+    X, y = prepare_training_data(pd.read_csv(csv_path), FEATURE_SPEC)
+    X_train, X_test, y_train, y_test = split_training_data(X, y, FEATURE_SPEC)
+
+    search = RandomizedSearchCV(
+        RandomForestClassifier(random_state=seed),
+        PARAM_GRID,
+        n_iter=iterations,
+        scoring="neg_log_loss",
+        cv=StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed),
+        n_jobs=jobs,
+        random_state=seed,
+        refit=True,
+    )
+    search.fit(X_train, y_train)
+
+    model = search.best_estimator_
+    params = dict(search.best_params_, random_state=seed)
+    report = {
+        "key": artifact_key(csv_path, FEATURE_SPEC),
+        "training_rows": int(len(X_train)),
+        "params": params,
+        "cv_log_loss": float(-search.best_score_),
+        "holdout": holdout_report(model, X_test, y_test),
+    }
+    if publish:
+        publish_model(model, report["key"], FEATURE_SPEC, params=params, metrics=report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and publish the 4Paws adoption model.")
+    parser.add_argument("--data", default=TRAINING_DATA_PATH, help="training CSV (default: %(default)s)")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds (default: %(default)s)")
+    parser.add_argument("--iterations", type=int, default=30, help="hyperparameter candidates to try (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=-1, help="parallel workers, -1 for all cores (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dry-run", action="store_true", help="report scores without publishing the model")
+    args = parser.parse_args()
+
+    report = train(args.data, args.folds, args.iterations, args.jobs, args.seed, publish=not args.dry_run)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()